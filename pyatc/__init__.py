@@ -28,6 +28,9 @@ eps = 0.01     # Amount to jitter perfectly perpendicular vectors
 
 DEBUG = False
 
+from . import cache
+from . import manifest
+from . import sky
 from . import util
 from . import performance
 from . import task
@@ -42,6 +45,8 @@ from . import parse
 from . import anim
 from . import cometa
 from . import cometa_params
+from . import stream
+from . import executors
 from . import runners
 from . import test
 
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This file is part of pyatc library
+#
+# Authors:
+# Jorge Ibáñez Gijón <jorge.ibannez@uam.es> [2020-2022]
+# Departamento de Psicología Básica, Facultad de Psicología
+# Universidad Autónoma de Madrid
+#
+# © Copyright 2022 Jorge Ibáñez Gijón. All rights reserved
+#
+
+"""
+Command line interface of the batch runners:
+
+    python -m pyatc exp LOGPATH TASKPATH [--out OUTPATH] [--retry-failed]
+                                  [--queue QUEUEPATH [--job-timeout SECONDS]]
+    python -m pyatc worker QUEUEPATH [--taskpath TASKPATH]
+
+The jobs of exp run in the local pool, or in the job queue of QUEUEPATH
+served by the worker processes, see pyatc.executors.
+"""
+
+import argparse
+
+from . import runners
+from . import executors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pyatc', description='Batch COMETA computation')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    exp = commands.add_parser('exp', help='compute the COMETA of all the participants of an experiment')
+    exp.add_argument('logpath', help='directory with one P### directory per participant')
+    exp.add_argument('taskpath', help='directory with the task xml and flows files')
+    exp.add_argument('--out', dest='outpath', default=None,
+                     help='directory of the manifest and job outputs (default LOGPATH/cometa_run)')
+    exp.add_argument('--tmax', type=int, default=600, help='maximal time of the conflicts')
+    exp.add_argument('--retry-failed', action='store_true', help='run again only the jobs that failed or are out of date')
+    exp.add_argument('--queue', dest='queuepath', default=None,
+                     help='run the jobs in the job queue of this directory instead of the local pool')
+    exp.add_argument('--job-timeout', type=float, default=executors.QUEUE_JOB_TIMEOUT,
+                     help='seconds without heartbeats of its worker after which a queued job is '
+                          'submitted again, 0 never (default %(default)s)')
+
+    worker = commands.add_parser('worker', help='run the jobs of a job queue')
+    worker.add_argument('queuepath', help='directory of the job queue, in storage shared with the submitter')
+    worker.add_argument('--taskpath', default=None, help='directory of the task files to preload')
+    worker.add_argument('--poll', type=float, default=executors.QUEUE_POLL,
+                        help='seconds between the checks of the queue')
+    worker.add_argument('--idle-timeout', type=float, default=None,
+                        help='exit after this many seconds without jobs (default never)')
+    worker.add_argument('--max-jobs', type=int, default=None, help='exit after running this many jobs')
+
+    args = parser.parse_args(argv)
+    if args.command == 'exp':
+        if args.queuepath is not None:
+            runners.set_executor(executors.QueueExecutor(args.queuepath,
+                                                         job_timeout=args.job_timeout if args.job_timeout > 0 else None))
+        runners.compute_cometa_exp_resumable(args.logpath, args.taskpath, args.outpath, args.tmax,
+                                             retry_failed=args.retry_failed)
+    elif args.command == 'worker':
+        runners.preload_skies(args.taskpath)
+        executors.run_worker(args.queuepath, args.poll, args.idle_timeout, args.max_jobs)
+
+
+if __name__ == '__main__':
+    main()
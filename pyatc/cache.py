@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This file is part of pyatc library
+#
+# Authors:
+# Jorge Ibáñez Gijón <jorge.ibannez@uam.es> [2020-2022]
+# Departamento de Psicología Básica, Facultad de Psicología
+# Universidad Autónoma de Madrid
+#
+# © Copyright 2022 Jorge Ibáñez Gijón. All rights reserved
+#
+
+"""
+Persistent cache of parsed log files.
+
+Each parsed log is stored in columnar form as an uncompressed NumPy .npz
+file named after the SHA-1 hash of the log contents, so that copies of the
+same log share a single entry. A small stamp file per log path remembers the
+size, modification time and hash of the log, to avoid hashing it again while
+it does not change. Entries are evicted in least recently used order when
+the total size of the cache exceeds CACHE_MAXSIZE, together with the stamps
+of their logs.
+
+The cache is used by parse.run when parse.CACHE is set, which is the default
+only when the PYATC_CACHE environment variable is set, and by the batch
+runners unless runners.CACHE is unset.
+
+All the files are written atomically and there is no shared index, so
+several processes can safely use the same cache directory.
+"""
+
+import os
+import ast
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from collections import OrderedDict as OD
+
+
+# Directory of the cache, it can be set with the PYATC_CACHE environment variable
+CACHE_PATH = os.environ.get('PYATC_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'pyatc'))
+
+# Maximum size of the cache in bytes
+CACHE_MAXSIZE = 4 * 1024**3
+
+# Format version of the entries, increase it whenever the parser output changes
+CACHE_VERSION = 1
+
+# Size of the blocks read to hash the log files
+HASH_BLOCKSIZE = 1024**2
+
+
+def get_file_hash(filename):
+    """Computes the SHA-1 hash of the contents of a file"""
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCKSIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def get_log_key(logname, path=None):
+    """Returns the content hash of a log file. The hash is computed only if
+    the path, size or modification time of the log differ from the last time
+    it was hashed."""
+    path = CACHE_PATH if path is None else path
+    logname = os.path.abspath(logname)
+    stat = os.stat(logname)
+    stamp = [logname, stat.st_size, stat.st_mtime_ns]
+    stampfile = os.path.join(path, hashlib.sha1(logname.encode('utf-8')).hexdigest() + '.stamp')
+    try:
+        with open(stampfile, 'r') as f:
+            saved = json.load(f)
+        if saved[:3] == stamp:
+            return saved[3]
+    except (OSError, ValueError, IndexError):
+        pass
+
+    key = get_file_hash(logname)
+    _write_atomic(stampfile, lambda f: f.write(json.dumps(stamp + [key]).encode('utf-8')))
+    return key
+
+
+def get_entry_path(key, path=None):
+    path = CACHE_PATH if path is None else path
+    return os.path.join(path, 'v%d_%s.npz' % (CACHE_VERSION, key))
+
+
+def load_log(logname, path=None):
+    """Loads the columnar outdict of a log file from the cache. Returns None
+    if the log is not cached."""
+    try:
+        entry = get_entry_path(get_log_key(logname, path), path)
+        if not os.path.isfile(entry):
+            return None
+        outdict = _read_entry(entry)
+        # Touch the entry to keep track of the least recently used ones
+        os.utime(entry)
+        return outdict
+    except Exception as e:
+        print('\t[WARNING] Could not load %s from the cache: %s' % (logname, e))
+        return None
+
+
+def store_log(logname, outdict, path=None, maxsize=None):
+    """Stores the columnar outdict of a log file in the cache, evicting the
+    least recently used entries if the cache grows beyond maxsize bytes."""
+    try:
+        entry = get_entry_path(get_log_key(logname, path), path)
+        _write_atomic(entry, lambda f: _write_entry(f, outdict))
+        evict(maxsize, path)
+    except Exception as e:
+        print('\t[WARNING] Could not store %s in the cache: %s' % (logname, e))
+
+
+def evict(maxsize=None, path=None):
+    """Removes the least recently used entries until the total size of the
+    cache is not larger than maxsize bytes."""
+    path = CACHE_PATH if path is None else path
+    maxsize = CACHE_MAXSIZE if maxsize is None else maxsize
+    entries = list()
+    for fname in os.listdir(path):
+        if fname.endswith('.npz'):
+            fpath = os.path.join(path, fname)
+            try:
+                stat = os.stat(fpath)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, fpath))
+
+    total = sum(size for (_, size, _) in entries)
+    evicted = 0
+    for (_, size, fpath) in sorted(entries):
+        if total <= maxsize:
+            break
+        try:
+            os.remove(fpath)
+            evicted += 1
+        except OSError:
+            pass
+        total -= size
+    if evicted > 0:
+        remove_stale_stamps(path)
+
+
+def remove_stale_stamps(path=None):
+    """Removes the stamps of the logs whose entries are not in the cache.
+    The stamp of a log being parsed is removed too, which only means that
+    the log is hashed again when it is stored."""
+    path = CACHE_PATH if path is None else path
+    for fname in os.listdir(path):
+        if not fname.endswith('.stamp'):
+            continue
+        stampfile = os.path.join(path, fname)
+        try:
+            with open(stampfile, 'r') as f:
+                key = json.load(f)[3]
+            if os.path.isfile(get_entry_path(key, path)):
+                continue
+        except (OSError, ValueError, IndexError):
+            pass
+        try:
+            os.remove(stampfile)
+        except OSError:
+            pass
+
+
+def clear(path=None):
+    """Removes all the entries and stamps from the cache"""
+    path = CACHE_PATH if path is None else path
+    if not os.path.isdir(path):
+        return
+    for fname in os.listdir(path):
+        if fname.endswith('.npz') or fname.endswith('.stamp'):
+            os.remove(os.path.join(path, fname))
+
+
+########################################################################
+## Private functions to read and write entries
+########################################################################
+
+def _write_atomic(filename, write):
+    """Writes a file through a temporary file in the same directory, so that
+    other processes never see partially written files"""
+    dirname = os.path.dirname(filename)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.remove(tmpname)
+        raise
+
+
+def _write_entry(f, outdict):
+    """Stores each column of the record dataframes as a separate array.
+    String columns are stored as unicode arrays to avoid pickling them.
+    The 'info' records and the layout of the dataframes go in a header."""
+    arrays = OD()
+    layout = OD()
+    for otype, records in outdict.items():
+        if otype == 'info':
+            continue
+        layout[otype] = list()
+        for i, (name, column) in enumerate(records.items()):
+            values = column.values
+            if values.dtype == object:
+                values = values.astype(str)
+            arrays['%s__%d' % (otype, i)] = values
+            layout[otype].append([name, column.dtype.str])
+    header = dict(version=CACHE_VERSION, layout=layout, info=repr(outdict['info']))
+    arrays['__header__'] = np.array(json.dumps(header))
+    np.savez(f, **arrays)
+
+
+def _read_entry(entry):
+    with np.load(entry, allow_pickle=False) as arrays:
+        header = json.loads(str(arrays['__header__']))
+        outdict = OD()
+        outdict['info'] = ast.literal_eval(header['info'])
+        for otype, columns in header['layout'].items():
+            outdict[otype] = pd.DataFrame(OD(
+                (name, arrays['%s__%d' % (otype, i)].astype(np.dtype(dtype)))
+                for i, (name, dtype) in enumerate(columns)))
+    return outdict
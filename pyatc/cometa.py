@@ -14,22 +14,37 @@
 import os
 import numpy as np
 import pandas as pd
+import multiprocessing as mp
 
 from copy import deepcopy
+from contextlib import closing
 from collections import OrderedDict as OD
+from collections.abc import Mapping
 
 from . import util
 from . import compute_conflicts
 from . import performance as perf
+from .conflicts_segments import get_aircraft_conflicts, get_conflict_tag, parse_conflict_name
 
-from .cometa_params import COMETAP, PD_FLOAT_FORMAT, FLOW_COMPLEXITY_FACTOR, CONFLICT_COMPLEXITY_FACTOR
+from .cometa_params import COMETAP, CometaParams, COMETA_NAMES, PD_FLOAT_FORMAT, FLOW_COMPLEXITY_FACTOR, CONFLICT_COMPLEXITY_FACTOR
+
+# Engines available to compute the per-aircraft COMETA
+COMETA_ENGINES = ('dense', 'frames')
+
+# Geometric features of the conflicts that COMETA thresholds
+CONFLICT_FEATURES = ('A0_vdist_a1_a2_conflict', 'A0_hdist_a1_conflict', 'A0_hdist_a2_conflict',
+                     'A0_distA1A2nm', 'A2_hdist_conflict_sector', 'THc', 'A4_hdist_conflict_crossingpoints')
+
+# Arrays of compute_cometa_arrays shaped (conflict, time), see drop_conflict_arrays
+CONFLICT_ARRAYS = ('isconflictinsector', 'inconflict', 'inconflictGIPYM', 'inconflictCOMETA',
+                   'Severity_Conflict', 'Total_Conflict_Severity', 'Conflict_Complexity')
 
 
 ############################################################
 ### HIGHEST LEVEL API FOR COMETA
 ############################################################
 
-def compute_cometa(taskdict, logdict, flowdict, params, save2mat=False, saveCometa=True):
+def compute_cometa(taskdict, logdict, flowdict, params, save2mat=False, saveCometa=True, engine='dense', cometap=None, conflict_intervals=False):
     """Computes the cometa index using the information specified in the
     dictionaries passed as arguments. This function is used by both cometa_dir
     and cometa_file, which act as wrappers of cometa compution that take paths
@@ -58,7 +73,26 @@ def compute_cometa(taskdict, logdict, flowdict, params, save2mat=False, saveCome
         save2mat [boolean]:
             flag to indicate if we want the parsed events in the log to be
             saved in mat files for processing in Matlab.
+
+        engine [string]:
+            'dense' computes the per-aircraft COMETA with compute_cometa_arrays,
+            and the per-aircraft dataframes are only built when they are
+            requested. 'frames' builds them with compute_aircraft_cometa.
+
+        cometap [CometaParams]:
+            COMETA parameters, by default the current values of COMETAP.
+
+        conflict_intervals [boolean]:
+            return the intervals of each conflict computed by
+            get_conflict_intervals instead of the conflict dataframes. With
+            the dense engine, the per-aircraft dataframes then only keep the
+            sums over the conflicts of each aircraft, see
+            drop_conflict_arrays.
     """
+    if engine not in COMETA_ENGINES:
+        raise ValueError('Unknown COMETA engine %s, use one of %s' % (engine, ', '.join(COMETA_ENGINES)))
+    cometap = CometaParams() if cometap is None else CometaParams(cometap)
+
     #######################################################
     # Fetch variables necessary for the analysis:
     #  - conflicts
@@ -70,31 +104,32 @@ def compute_cometa(taskdict, logdict, flowdict, params, save2mat=False, saveCome
     #######################################################
     print("\n\t"+"·"*30)
     print("\tComputing cometa indexes for log file " + params['logfile'])
-    conflicts, trajectories = compute_conflicts(logdict, params, params['tmax'], COMETAP)
-    flow_interactions = compute_flow_interactions(params['crossingpoints'], params['flows'])
+    conflicts, trajectories = compute_conflicts(logdict, params, params['tmax'], cometap)
+    flow_interactions = compute_flow_interactions(params['crossingpoints'], params['flows'], cometap)
     aircrafts = util.get_aircrafts_xml(taskdict)
     non_standard = util.get_non_standard_aircrafts(aircrafts, flowdict)
     inevolution = util.get_inevolution_aircrafts(aircrafts)
     crossingpoints = list(params['crossingpoints'].values())
+    grid = util.compute_time_grid(trajectories)
 
     #######################################################
     # Compute per-aircraft COMETA
     #######################################################
-    cometa_aircrafts = OD()
-    tlen = 0
-    for aname, aircraft in aircrafts.items():
+    for aname in aircrafts:
         if aname not in trajectories:
             # Skip aircrafts that are defined in the xml, but does not appear in the log.
             print('\t\t [WARNING] Aircraft %s is defined in the xml, but has no data in the log, it may appear too late in the simulations' % aname)
-            continue
-        tmp = compute_aircraft_cometa(
-            aircraft, conflicts.copy(), flowdict, flow_interactions, crossingpoints, non_standard, inevolution, trajectories)
-        if tmp is not None:
-            cometa_aircrafts[aname] = tmp
-            newtlen = len(tmp['time'])
-            if tlen < newtlen:
-                tlen = newtlen
-                longest = aname
+
+    if engine == 'dense':
+        arrays = compute_cometa_arrays(
+            aircrafts, conflicts, flowdict, flow_interactions, non_standard, inevolution, trajectories, cometap, grid)
+        cometa_aircrafts = AircraftsCometa(arrays)
+    else:
+        cometa_aircrafts = OD()
+        for aname, aircraft in aircrafts.items():
+            if aname in trajectories:
+                cometa_aircrafts[aname] = compute_aircraft_cometa(
+                    aircraft, conflicts, flowdict, flow_interactions, crossingpoints, non_standard, inevolution, trajectories, grid, cometap)
 
     #######################################################
     # Compute overall COMETA
@@ -105,17 +140,17 @@ def compute_cometa(taskdict, logdict, flowdict, params, save2mat=False, saveCome
         print('[ERROR] something is wrong with the log file. Could not compute anything.')
         return
 
-    # Fetch first aircraft COMETA to use it as a template
-    #aname = list(cometa_aircrafts.keys())[0]
-    cometadf = cometa_aircrafts[longest][['time']].copy()
-
-    # Fill in with COMETA fields mergin the data of all aircrafts in the sector
-    cometadf['COMETA_Flow'] = join_cometa_dfs(cometa_aircrafts, 'COMETA_Flow')
-    cometadf['COMETA_Evolution'] = join_cometa_dfs(cometa_aircrafts, 'COMETA_Evolution')
-    cometadf['COMETA_Non_Standard'] = join_cometa_dfs(cometa_aircrafts, 'COMETA_Non_Standard')
-    cometadf['COMETA_Conflict'] = join_cometa_dfs(cometa_aircrafts, 'COMETA_Conflict')
-    cometadf['COMETA_Reduction'] = join_cometa_dfs(cometa_aircrafts, 'COMETA_Reduction')
-    cometadf['COMETA'] = join_cometa_dfs(cometa_aircrafts, 'COMETA')
+    if engine == 'dense':
+        cometadf = pd.DataFrame(OD([('time', arrays['time'])]), index=arrays['time'])
+        for name in COMETA_NAMES:
+            cometadf[name] = arrays[name].sum(axis=0)
+    else:
+        # All the aircrafts share the same time index, use the first one as template
+        cometadf = cometa_aircrafts[next(iter(cometa_aircrafts))][['time']].copy()
+
+        # Fill in with COMETA fields mergin the data of all aircrafts in the sector
+        for name in COMETA_NAMES:
+            cometadf[name] = join_cometa_dfs(cometa_aircrafts, name)
     cometadf = cometadf.set_index(cometadf.time)
 
     #######################################################
@@ -123,21 +158,24 @@ def compute_cometa(taskdict, logdict, flowdict, params, save2mat=False, saveCome
     #######################################################
 
     # Add Active conflicts
-    cometadf['Active_conflicts'] = join_cometa_dfs(cometa_aircrafts, 'Active_conflicts') / 2
+    if engine == 'dense':
+        cometadf['Active_conflicts'] = arrays['Active_conflicts'].sum(axis=0) / 2
+    else:
+        cometadf['Active_conflicts'] = join_cometa_dfs(cometa_aircrafts, 'Active_conflicts') / 2
 
     # Add Active Aircrafts globally and in sector
-    dfX = join_cometa_dfs(trajectories, 'x', False)
-    dfY = join_cometa_dfs(trajectories, 'y', False)
-    dfInsector = join_cometa_dfs(trajectories, 'insector', False)
-    cometadf['Active_aircrafts'] = len(dfX.columns) - dfX.isnull().sum(axis=1)
-    cometadf['Active_aircrafts_insector'] = dfInsector.sum(axis=1)
+    active = grid['inregion'].sum(axis=0)
+    cometadf['Active_aircrafts'] = active
+    cometadf['Active_aircrafts_insector'] = grid['insector'].sum(axis=0)
 
     # Add Aircrafts trajectories centroids
-    cometadf['CentroidX'] = dfX.sum(axis=1) / cometadf['Active_aircrafts']
-    cometadf['CentroidY'] = dfY.sum(axis=1) / cometadf['Active_aircrafts']
-    ddfX = dfX.sub(cometadf['CentroidX'], axis=0)
-    ddfY = dfY.sub(cometadf['CentroidY'], axis=0)
-    cometadf['Distance2Centroid'] = np.sqrt(ddfX**2 + ddfY**2).mean(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centroidx = np.nansum(grid['x'], axis=0) / active
+        centroidy = np.nansum(grid['y'], axis=0) / active
+        distances = np.sqrt((grid['x'] - centroidx)**2 + (grid['y'] - centroidy)**2)
+        cometadf['CentroidX'] = centroidx
+        cometadf['CentroidY'] = centroidy
+        cometadf['Distance2Centroid'] = np.nansum(distances, axis=0) / active
 
     # Add mouse clicks
     try:
@@ -175,6 +213,15 @@ def compute_cometa(taskdict, logdict, flowdict, params, save2mat=False, saveCome
     else:
         cometadf['exit_speed_success'] = speed_out.speed_ok.sum() / len(speed_out)
 
+    # Keep only the intervals of the conflicts if requested
+    if conflict_intervals:
+        if engine != 'dense':
+            arrays = compute_cometa_arrays(
+                aircrafts, conflicts, flowdict, flow_interactions, non_standard, inevolution, trajectories, cometap, grid)
+        conflicts = get_conflict_intervals(arrays, conflicts)
+        if engine == 'dense':
+            cometa_aircrafts = AircraftsCometa(drop_conflict_arrays(arrays))
+
     #######################################################
     # Save results to csv
     #######################################################
@@ -186,11 +233,81 @@ def compute_cometa(taskdict, logdict, flowdict, params, save2mat=False, saveCome
     return cometadf, cometa_aircrafts, conflicts, trajectories
 
 
-def compute_aircraft_cometa(aircraft, conflicts, flowdict, flow_interactions, crossingpoints, non_standard, inevolution, trajectories):
+def compute_cometa_sweep(taskdict, logdict, flowdict, params, cometaps, processes=1):
+    """Evaluates the COMETA of a log for several sets of COMETA parameters.
+    Trajectories, conflicts and their geometric features are computed only
+    once, and then each parameter set is evaluated with the dense engine,
+    optionally in a pool of processes. Parameters that change the geometry
+    of the conflicts (tmax, the overlap distance eps_route) cannot be swept.
+
+    Arguments are the same of compute_cometa, and:
+
+        cometaps [list]:
+            CometaParams (or dicts of parameter values) to evaluate, see
+            cometa_params.get_cometa_params_grid.
+
+        processes [int]:
+            number of processes evaluating the parameter sets.
+
+    Returns a tidy dataframe with one row per parameter set and time, with
+    the index of the parameter set (paramset), the values of the parameters
+    that change between sets, the time and the overall COMETA values.
+    """
+    cometaps = [CometaParams(cometap) for cometap in cometaps]
+    print("\n\t"+"·"*30)
+    print("\tComputing cometa sweep of %d parameter sets for log file %s" % (len(cometaps), params['logfile']))
+    # Conflict ticks are pruned by altitude, keep the ones of the largest threshold
+    altitude = max(cometap['umbral_altitud_conflicto'] for cometap in cometaps)
+    conflicts, trajectories = compute_conflicts(
+        logdict, params, params['tmax'], CometaParams(umbral_altitud_conflicto=altitude))
+    aircrafts = util.get_aircrafts_xml(taskdict)
+    non_standard = util.get_non_standard_aircrafts(aircrafts, flowdict)
+    inevolution = util.get_inevolution_aircrafts(aircrafts)
+    features = get_cometa_features(aircrafts, conflicts, flowdict, non_standard, inevolution, trajectories)
+    config = (features, params['crossingpoints'], params['flows'])
+
+    if processes > 1:
+        with closing(mp.Pool(processes=processes, initializer=_init_sweep_worker, initargs=(config,))) as pool:
+            results = pool.map(_sweep_worker, cometaps)
+    else:
+        _init_sweep_worker(config)
+        results = [_sweep_worker(cometap) for cometap in cometaps]
+
+    swept = [name for name in COMETAP if len(set(cometap[name] for cometap in cometaps)) > 1]
+    sweepdfs = list()
+    for k, (cometap, result) in enumerate(zip(cometaps, results)):
+        sweepdf = pd.DataFrame(OD([('paramset', k)] + [(name, cometap[name]) for name in swept] +
+                                  [('time', features['time'])]), index=range(len(features['time'])))
+        for name, values in result.items():
+            sweepdf[name] = values
+        sweepdfs.append(sweepdf)
+    return pd.concat(sweepdfs, ignore_index=True)
+
+
+# Features shared by the parameter sets evaluated in a process
+_SWEEP_CONFIG = None
+
+
+def _init_sweep_worker(config):
+    global _SWEEP_CONFIG
+    _SWEEP_CONFIG = config
+
+
+def _sweep_worker(cometap):
+    (features, crossingpoints, flows) = _SWEEP_CONFIG
+    flow_interactions = compute_flow_interactions(crossingpoints, flows, cometap)
+    arrays = evaluate_cometa_features(features, flow_interactions, cometap)
+    result = OD((name, arrays[name].sum(axis=0)) for name in COMETA_NAMES)
+    result['Active_conflicts'] = arrays['Active_conflicts'].sum(axis=0) / 2
+    return result
+
+
+def compute_aircraft_cometa(aircraft, conflicts, flowdict, flow_interactions, crossingpoints, non_standard, inevolution, trajectories, grid=None, cometap=COMETAP):
     """Compute complexity values obtained with cometa equations for a given
     aircraft.
     This function follows step by step the computations exposed in CRIDA's
-    lastest technical report of COMETA.
+    lastest technical report of COMETA. The time grid of the trajectories,
+    from util.compute_time_grid, is computed if not provided.
     """
     #################################################################
     #0a - Use conflicts dataframe as template to store all cometa values
@@ -200,15 +317,17 @@ def compute_aircraft_cometa(aircraft, conflicts, flowdict, flow_interactions, cr
     #    print('WARNING: No conflicts provided!!!')
     #    tmpdf = trajectories[aircraft['idx']]
     #cometadf = tmpdf.loc[:,['time']].copy()
-    dfX = join_cometa_dfs(trajectories, 'x', False)
-    cometadf = dfX.index.to_frame(name='time')
-    cometadf['inregion'] = ~dfX[aircraft['idx']].isnull()
+    if grid is None:
+        grid = util.compute_time_grid(trajectories)
+    i = grid['index'][aircraft['idx']]
+    time = pd.Index(grid['time'], name=trajectories[aircraft['idx']].index.name)
+    cometadf = pd.DataFrame(OD([('time', grid['time'])]), index=time)
+    cometadf['inregion'] = grid['inregion'][i]
 
     #################################################################
     #0b - Use trajectory of this plane to fill insector column
     #################################################################
-    cometadf['insector'] = trajectories[aircraft['idx']]['insector']
-    cometadf.loc[cometadf['insector'].isnull(),'insector'] = False
+    cometadf['insector'] = grid['insector'][i]
 
     #################################################################
     # 1 - Add flow-interaction related complexities
@@ -232,14 +351,14 @@ def compute_aircraft_cometa(aircraft, conflicts, flowdict, flow_interactions, cr
 
         # Fetch the invalid indexes due to COMETA constraints
         # Assign complexity value according to severities and thresholds
-        if severity < COMETAP['umbral_i2']:
-            cometadf[colname] = COMETAP['i3']
+        if severity < cometap['umbral_i2']:
+            cometadf[colname] = cometap['i3']
 
-        elif severity > COMETAP['umbral_i1']:
-            cometadf[colname] = COMETAP['i1']
+        elif severity > cometap['umbral_i1']:
+            cometadf[colname] = cometap['i1']
 
         else:
-            cometadf[colname] = COMETAP['i2']
+            cometadf[colname] = cometap['i2']
 
         # Parameter to reduce the weight of flows in complexity
         cometadf[colname] =  cometadf[colname] * FLOW_COMPLEXITY_FACTOR
@@ -255,7 +374,7 @@ def compute_aircraft_cometa(aircraft, conflicts, flowdict, flow_interactions, cr
     # 2 - Add non-standard aircrafts related complexities
     #################################################################
     if aircraft['idx'] in non_standard:
-        cometadf['COMETA_Non_Standard'] = COMETAP['noestandar']
+        cometadf['COMETA_Non_Standard'] = cometap['noestandar']
     else:
         cometadf['COMETA_Non_Standard'] = 0
 
@@ -263,31 +382,26 @@ def compute_aircraft_cometa(aircraft, conflicts, flowdict, flow_interactions, cr
     # 3 - Add inevolution related complexities
     #################################################################
     if aircraft['idx'] in inevolution:
-        cometadf['COMETA_Evolution'] = COMETAP['evolucion']
+        cometadf['COMETA_Evolution'] = cometap['evolucion']
     else:
         cometadf['COMETA_Evolution'] = 0
 
     #################################################################
     # 4 - Add conflict-related complexities
     #################################################################
-    for cname, df in conflicts.items():
-        air1, air2 = cname.split('_')[:2]
-        lastsuffix = cname.split('_')[-1]
-        if lastsuffix in [air1, air2]:
-            lastsuffix = None
-
-        # Skip conflicts unrelated to the current aircraft
+    for cname, key in get_aircraft_conflicts(conflicts, aircraft['idx']):
+        df = conflicts[cname]
+        air1, air2 = key.air1, key.air2
         if aircraft['idx'] == air1:
             suffix = 'a1'
             suffix2 = air2
-        elif aircraft['idx'] == air2:
+        else:
             suffix = 'a2'
             suffix2 = air1
-        else:
-            continue
 
-        if lastsuffix is not None:
-            suffix2 = '_'.join([suffix2, lastsuffix])
+        tag = get_conflict_tag(key)
+        if tag is not None:
+            suffix2 = '_'.join([suffix2, tag])
 
         # Copy df because we'll be modifying it
         df = df.copy()
@@ -324,26 +438,26 @@ def compute_aircraft_cometa(aircraft, conflicts, flowdict, flow_interactions, cr
 
         # A2: Conflict severity due to distance from conflict point to sector
         colname2 = template % (2, cname)
-        cometadf[colname2] = COMETAP['A2_nofrontera']
-        bsectordist = df['A2_hdist_conflict_sector'] < COMETAP['umbral_distancia_conflicto']
-        cometadf.loc[bsectordist, colname2] = COMETAP['A2_frontera']
+        cometadf[colname2] = cometap['A2_nofrontera']
+        bsectordist = df['A2_hdist_conflict_sector'] < cometap['umbral_distancia_conflicto']
+        cometadf.loc[bsectordist, colname2] = cometap['A2_frontera']
         cometadf.loc[bnoconflict, colname2] = 0
 
         # A3: Conflict severity due to convergence between routes
         colname3 = template % (3,cname)
-        cometadf[colname3] = COMETAP['A3_noconvergente']
-        bconvergence = df['THc'] < COMETAP['umbral_angulo']
-        cometadf.loc[bconvergence, colname3] = COMETAP['A3_convergente']
+        cometadf[colname3] = cometap['A3_noconvergente']
+        bconvergence = df['THc'] < cometap['umbral_angulo']
+        cometadf.loc[bconvergence, colname3] = cometap['A3_convergente']
         boverlap = np.isnan(df['THc'])
         cometadf.loc[boverlap, colname3] = 1
         cometadf.loc[bnoconflict, colname3] = 0
 
         # A4: Conflict severity due to proximity to standard flows crossing points
         colname4 = template % (4,cname)
-        cometadf[colname4] = COMETAP['A4_nocritico']
+        cometadf[colname4] = cometap['A4_nocritico']
         # Again seems odd to have critial conflicts with higher than threshold distances
-        bcrossing = df['A4_hdist_conflict_crossingpoints'] > COMETAP['umbralcritico']
-        cometadf.loc[bcrossing, colname4] = COMETAP['A4_critico']
+        bcrossing = df['A4_hdist_conflict_crossingpoints'] > cometap['umbralcritico']
+        cometadf.loc[bcrossing, colname4] = cometap['A4_critico']
         cometadf.loc[bnoconflict, colname4] = 0
 
         # A5: Conflict severity due to relative temporal proximity
@@ -352,16 +466,16 @@ def compute_aircraft_cometa(aircraft, conflicts, flowdict, flow_interactions, cr
         THIS FACTOR IS NOT USED IN THE EXTENDED VERSION OF COMETA
 
         colname5 = template % (5,cname)
-        #cometadf[colname4] = COMETAP['A4_nocritico']
-        #bcrossing = df['A4_hdist_conflict_crossingpoints'] > COMETAP['umbralcritico']
-        #cometadf.loc[bcrossing, colname4] = COMETAP['A4_critico']
+        #cometadf[colname4] = cometap['A4_nocritico']
+        #bcrossing = df['A4_hdist_conflict_crossingpoints'] > cometap['umbralcritico']
+        #cometadf.loc[bcrossing, colname4] = cometap['A4_critico']
         # The exponential goes from 1 to 0, because the range of the relative time to conflict
         # goes from 1 (the timing difference at the critical point is equal to the maximum
         # difference, which implies that one aircraft is already at the critical point)
         # to 0 (the timing difference is exactly the same, they will collide at time)
         # so the factor should be higher than 1, somewhere between 2 and 4 I guess.
-        #cometadf[colname5] = np.exp(-df['A5_relative_time2conflict']) * COMETAP['A5_factor']
-        cometadf[colname5] = df['A5_relative_time2conflict'] * COMETAP['A5_factor']
+        #cometadf[colname5] = np.exp(-df['A5_relative_time2conflict']) * cometap['A5_factor']
+        cometadf[colname5] = df['A5_relative_time2conflict'] * cometap['A5_factor']
         cometadf.loc[bnoconflict, colname5] = 0
         """
 
@@ -371,11 +485,11 @@ def compute_aircraft_cometa(aircraft, conflicts, flowdict, flow_interactions, cr
 
         # Conflict complexity
         colnameC = 'COMETA_Conflict_'+cname
-        cometadf[colnameC] = COMETAP['c2']
-        bumbralc1 = cometadf[colnameS] > COMETAP['umbral_c1']
-        cometadf.loc[bumbralc1, colnameC] = COMETAP['c1']
-        bumbralc2 = cometadf[colnameS] < COMETAP['umbral_c2']
-        cometadf.loc[bumbralc2, colnameC] = COMETAP['c3']
+        cometadf[colnameC] = cometap['c2']
+        bumbralc1 = cometadf[colnameS] > cometap['umbral_c1']
+        cometadf.loc[bumbralc1, colnameC] = cometap['c1']
+        bumbralc2 = cometadf[colnameS] < cometap['umbral_c2']
+        cometadf.loc[bumbralc2, colnameC] = cometap['c3']
         cometadf.loc[bnoconflict, colnameC] = 0
 
         # Parameter to increase the weight of conflicts in complexity
@@ -397,16 +511,16 @@ def compute_aircraft_cometa(aircraft, conflicts, flowdict, flow_interactions, cr
     #################################################################
     # Compute overall COMETA
     #################################################################
-    cometadf['COMETA'] = COMETAP['a'] * cometadf['COMETA_Flow'] +\
-                         COMETAP['b'] * cometadf['COMETA_Evolution'] +\
-                         COMETAP['c'] * cometadf['COMETA_Non_Standard'] +\
-                         COMETAP['d'] * cometadf['COMETA_Conflict'] + 1
+    cometadf['COMETA'] = cometap['a'] * cometadf['COMETA_Flow'] +\
+                         cometap['b'] * cometadf['COMETA_Evolution'] +\
+                         cometap['c'] * cometadf['COMETA_Non_Standard'] +\
+                         cometap['d'] * cometadf['COMETA_Conflict'] + 1
 
     #################################################################
     # Reduce complexity if all factors are zero
     #################################################################
     cometadf['COMETA_Reduction'] = 0
-    cometadf.loc[cometadf['COMETA'] == 1, 'COMETA_Reduction'] = COMETAP['reduccion']
+    cometadf.loc[cometadf['COMETA'] == 1, 'COMETA_Reduction'] = cometap['reduccion']
     cometadf['COMETA'] -= cometadf['COMETA_Reduction']
 
     #################################################################
@@ -423,6 +537,280 @@ def compute_aircraft_cometa(aircraft, conflicts, flowdict, flow_interactions, cr
     return cometadf
 
 
+############################################################
+### DENSE COMETA ENGINE
+############################################################
+
+def compute_cometa_arrays(aircrafts, conflicts, flowdict, flow_interactions, non_standard, inevolution, trajectories, cometap=COMETAP, grid=None):
+    """Dense version of compute_aircraft_cometa for all the aircrafts at once.
+    The COMETA terms are stored as arrays shaped (aircraft, time), and the
+    conflict severities as arrays shaped (conflict, time), so that thresholds
+    and weights are applied with broadcast operations. Returns an OrderedDict
+    with the arrays; use AircraftsCometa to get the per-aircraft dataframes.
+    """
+    features = get_cometa_features(aircrafts, conflicts, flowdict, non_standard, inevolution, trajectories, grid)
+    return evaluate_cometa_features(features, flow_interactions, cometap)
+
+
+def get_cometa_features(aircrafts, conflicts, flowdict, non_standard, inevolution, trajectories, grid=None):
+    """Collects everything compute_cometa_arrays needs that does not depend on
+    the COMETA parameters: the presence of the aircrafts in the time grid,
+    their flows, and the geometric features of each conflict, aligned to the
+    time grid as arrays shaped (conflict, time)."""
+    features = OD()
+
+    # Global time index and presence of each aircraft of the task in the log
+    if grid is None:
+        grid = util.compute_time_grid(trajectories)
+    names = [aname for aname in aircrafts if aname in trajectories]
+    rows = [grid['index'][aname] for aname in names]
+    features['time'] = grid['time']
+    features['aircrafts'] = names
+    features['inregion'] = grid['inregion'][rows]
+    features['insector'] = grid['insector'][rows]
+    features['flowdict'] = flowdict
+    features['non_standard'] = np.array([aname in non_standard for aname in names], dtype=bool)
+    features['inevolution'] = np.array([aname in inevolution for aname in names], dtype=bool)
+
+    # Conflicts of each aircraft, with the suffix of their columns
+    index = OD((aname, i) for i, aname in enumerate(names))
+    features['conflicts'] = list()
+    features['aircraft_conflicts'] = [OD() for _ in names]
+    conflict_index = OD()
+    overlap = list()
+    for aname in names:
+        for cname, key in get_aircraft_conflicts(conflicts, aname):
+            if cname not in conflict_index:
+                conflict_index[cname] = len(features['conflicts'])
+                features['conflicts'].append(cname)
+                overlap.append(key.kind == 'O')
+            other = key.air2 if aname == key.air1 else key.air1
+            tag = get_conflict_tag(key)
+            suffix2 = other if tag is None else '_'.join([other, tag])
+            features['aircraft_conflicts'][index[aname]][cname] = (conflict_index[cname], suffix2)
+    features['overlap'] = np.array(overlap, dtype=bool)
+
+    # Conflict features aligned to the global time index
+    time = features['time']
+    shape = (len(features['conflicts']), len(time))
+    for name in ('isconflictinsector', 'inspan'):
+        features[name] = np.zeros(shape, dtype=bool)
+    for name in CONFLICT_FEATURES:
+        features[name] = np.full(shape, np.nan)
+    for c, cname in enumerate(features['conflicts']):
+        df = conflicts[cname]
+        pos = np.searchsorted(time, df.index.values)
+        insector = df['isconflictinsector'].values == True
+        features['isconflictinsector'][c, pos] = insector
+        features['inspan'][c, pos] = insector & (df['intime'].values == True)
+        for name in CONFLICT_FEATURES:
+            features[name][c, pos] = df[name].values
+    return features
+
+
+def evaluate_cometa_features(features, flow_interactions, cometap=COMETAP):
+    """Computes the arrays of compute_cometa_arrays from the output of
+    get_cometa_features, for the given flow interactions and COMETA
+    parameters."""
+    arrays = OD()
+    names = features['aircrafts']
+    time = features['time']
+    flowdict = features['flowdict']
+    for name in ('time', 'aircrafts', 'inregion', 'insector'):
+        arrays[name] = features[name]
+
+    #################################################################
+    # 1, 2, 3 - Flow, non-standard and inevolution complexities, which
+    # are constant for each aircraft
+    #################################################################
+    arrays['flows'] = list()
+    flow = np.zeros(len(names))
+    for i, aname in enumerate(names):
+        aflows = OD()
+        for (flow1, flow2), severity in flow_interactions.items():
+            if not (util.is_in_flow(aname, flowdict[flow1]) or util.is_in_flow(aname, flowdict[flow2])):
+                continue
+            if severity < cometap['umbral_i2']:
+                value = cometap['i3']
+            elif severity > cometap['umbral_i1']:
+                value = cometap['i1']
+            else:
+                value = cometap['i2']
+            aflows[(flow1, flow2)] = (severity, value * FLOW_COMPLEXITY_FACTOR)
+        if len(aflows) > 0:
+            flow[i] = np.sum([value for (_, value) in aflows.values()])
+        arrays['flows'].append(aflows)
+    nonstandard = np.where(features['non_standard'], cometap['noestandar'], 0)
+    evolution = np.where(features['inevolution'], cometap['evolucion'], 0)
+
+    #################################################################
+    # 4 - Conflict related complexities
+    #################################################################
+    arrays['conflicts'] = features['conflicts']
+    arrays['aircraft_conflicts'] = features['aircraft_conflicts']
+    shape = (len(arrays['conflicts']), len(time))
+
+    with np.errstate(invalid='ignore'):
+        # A0: Inside the distance threshold and closer than the altitude threshold,
+        # as in compute_conflicts. Overlaps use the distance between aircrafts.
+        vertical = (features['A0_vdist_a1_a2_conflict'] < cometap['umbral_altitud_conflicto']) & features['inspan']
+        arrays['isconflictinsector'] = features['isconflictinsector']
+        arrays['inconflictCOMETA'] = vertical &\
+            (features['A0_hdist_a1_conflict'] < cometap['umbral_distancia_conflicto']) &\
+            (features['A0_hdist_a2_conflict'] < cometap['umbral_distancia_conflicto'])
+        arrays['inconflictGIPYM'] = vertical & (features['A0_distA1A2nm'] < cometap['umbral_distancia_conflicto'])
+        arrays['inconflict'] = np.where(features['overlap'][:,None], arrays['inconflictGIPYM'], arrays['inconflictCOMETA'])
+        noconflict = ~arrays['inconflict']
+
+        # A1: Conflict severity due to horizontal distance in meters
+        A1 = np.where(noconflict, 0, features['A0_distA1A2nm'] * cometap['nm2meters'])
+        # A2: Conflict severity due to distance from conflict point to sector
+        A2 = np.where(features['A2_hdist_conflict_sector'] < cometap['umbral_distancia_conflicto'], cometap['A2_frontera'], cometap['A2_nofrontera'])
+        A2[noconflict] = 0
+        # A3: Conflict severity due to convergence between routes
+        A3 = np.where(features['THc'] < cometap['umbral_angulo'], cometap['A3_convergente'], cometap['A3_noconvergente'])
+        A3[np.isnan(features['THc'])] = 1
+        A3[noconflict] = 0
+        # A4: Conflict severity due to proximity to standard flows crossing points
+        A4 = np.where(features['A4_hdist_conflict_crossingpoints'] > cometap['umbralcritico'], cometap['A4_critico'], cometap['A4_nocritico'])
+        A4[noconflict] = 0
+
+    # Overall conflict severity and complexity
+    severity = A1 * A2 * A3 * A4
+    complexity = np.full(shape, cometap['c2'])
+    complexity[severity > cometap['umbral_c1']] = cometap['c1']
+    complexity[severity < cometap['umbral_c2']] = cometap['c3']
+    complexity[noconflict] = 0
+    complexity = complexity * CONFLICT_COMPLEXITY_FACTOR
+    arrays['Severity_Conflict'] = np.stack([A1, A2, A3, A4])
+    arrays['Total_Conflict_Severity'] = severity
+    arrays['Conflict_Complexity'] = complexity
+
+    # Add the complexity of the conflicts of each aircraft, and count the
+    # active ones. As in compute_aircraft_cometa, conflicts with the same
+    # suffix are counted once.
+    conflict = np.zeros((len(names), len(time)))
+    active = np.zeros((len(names), len(time)), dtype=int)
+    for i, aconflicts in enumerate(arrays['aircraft_conflicts']):
+        suffixes = OD()
+        for (c, suffix2) in aconflicts.values():
+            conflict[i] += complexity[c]
+            suffixes[suffix2] = c
+        for c in suffixes.values():
+            active[i] += arrays['inconflict'][c]
+
+    #################################################################
+    # Remove complexity from timestamps where the aircraft is not in sector
+    #################################################################
+    insector = arrays['insector']
+    arrays['COMETA_Flow'] = np.where(insector, flow[:,None], 0)
+    arrays['COMETA_Non_Standard'] = np.where(insector, nonstandard[:,None], 0)
+    arrays['COMETA_Evolution'] = np.where(insector, evolution[:,None], 0)
+    arrays['COMETA_Conflict'] = np.where(insector, conflict, 0)
+
+    #################################################################
+    # Compute overall COMETA, reduced if all factors are zero
+    #################################################################
+    cometa = cometap['a'] * arrays['COMETA_Flow'] +\
+             cometap['b'] * arrays['COMETA_Evolution'] +\
+             cometap['c'] * arrays['COMETA_Non_Standard'] +\
+             cometap['d'] * arrays['COMETA_Conflict'] + 1
+    reduction = np.where(cometa == 1, cometap['reduccion'], 0)
+    cometa = cometa - reduction
+
+    # Remove any cometa related value if aircraft is not region
+    arrays['COMETA'] = np.where(arrays['inregion'], cometa, 0)
+    arrays['COMETA_Reduction'] = np.where(arrays['inregion'], reduction, 0)
+    arrays['Active_conflicts'] = active
+    return arrays
+
+
+def get_aircraft_cometa_frame(arrays, aname):
+    """Builds the dataframe of an aircraft from the output of compute_cometa_arrays,
+    with the same columns returned by compute_aircraft_cometa. Conflict flags are
+    False outside the time span of each conflict."""
+    i = arrays['aircrafts'].index(aname)
+    time = arrays['time']
+    cometadf = pd.DataFrame(OD([('time', time)]), index=time)
+    cometadf['inregion'] = arrays['inregion'][i]
+    cometadf['insector'] = arrays['insector'][i]
+    for (flow1, flow2), (severity, value) in arrays['flows'][i].items():
+        cometadf['Severity_%s_%s' % (flow1,flow2)] = severity
+        cometadf['COMETA_Flow_%s_%s' % (flow1,flow2)] = value
+    cometadf['COMETA_Flow'] = arrays['COMETA_Flow'][i]
+    cometadf['COMETA_Non_Standard'] = arrays['COMETA_Non_Standard'][i]
+    cometadf['COMETA_Evolution'] = arrays['COMETA_Evolution'][i]
+    for cname, (c, suffix2) in arrays['aircraft_conflicts'][i].items():
+        for name in ('isconflictinsector', 'inconflict', 'inconflictGIPYM', 'inconflictCOMETA'):
+            cometadf[name + '_' + suffix2] = arrays[name][c]
+        for k in range(4):
+            cometadf['Severity_Conflict_A%d_%s' % (k+1, cname)] = arrays['Severity_Conflict'][k, c]
+        cometadf['Total_Conflict_Severity_'+cname] = arrays['Total_Conflict_Severity'][c]
+        cometadf['COMETA_Conflict_'+cname] = arrays['Conflict_Complexity'][c]
+    for name in ('COMETA_Conflict', 'COMETA', 'COMETA_Reduction', 'Active_conflicts'):
+        cometadf[name] = arrays[name][i]
+    return cometadf
+
+
+def get_conflict_intervals(arrays, conflicts=None):
+    """Summarizes the conflicts in the output of compute_cometa_arrays as the
+    intervals of consecutive ticks in which each one is active. Returns a
+    dataframe with one row per interval, with its first and last tick, the
+    peak total severity and its time, and the mean of each severity factor.
+    The names of the aircrafts are taken from the keys of the conflicts
+    registry if given, or parsed from the conflict names."""
+    keys = getattr(conflicts, 'conflict_keys', dict())
+    time = arrays['time']
+    rows = list()
+    for c, cname in enumerate(arrays['conflicts']):
+        key = keys[cname] if cname in keys else parse_conflict_name(cname)
+        active = np.concatenate(([False], arrays['inconflict'][c], [False]))
+        bounds = np.flatnonzero(active[1:] != active[:-1]).reshape(-1, 2)
+        for (start, stop) in bounds:
+            severity = arrays['Total_Conflict_Severity'][c, start:stop]
+            peak = np.argmax(severity)
+            row = OD([('conflict', cname), ('air1', key.air1), ('air2', key.air2), ('kind', key.kind),
+                      ('start', time[start]), ('end', time[stop-1]), ('ticks', stop - start),
+                      ('peak_severity', severity[peak]), ('peak_time', time[start + peak])])
+            for k in range(4):
+                row['A%d_mean' % (k+1)] = arrays['Severity_Conflict'][k, c, start:stop].mean()
+            rows.append(row)
+    columns = ['conflict', 'air1', 'air2', 'kind', 'start', 'end', 'ticks', 'peak_severity', 'peak_time',
+               'A1_mean', 'A2_mean', 'A3_mean', 'A4_mean']
+    return pd.DataFrame(rows, columns=columns)
+
+
+def drop_conflict_arrays(arrays):
+    """Returns the output of compute_cometa_arrays without the arrays of each
+    conflict, CONFLICT_ARRAYS. The dataframes of the aircrafts built from it
+    keep the sums over their conflicts, COMETA_Conflict and
+    Active_conflicts, but have no columns of each conflict."""
+    kept = OD((name, value) for name, value in arrays.items() if name not in CONFLICT_ARRAYS)
+    kept['conflicts'] = list()
+    kept['aircraft_conflicts'] = [OD() for _ in arrays['aircrafts']]
+    return kept
+
+
+class AircraftsCometa(Mapping):
+    """Per-aircraft COMETA computed by the dense engine. It behaves as the
+    OrderedDict of dataframes of compute_aircraft_cometa, but each dataframe
+    is only built when it is requested."""
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+
+    def __getitem__(self, aname):
+        if aname not in self.arrays['aircrafts']:
+            raise KeyError(aname)
+        return get_aircraft_cometa_frame(self.arrays, aname)
+
+    def __iter__(self):
+        return iter(self.arrays['aircrafts'])
+
+    def __len__(self):
+        return len(self.arrays['aircrafts'])
+
+
 ############################################################
 ### COMETA UTILITY FUNCTIONS
 ############################################################
@@ -444,7 +832,7 @@ def join_cometa_dfs(cometa_aircrafts, field, do_sum=True, index=None):
         return cometa_df
 
 
-def compute_flow_interactions(crossingpoints, flows):
+def compute_flow_interactions(crossingpoints, flows, cometap=COMETAP):
     interactions = OD()
     for flow1, flow2 in crossingpoints:
         # Fetch flows
@@ -474,13 +862,13 @@ def compute_flow_interactions(crossingpoints, flows):
         # Compute interaction type
         if elevation1 == 0 and elevation2 == 0:
             # T = 0 for equal sense not used, though not likely happening in our tasks
-            T = COMETAP['interaccion1']
+            T = cometap['interaccion1']
         elif (elevation1 == 0 and elevation2 != 0) or (elevation2 == 0 and elevation1 != 0):
-            T = COMETAP['interaccion2']
+            T = cometap['interaccion2']
         elif (elevation1 < 0 and elevation2 < 0) or (elevation1 > 0 and elevation2 > 0):
-            T = COMETAP['interaccion3']
+            T = cometap['interaccion3']
         elif (elevation1 < 0 and elevation2 > 0) or (elevation1 > 0 and elevation2 < 0):
-            T = COMETAP['interaccion4']
+            T = cometap['interaccion4']
 
         # Store in dictionary
         interactions[(flow1, flow2)] = T * Oc1 * Oc2
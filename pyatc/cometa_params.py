@@ -11,9 +11,11 @@
 # © Copyright 2022 Jorge Ibáñez Gijón. All rights reserved
 #
 
+import itertools
 import numpy as np
 
 from collections import OrderedDict as OD
+from collections.abc import Mapping
 
 # Small trick to force pandas to show full dataframe contents. Useful for debugging.
 # Comment these two lines to get the original, prettier, behavior.
@@ -74,6 +76,50 @@ COMETAP = OD([
     ('nm2meters', 1852),
     ])
 
+
+class CometaParams(Mapping):
+    """Immutable set of COMETA parameters. The values not given are taken from
+    COMETAP when the object is created, so later changes of COMETAP do not
+    affect it. Use replace to get a copy with some values changed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        values = OD(COMETAP)
+        for name, value in OD(*args, **kwargs).items():
+            if name not in COMETAP:
+                raise KeyError('Unknown COMETA parameter %s' % name)
+            values[name] = value
+        self._values = values
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __hash__(self):
+        return hash(tuple(self._values.items()))
+
+    def __repr__(self):
+        changes = ['%s=%r' % (name, value) for name, value in self._values.items() if COMETAP.get(name) != value]
+        return 'CometaParams(%s)' % ', '.join(changes)
+
+    def replace(self, **kwargs):
+        return CometaParams(self._values, **kwargs)
+
+
+def get_cometa_params_grid(base=None, **values):
+    """Returns the list of CometaParams of all the combinations of the values
+    given for each parameter, e.g. get_cometa_params_grid(c=[5, 10], d=[10, 20])
+    gives four parameter sets. The rest of values are taken from base."""
+    base = CometaParams() if base is None else CometaParams(base)
+    names = list(values.keys())
+    return [base.replace(**OD(zip(names, combination)))
+            for combination in itertools.product(*[values[name] for name in names])]
+
 COMETA_NAMES = ['COMETA_Flow','COMETA_Evolution','COMETA_Non_Standard','COMETA_Conflict','COMETA_Reduction','COMETA']
 
 # Default parameters used in performance computations
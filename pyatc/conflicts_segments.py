@@ -11,22 +11,111 @@
 # © Copyright 2022 Jorge Ibáñez Gijón. All rights reserved
 #
 import itertools
+import functools
 import pandas as pd
 import numpy as np
 
-from collections import OrderedDict as OD
+from collections import OrderedDict as OD, namedtuple
 
 from . import util
 from .geom import get_distance_to_sector, get_distance_to_crossing_points, find_intersection, get_angle_between_vectors
 from .cometa_params import COMETAP, CALL_NAMES
 from . import eps_route
 
+# Size in nautical miles of the cells of the grid used to find the segments
+# of different flightpaths that may interact
+GRID_CELLSIZE = 20.0
+
+# Parsed name of a conflict: aircraft names, kind ('C' crossing, 'O' overlap) and ordinal
+ConflictKey = namedtuple('ConflictKey', ['air1', 'air2', 'kind', 'ordinal'])
+
+
+class ConflictRegistry(OD):
+    """OrderedDict of conflict dataframes, indexed by conflict name as in
+    previous versions, that also stores the parsed key of each conflict and
+    the names of the conflicts of each aircraft. Conflicts should be added
+    with add, names set directly are parsed with parse_conflict_name. The
+    number of aircraft pairs skipped by compute_trajectories_conflicts is
+    kept in pruned."""
+
+    def __init__(self, *args, **kwargs):
+        self.conflict_keys = OD()
+        self.aircraft_index = OD()
+        self.pruned = OD([('lifetime', 0), ('vertical', 0)])
+        super().__init__(*args, **kwargs)
+
+    def __setitem__(self, name, df):
+        if name not in self.conflict_keys:
+            self._register(name, parse_conflict_name(name))
+        super().__setitem__(name, df)
+
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        key = self.conflict_keys.pop(name)
+        for aname in set((key.air1, key.air2)):
+            self.aircraft_index[aname].remove(name)
+
+    def _register(self, name, key):
+        self.conflict_keys[name] = key
+        for aname in set((key.air1, key.air2)):
+            self.aircraft_index.setdefault(aname, list()).append(name)
+
+    def add(self, key, df):
+        """Stores the dataframe of a conflict given its ConflictKey, returns its name"""
+        name = get_conflict_name(key)
+        if name not in self.conflict_keys:
+            self._register(name, key)
+        super().__setitem__(name, df)
+        return name
+
+    def copy(self):
+        new = self.__class__()
+        for name, df in self.items():
+            new.add(self.conflict_keys[name], df)
+        new.pruned.update(self.pruned)
+        return new
+
+    def has_conflict(self, air1, air2, kind):
+        """Checks whether any conflict of the given kind exists between air1 and air2, in this order"""
+        return any(self.conflict_keys[name][:3] == (air1, air2, kind) for name in self.aircraft_index.get(air1, ()))
+
+
+def get_conflict_name(key):
+    return '_'.join([key.air1, key.air2, key.kind + str(key.ordinal)])
+
+
+def get_conflict_tag(key):
+    """Returns the kind and ordinal of a conflict as in its name (C0, O1...), or None if unknown"""
+    return None if key.kind is None else key.kind + str(key.ordinal)
+
+
+def parse_conflict_name(name):
+    """Parses the conflict names made by get_conflict_name, AIR1_AIR2_[C|O]N"""
+    parts = name.split('_')
+    (air1, air2) = parts[:2]
+    if len(parts) > 2 and parts[-1][1:].isdigit():
+        return ConflictKey(air1, air2, parts[-1][0], int(parts[-1][1:]))
+    return ConflictKey(air1, air2, None, None)
+
+
+def get_aircraft_conflicts(conflicts, aname):
+    """Returns the (name, ConflictKey) of the conflicts in which an aircraft
+    takes part. Plain dicts of conflicts are scanned parsing their names."""
+    if isinstance(conflicts, ConflictRegistry):
+        return [(name, conflicts.conflict_keys[name]) for name in conflicts.aircraft_index.get(aname, ())]
+    keys = [(name, parse_conflict_name(name)) for name in conflicts]
+    return [(name, key) for (name, key) in keys if aname in (key.air1, key.air2)]
+
 
 ##################################################################################
 
 def compute_aircrafts_trjs(logdict, sector):
     if isinstance(logdict, pd.DataFrame):
         logdf = logdict
+    elif isinstance(logdict['call_update'], pd.DataFrame):
+        # Columnar output of the parser, copy it because times are modified below
+        logdf = logdict['call_update'].copy()
+        logdf.columns = CALL_NAMES
     else:
         logdf = pd.DataFrame(logdict['call_update'], columns=CALL_NAMES)
 
@@ -34,25 +123,52 @@ def compute_aircrafts_trjs(logdict, sector):
     logdf.time = (logdf.time/1000).round()
 
     # Compute aircrafts trajectories
-    trajectories = OD()
-    for name in logdf.name.unique():
-        trajectories[name] = util.compute_aircraft_trjs(logdf, name, sector)
-    return trajectories
+    return util.compute_all_aircraft_trjs(logdf, sector)
 
 
-def compute_conflicts(logdict, params, tmax=600, cometap=COMETAP):
+def compute_conflicts(logdict, params, tmax=600, cometap=COMETAP, vectorized=True, sparse=True):
     """Compute pairwise conflicts between aircrafts. A conflict can be empty
-    if the two aircrafts do not encounter.
+    if the two aircrafts do not encounter. If vectorized is False, times to
+    conflict are computed row by row with the original scalar functions.
+    If sparse is True, conflicts only keep the ticks where both aircrafts
+    exist and the conflict is within tmax, otherwise they span all the ticks
+    of any of the two aircrafts.
+    """
+    trajectories = compute_aircrafts_trjs(logdict, params['sector'])
+    conflicts = compute_trajectories_conflicts(trajectories, params, tmax, cometap, vectorized, sparse)
+    if sparse:
+        print('\t\tSkipped %d aircraft pairs that do not coexist and %d vertically separated' %
+              (conflicts.pruned['lifetime'], conflicts.pruned['vertical']))
+    return conflicts, trajectories
+
+
+def compute_trajectories_conflicts(trajectories, params, tmax=600, cometap=COMETAP, vectorized=True, sparse=True):
+    """Compute pairwise conflicts between the aircrafts of the trajectories
+    computed by compute_aircrafts_trjs. Returns a ConflictRegistry. If sparse
+    is True, pairs of aircrafts that never coexist in the log are skipped,
+    and the trajectories are clipped to the time both aircrafts coexist.
+    Pairs whose predicted altitudes within tmax are always further apart than
+    the altitude threshold of COMETA are skipped too.
     """
     crossingpoints = params['crossingpoints']
     sector = params['sector']
-    trajectories = compute_aircrafts_trjs(logdict, sector)
 
-    # Compute all potential interactions between predefined aircraft trajectories
-    potential_interactions = get_potential_interactions(params)
+    # Compute all potential interactions between predefined aircraft trajectories,
+    # unless they come precomputed in a compiled sky
+    if 'interactions' in params:
+        potential_interactions = params['interactions']
+    else:
+        potential_interactions = get_potential_interactions(params)
+    # Same for the values of the crossing points, otherwise they are computed
+    # once per crossing point in this call
+    crossing_features = params['crossing_features'] if 'crossing_features' in params else OD()
+
+    # Time span and predicted altitudes of each aircraft in the log
+    lifetimes = util.get_trajectories_lifetimes(trajectories)
+    bands = util.get_trajectories_altitude_bands(trajectories, tmax)
 
     # Compute aircrafts conflicts
-    conflicts = OD()
+    conflicts = ConflictRegistry()
     for aname1, air1_interactions in potential_interactions.items():
         # Fetch information from first aircraft
         if aname1 not in trajectories:
@@ -68,33 +184,43 @@ def compute_conflicts(logdict, params, tmax=600, cometap=COMETAP):
             air2 = trajectories[aname2]
             locs2 = params['aircrafts'][aname2]['flightpath']
 
+            # Skip aircrafts that do not coexist, and clip the rest to the common time
+            if sparse:
+                start = max(lifetimes[aname1][0], lifetimes[aname2][0])
+                end = min(lifetimes[aname1][1], lifetimes[aname2][1])
+                if start > end:
+                    conflicts.pruned['lifetime'] += 1
+                    continue
+                vgap = max(bands[aname1][0] - bands[aname2][1], bands[aname2][0] - bands[aname1][1])
+                if vgap >= cometap['umbral_altitud_conflicto']:
+                    conflicts.pruned['vertical'] += 1
+                    continue
+                (trj1, trj2) = (air1.loc[start:end], air2.loc[start:end])
+            else:
+                (trj1, trj2) = (air1, air2)
+
             # Crossing conflicts
             for i, crossing in enumerate(crossings.values()):
-                # Create name of new conflict between two aircrafts
-                name = '_'.join([aname1, aname2,'C'+str(i)])
+                point = tuple(crossing[0])
+                if point not in crossing_features:
+                    crossing_features[point] = get_crossing_features(crossing, sector, crossingpoints)
                 # compute and store conflict
-                conflicts[name] = compute_crossing_conflict(crossing, air1, air2, locs1, locs2, sector, crossingpoints, tmax, cometap)
+                conflicts.add(ConflictKey(aname1, aname2, 'C', i),
+                    compute_crossing_conflict(crossing, trj1, trj2, locs1, locs2, sector, crossingpoints, tmax, cometap,
+                                              vectorized, sparse, crossing_features[point]))
 
-            # Overlap conflicts should be computed here
+            # Overlap conflicts, skipped if already computed for the pair in the opposite order
+            if conflicts.has_conflict(aname2, aname1, 'O'):
+                continue
             for i, (overlapk, overlapv) in enumerate(overlaps.items()):
-                # Create name of new conflict between two aircrafts
-                name = '_'.join([aname1, aname2,'O'+str(i)])
-                name2 = '_'.join([aname2, aname1,'O'])
-                current_conflicts = conflicts.keys()
-                flagcomputed = False
-                for conname in current_conflicts:
-                    if name2 in conname:
-                        flagcomputed = True
-                        break
-
                 # compute and store conflict
-                if flagcomputed == False:
-                    conflicts[name] = compute_overlap_conflict(overlapk, overlapv, air1, air2, locs1, locs2, sector, crossingpoints, tmax, cometap)
+                conflicts.add(ConflictKey(aname1, aname2, 'O', i),
+                    compute_overlap_conflict(overlapk, overlapv, trj1, trj2, locs1, locs2, sector, crossingpoints, tmax, cometap, vectorized, sparse))
 
-    return conflicts, trajectories
+    return conflicts
 
 
-def compute_crossing_conflict(crossing, air1, air2, locs1, locs2, sector, crossingpoints, tmax, cometap):
+def compute_crossing_conflict(crossing, air1, air2, locs1, locs2, sector, crossingpoints, tmax, cometap, vectorized=True, sparse=True, static=None):
     # Merge dataframes to store properties of the conflicts between this two planes
     df = pd.merge(air1, air2, 'outer', 'time', suffixes=('_a1','_a2'))
     df = df.set_index(df.time.values)#.sort_index()
@@ -108,18 +234,28 @@ def compute_crossing_conflict(crossing, air1, air2, locs1, locs2, sector, crossi
     # Compute_paired_conflicts
     df['Xc'] = crossing[0][0]
     df['Yc'] = crossing[0][1]
-    df['Tc_a1'] = df.apply(get_ttc_a1, axis=1)
-    df['Tc_a2'] = df.apply(get_ttc_a2, axis=1)
+    if vectorized:
+        (xc, yc) = crossing[0]
+        df['Tc_a1'] = get_times_to_location(get_flightpath_arrays(locs1), df['x_a1'].values, df['y_a1'].values, xc, yc, df['v_a1'].values)
+        df['Tc_a2'] = get_times_to_location(get_flightpath_arrays(locs2), df['x_a2'].values, df['y_a2'].values, xc, yc, df['v_a2'].values)
+    else:
+        df['Tc_a1'] = df.apply(get_ttc_a1, axis=1)
+        df['Tc_a2'] = df.apply(get_ttc_a2, axis=1)
     df['Tc_max'] = df[['Tc_a1', 'Tc_a2']].max(axis=1)
     df['Tc_diff'] = np.abs(df['Tc_a1'] - df['Tc_a2'])
+    if sparse:
+        df = _get_conflict_ticks(df, tmax, cometap)
 
     # Add cometa-related conflic values, this does not depend on the type of conflict
-    _add_cometa_values(df, sector, crossingpoints, tmax, cometap, crossing[1])
+    # The values that only depend on the crossing point may come precomputed
+    if static is None:
+        static = get_crossing_features(crossing, sector, crossingpoints)
+    _add_cometa_values(df, sector, crossingpoints, tmax, cometap, crossing[1], static=static)
 
     return df
 
 
-def compute_overlap_conflict(overlapk, overlapv, air1, air2, locs1, locs2, sector, crossingpoints, tmax, cometap):
+def compute_overlap_conflict(overlapk, overlapv, air1, air2, locs1, locs2, sector, crossingpoints, tmax, cometap, vectorized=True, sparse=True):
     # Merge dataframes to store properties of the conflicts between this two planes
     df = pd.merge(air1, air2, 'outer', 'time', suffixes=('_a1','_a2'))
     df = df.set_index(df.time.values)
@@ -321,23 +457,46 @@ def compute_overlap_conflict(overlapk, overlapv, air1, air2, locs1, locs2, secto
         return get_location_at_time(locs1, (df['x_a1'],df['y_a1']), df['v_a1'], df['Tc_a1'])[1]
 
     # Compute_paired_conflicts
-    if bopposite:
-        df['Tc_a1'] = df.apply(get_ttc_opposite, axis=1)
+    if vectorized:
+        path1 = get_flightpath_arrays(locs1)
+        path2 = get_flightpath_arrays(locs2)
+        columns = [df[c].values for c in ('x_a1', 'y_a1', 'x_a2', 'y_a2', 'v_a1', 'v_a2')]
+        if bopposite:
+            df['Tc_a1'] = get_overlap_ttcs_opposite(path1, path2, *columns)
+        else:
+            df['Tc_a1'] = get_overlap_ttcs_solidary(path1, path2, *columns, overlapv)
+        df['Tc_a2'] = df['Tc_a1']
+        (df['Xc'], df['Yc']) = get_locations_at_time(path1, df['x_a1'].values, df['y_a1'].values, df['v_a1'].values, df['Tc_a1'].values)
     else:
-        df['Tc_a1'] = df.apply(get_ttc_solidary, axis=1)
+        if bopposite:
+            df['Tc_a1'] = df.apply(get_ttc_opposite, axis=1)
+        else:
+            df['Tc_a1'] = df.apply(get_ttc_solidary, axis=1)
 
-    df['Tc_a2'] = df['Tc_a1']
-    df['Xc'] = df.apply(get_Xc, axis=1)
-    df['Yc'] = df.apply(get_Yc, axis=1)
+        df['Tc_a2'] = df['Tc_a1']
+        df['Xc'] = df.apply(get_Xc, axis=1)
+        df['Yc'] = df.apply(get_Yc, axis=1)
     df['Tc_max'] = df[['Tc_a1', 'Tc_a2']].max(axis=1)
     df['Tc_diff'] = np.abs(df['Tc_a1'] - df['Tc_a2'])
+    if sparse:
+        df = _get_conflict_ticks(df, tmax, cometap)
 
     _add_cometa_values(df, sector, crossingpoints, tmax, cometap, np.NaN, True)
 
     return df
 
 
-def _add_cometa_values(df, sector, crossingpoints, tmax, cometap, THcrossing=np.NaN, isoverlap=False):
+def _get_conflict_ticks(df, tmax, cometap):
+    """Keeps the ticks of a conflict where both aircrafts exist, the conflict
+    is within tmax and their altitudes at the conflict are closer than the
+    altitude threshold, the only ones where it can be active"""
+    bkeep = util.is_conflict_intime(df, tmax) & ~pd.isnull(df['x_a1']) & ~pd.isnull(df['x_a2'])
+    vdist = np.abs((df['Tc_a1']*df['vz_a1'] + df['z_a1']) - (df['Tc_a2']*df['vz_a2'] + df['z_a2']))
+    bkeep &= vdist < cometap['umbral_altitud_conflicto']
+    return df.loc[np.asarray(bkeep)].copy()
+
+
+def _add_cometa_values(df, sector, crossingpoints, tmax, cometap, THcrossing=np.NaN, isoverlap=False, static=None):
     ####################################################################
     # Compute angle between trajectories at the conflict
     # THIS EQUATION LACKS TESTING
@@ -347,7 +506,9 @@ def _add_cometa_values(df, sector, crossingpoints, tmax, cometap, THcrossing=np.
 
     ####################################################################
     #Compute spatial and temporal boundaries of the conflict
-    df['isconflictinsector'] = util.is_conflict_insector(df, sector)
+    if static is None:
+        static = _get_static_values(df['Xc'], df['Yc'], sector, crossingpoints)
+    df['isconflictinsector'] = static['isconflictinsector']
     df['intime'] = util.is_conflict_intime(df, tmax)
 
     ####################################################################
@@ -390,7 +551,7 @@ def _add_cometa_values(df, sector, crossingpoints, tmax, cometap, THcrossing=np.
 
     ####################################################################
     # A2: Distance from conflict point to sector border
-    df['A2_hdist_conflict_sector'] = get_distance_to_sector(sector[:-1], df['Xc'], df['Yc'])
+    df['A2_hdist_conflict_sector'] = static['A2_hdist_conflict_sector']
 
     ####################################################################
     # A3: Convergence between routes
@@ -398,41 +559,146 @@ def _add_cometa_values(df, sector, crossingpoints, tmax, cometap, THcrossing=np.
 
     ####################################################################
     # A4: Proximity from conflict to standard flows crossing points
-    df['A4_hdist_conflict_crossingpoints'] =    get_distance_to_crossing_points(crossingpoints, df['Xc'], df['Yc'])
-    # When flows are not defined, crossing points may be missing
-    bh1 = df['A4_hdist_conflict_crossingpoints'] == False
-    bh2 = df['A4_hdist_conflict_crossingpoints'] < 0.5
-    bh3 = np.isnan(df['A4_hdist_conflict_crossingpoints'])
-    bhdist = np.logical_or(np.logical_or(bh1,bh2),bh3)
-    df.loc[bhdist, 'A4_hdist_conflict_crossingpoints'] = 1
+    df['A4_hdist_conflict_crossingpoints'] = static['A4_hdist_conflict_crossingpoints']
 
     ####################################################################
     # A5: Temporal distance to conflict
     df['A5_relative_time2conflict'] = df['Tc_diff'] / df['Tc_max']
 
 
+def _get_static_values(Xc, Yc, sector, crossingpoints):
+    """Conflict values that only depend on the location of the conflict:
+    whether it is in the sector, and its distance to the sector border and to
+    the crossing points of the flows"""
+    static = OD()
+    static['isconflictinsector'] = util.is_point_insector(Xc, Yc, sector)
+    static['A2_hdist_conflict_sector'] = get_distance_to_sector(sector[:-1], Xc, Yc)
+    dist = np.asarray(get_distance_to_crossing_points(crossingpoints, Xc, Yc)) * np.ones(np.shape(Xc))
+    # When flows are not defined, crossing points may be missing
+    bh1 = dist == False
+    bh2 = dist < 0.5
+    bh3 = np.isnan(dist)
+    bhdist = np.logical_or(np.logical_or(bh1,bh2),bh3)
+    static['A4_hdist_conflict_crossingpoints'] = np.where(bhdist, 1, dist)
+    return static
+
+
+def get_crossing_features(crossing, sector, crossingpoints):
+    """Values of a crossing conflict that only depend on its crossing point,
+    see _get_static_values"""
+    ((xc, yc), _) = crossing
+    static = _get_static_values(np.array([xc]), np.array([yc]), sector, crossingpoints)
+    return OD((name, values[0]) for name, values in static.items())
+
+
+def get_crossings_features(interactions, sector, crossingpoints):
+    """Values of get_crossing_features of all the crossing points of the
+    potential interactions, indexed by crossing point. They are computed once
+    per task by sky.compile_sky, and must not be modified."""
+    features = OD()
+    for air1_interactions in interactions.values():
+        for (crossings, _) in air1_interactions.values():
+            for crossing in crossings.values():
+                point = tuple(crossing[0])
+                if point not in features:
+                    features[point] = get_crossing_features(crossing, sector, crossingpoints)
+    return features
+
+
 def get_potential_interactions(params, force_self=False):
     interactions = OD()
-    for aname1, aircraft1 in params['aircrafts'].items():
+    aircrafts = params['aircrafts']
+    # Segments pairs close enough to interact, computed once for each pair of aircrafts
+    candidates = get_candidate_segments(aircrafts)
+    for aname1, aircraft1 in aircrafts.items():
         interactions[aname1] = OD()
-        for aname2, aircraft2 in params['aircrafts'].items():
+        for aname2, aircraft2 in aircrafts.items():
             # avoid double and self computation of conflicts
             if aname1 == aname2 and not force_self:
                 continue
+            if aname1 == aname2:
+                pairs = None
+            elif (aname1, aname2) in candidates:
+                pairs = candidates[(aname1, aname2)]
+            else:
+                # No segment of the two flightpaths is close enough to interact
+                continue
             is_shared_route = is_same_flow(aname1, aname2, params['flows'])
             # get potential interactions between the two locations
-            ret = get_trajectories_interactions(aircraft1['flightpath'], aircraft2['flightpath'], is_shared_route)
+            ret = get_trajectories_interactions(aircraft1['flightpath'], aircraft2['flightpath'], is_shared_route, pairs)
             if len(ret[0]) > 0 or len(ret[1]) > 0:
                 interactions[aname1][aname2] = ret
     return interactions
 
 
-def get_trajectories_interactions(locs1, locs2, same_route=False):
+def get_segments_grid(aircrafts, cellsize=GRID_CELLSIZE):
+    """Uniform grid index of the flightpath segments of the aircrafts. Returns
+    the bounding boxes of the segments, enlarged by get_segment_margin, and a
+    dict that maps each cell of the grid to the segments, as (aircraft name,
+    segment number), whose bounding box touches it."""
+    bboxes = OD()
+    grid = OD()
+    for aname, aircraft in aircrafts.items():
+        locs = aircraft['flightpath']
+        for i, ((x1,y1), (x2,y2)) in enumerate(zip(locs[:-1], locs[1:])):
+            margin = get_segment_margin((x1,y1), (x2,y2))
+            bbox = (min(x1,x2) - margin, min(y1,y2) - margin, max(x1,x2) + margin, max(y1,y2) + margin)
+            bboxes[(aname, i)] = bbox
+            for cx in range(int(np.floor(bbox[0] / cellsize)), int(np.floor(bbox[2] / cellsize)) + 1):
+                for cy in range(int(np.floor(bbox[1] / cellsize)), int(np.floor(bbox[3] / cellsize)) + 1):
+                    grid.setdefault((cx,cy), list()).append((aname, i))
+    return bboxes, grid
+
+
+def get_segment_margin(p1, p2):
+    """Distance from a segment to the farthest point that is_point_in_segment
+    accepts as part of it. Those points fill the ellipse with foci at the ends
+    of the segment where AP+PB < AB+eps_route, whose semi-minor axis is
+    sqrt(L*eps_route/2 + eps_route**2/4) for a segment of length L, and no
+    point of the ellipse is farther than that from the segment."""
+    length = np.hypot(p2[0] - p1[0], p2[1] - p1[1])
+    return np.sqrt(length * eps_route / 2 + eps_route**2 / 4)
+
+
+def get_candidate_segments(aircrafts, cellsize=GRID_CELLSIZE):
+    """Finds the pairs of segments of different aircrafts whose bounding boxes
+    overlap, the only ones that can cross or overlap. Returns a dict
+    {(aname1, aname2): {i: set of j}} with both orders of each pair of aircrafts,
+    where i are segments of aname1 and j segments of aname2."""
+    bboxes, grid = get_segments_grid(aircrafts, cellsize)
+
+    # Each pair of segments sharing a cell is tested once, whatever its order
+    pairs = set()
+    for segments in grid.values():
+        for (s1, s2) in itertools.combinations(segments, 2):
+            if s1[0] != s2[0]:
+                pairs.add((s1, s2) if s1 < s2 else (s2, s1))
+
+    candidates = OD()
+    for (s1, s2) in pairs:
+        (b1, b2) = (bboxes[s1], bboxes[s2])
+        if b1[0] <= b2[2] and b2[0] <= b1[2] and b1[1] <= b2[3] and b2[1] <= b1[3]:
+            ((aname1, i), (aname2, j)) = (s1, s2)
+            candidates.setdefault((aname1, aname2), dict()).setdefault(i, set()).add(j)
+            candidates.setdefault((aname2, aname1), dict()).setdefault(j, set()).add(i)
+    return candidates
+
+
+def get_trajectories_interactions(locs1, locs2, same_route=False, candidates=None):
+    """Finds the crossings and overlaps between two flightpaths. If candidates
+    is given, as a dict {i: set of j} like in get_candidate_segments, only
+    those pairs of segments are tested.
+    """
     overlaps = OD()
     crossings = OD()
     for i, p1a in enumerate(locs1[:-1]):
+        if candidates is not None and i not in candidates:
+            continue
+        jcandidates = None if candidates is None else candidates[i]
         p1b = locs1[i+1]
         for j, p2a in enumerate(locs2[:-1]):
+            if jcandidates is not None and j not in jcandidates:
+                continue
             p2b = locs2[j+1]
             S1 = (p1a, p1b)
             S2 = (p2a, p2b)
@@ -495,6 +761,8 @@ def get_trajectories_interactions(locs1, locs2, same_route=False):
             if ret is not None and ret not in cvalues:
                 if is_same_point(p1a, ret):
                     p1a = locs1[i-1]
+                    # The segment changed, test the rest of the row without pruning
+                    jcandidates = None
                 if is_same_point(p2a, ret):
                     p2a = locs2[j-1]
                 v1 = [p1a[0] - ret[0], p1a[1] - ret[1]]
@@ -648,6 +916,208 @@ def get_time_to_location(locs, p0, p1, v):
         return dist / v
 
 
+########################################################################
+## Vectorized versions of the path functions, they operate on arrays of
+## points and return NaN where the scalar functions return NaN or None
+########################################################################
+
+def get_flightpath_arrays(locs):
+    """Returns the coordinates of the locations of a flightpath, the length
+    of its segments and the distance along the path to each location. The
+    arrays are computed once per flightpath and must not be modified."""
+    return _get_flightpath_arrays(tuple(tuple(loc) for loc in locs))
+
+
+@functools.lru_cache(maxsize=1024)
+def _get_flightpath_arrays(locs):
+    xy = np.array(locs, dtype=float).reshape(-1, 2)
+    (x, y) = (xy[:,0], xy[:,1])
+    lengths = np.sqrt((x[1:]-x[:-1]) * (x[1:]-x[:-1]) + (y[1:]-y[:-1]) * (y[1:]-y[:-1]))
+    cumlengths = np.concatenate(([0.], np.cumsum(lengths)))
+    path = OD([('x', x), ('y', y), ('lengths', lengths), ('cumlengths', cumlengths)])
+    for values in path.values():
+        values.flags.writeable = False
+    return path
+
+
+def get_segments_in_path(path, x, y):
+    """Index of the first segment of the path that contains each point, same
+    test as is_point_in_segment. Points outside the path get -1."""
+    x = np.asarray(x, dtype=float).reshape(-1, 1)
+    y = np.asarray(y, dtype=float).reshape(-1, 1)
+    (x1, y1) = (path['x'][:-1], path['y'][:-1])
+    (x2, y2) = (path['x'][1:], path['y'][1:])
+    AP = np.sqrt((x-x1) * (x-x1) + (y-y1) * (y-y1))
+    PB = np.sqrt((x2-x) * (x2-x) + (y2-y) * (y2-y))
+    inseg = np.abs(path['lengths'] - (AP + PB)) < eps_route
+    segments = np.argmax(inseg, axis=1)
+    segments[~inseg.any(axis=1)] = -1
+    return segments
+
+
+def get_distances_to_location(path, x0, y0, x1, y1):
+    """Vectorized get_distance_to_location. Computes the signed distance
+    along the path from each point (x0,y0) to each point (x1,y1), any of the
+    two can be a scalar."""
+    (x0, y0, x1, y1) = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (x0, y0, x1, y1)])
+    s0 = get_segments_in_path(path, x0, y0)
+    s1 = get_segments_in_path(path, x1, y1)
+    (x0, y0, x1, y1) = (x0.ravel(), y0.ravel(), x1.ravel(), y1.ravel())
+    (px, py, cumlengths) = (path['x'], path['y'], path['cumlengths'])
+
+    # Sort the points so that the first one always comes first in the path
+    backwards = s0 > s1
+    (sa, sb) = (np.where(backwards, s1, s0), np.where(backwards, s0, s1))
+    (xa, ya) = (np.where(backwards, x1, x0), np.where(backwards, y1, y0))
+    (xb, yb) = (np.where(backwards, x0, x1), np.where(backwards, y0, y1))
+
+    # Points in different segments: end of the first segment, intermediate
+    # segments and start of the last segment
+    ea = np.minimum(sa + 1, len(px) - 1)
+    dist = np.sqrt((xa-px[ea]) * (xa-px[ea]) + (ya-py[ea]) * (ya-py[ea]))
+    dist += cumlengths[sb] - cumlengths[ea]
+    dist += np.sqrt((xb-px[sb]) * (xb-px[sb]) + (yb-py[sb]) * (yb-py[sb]))
+    dist = np.where(backwards, -dist, dist)
+
+    # Points in the same segment: relative distance to the segment start
+    same = s0 == s1
+    dist1 = np.sqrt((px[s0]-x0) * (px[s0]-x0) + (py[s0]-y0) * (py[s0]-y0))
+    dist2 = np.sqrt((px[s0]-x1) * (px[s0]-x1) + (py[s0]-y1) * (py[s0]-y1))
+    dist = np.where(same, dist2 - dist1, dist)
+
+    dist[(s0 < 0) | (s1 < 0)] = np.nan
+    return dist
+
+
+def get_times_to_location(path, x0, y0, x1, y1, v):
+    """Vectorized get_time_to_location"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return get_distances_to_location(path, x0, y0, x1, y1) / v
+
+
+def get_locations_at_distance(path, x, y, d):
+    """Vectorized get_location_at_distance, returns the arrays of x and y
+    coordinates of the new locations"""
+    (x, y, d) = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (x, y, d)])
+    (x, y, d) = (x.ravel(), y.ravel(), d.ravel())
+    (px, py, cumlengths) = (path['x'], path['y'], path['cumlengths'])
+    segments = get_segments_in_path(path, x, y)
+    valid = (segments >= 0) & ~np.isnan(d)
+
+    with np.errstate(invalid='ignore'):
+        # Distance to the end of the current segment
+        sno = np.where(valid, segments, 0) + 1
+        (x2, y2) = (px[sno], py[sno])
+        d1 = np.sqrt((x2-x) * (x2-x) + (y2-y) * (y2-y))
+        theta = np.arctan2(y2-y, x2-x)
+        (xout, yout) = (x + d*np.cos(theta), y + d*np.sin(theta))
+
+        # Locations beyond the current segment. As in get_location_at_distance,
+        # idx counts the segments from the current one but it is used as an
+        # index of the whole flightpath.
+        beyond = ~(d < d1)
+        rdist = d - d1 + cumlengths[sno]
+        idx = np.searchsorted(cumlengths, np.where(beyond, rdist, np.inf), side='right') - sno
+        idx = np.clip(idx, 1, len(px) - 2)
+        drem = d - d1 - (cumlengths[sno+idx-1] - cumlengths[sno])
+        theta = np.arctan2(py[idx+1]-py[idx], px[idx+1]-px[idx])
+        xout = np.where(beyond, px[idx] + drem*np.cos(theta), xout)
+        yout = np.where(beyond, py[idx] + drem*np.sin(theta), yout)
+
+        # Locations past the end of the flightpath
+        last = beyond & (rdist >= cumlengths[-1])
+        xout[last] = px[-1]
+        yout[last] = py[-1]
+
+    xout[~valid] = np.nan
+    yout[~valid] = np.nan
+    return xout, yout
+
+
+def get_locations_at_time(path, x, y, v, t):
+    """Vectorized get_location_at_time"""
+    return get_locations_at_distance(path, x, y, np.asarray(v, dtype=float) * t)
+
+
+def get_overlap_ttcs_solidary(path1, path2, x1, y1, x2, y2, v1, v2, overlap):
+    """Vectorized get_ttc_solidary of compute_overlap_conflict, aircrafts
+    flying the overlap in the same sense. Each case of the scalar function
+    is a mask of the rows it discards, the comments give its number."""
+    [(xs, ys), (xe, ye)] = overlap
+    ttc = np.full(len(x1), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Get relative position with respect to the entry node. As in the
+        # scalar function, the position of the first aircraft is used twice.
+        dtos_a1 = get_distances_to_location(path1, x1, y1, xs, ys)
+        dtos_a2 = get_distances_to_location(path2, x1, y1, xs, ys)
+        valid = ~(np.isnan(dtos_a1) | np.isnan(dtos_a2))                            # 1
+        entered = valid & ((dtos_a1 < 0) | (dtos_a2 < 0))
+        notentered = valid & ~entered
+
+        ##############################################################
+        # Any of the aircrafts have crossed the initial crossing point
+        ##############################################################
+        dtoe_a1 = get_distances_to_location(path1, x1, y1, xe, ye)
+        dtoe_a2 = get_distances_to_location(path2, x2, y2, xe, ye)
+        entered &= ~(np.isnan(dtoe_a1) | np.isnan(dtoe_a2))                        # 2
+        entered &= ~((dtoe_a1 < 0) | (dtoe_a2 < 0))                                # 3
+        ahead = dtoe_a1 >= dtoe_a2
+
+        mask = entered & ahead & ~(v2 >= v1)                                       # 4
+        rdist = get_distances_to_location(path1, x1, y1, x2, y2)
+        mask &= ~(np.isnan(rdist) | (rdist < 0))                                   # 5
+        tgap = rdist / (v1 - v2)
+        mask &= ~(tgap > dtoe_a2 / v2)                                             # 6
+        ttc[mask] = tgap[mask]
+
+        mask = entered & ~ahead & ~(v1 >= v2)                                      # 7
+        rdist = get_distances_to_location(path2, x2, y2, x1, y1)
+        mask &= ~(np.isnan(rdist) | (rdist < 0))                                   # 8
+        tgap = rdist / (v2 - v1)
+        mask &= ~(tgap > dtoe_a1 / v1)                                             # 9
+        ttc[mask] = tgap[mask]
+
+        ##############################################################
+        # Both aircrafts have not entered the overlap segment yet
+        ##############################################################
+        ttos_a1 = dtos_a1 / v1
+        ttos_a2 = dtos_a2 / v2
+        first = ttos_a1 < ttos_a2
+
+        mask = notentered & first & ~(v1 >= v2)                                    # 10
+        (nx, ny) = get_locations_at_time(path1, x1, y1, v1, ttos_a2)
+        mask &= ~np.isnan(nx)                                                      # 11
+        ttleave = get_times_to_location(path1, nx, ny, xe, ye, v1)
+        rdist = get_distances_to_location(path2, xs, ys, nx, ny)
+        mask &= ~(np.isnan(rdist) | (rdist < 0))                                   # 12
+        tgap = rdist / (v2 - v1)
+        mask &= ~(tgap > ttleave)                                                  # 13
+        ttc[mask] = tgap[mask]
+
+        mask = notentered & ~first & ~(v2 >= v1)                                   # 14
+        (nx, ny) = get_locations_at_time(path2, x2, y2, v2, ttos_a1)
+        mask &= ~np.isnan(nx)                                                      # 15
+        ttleave = get_times_to_location(path2, nx, ny, xe, ye, v2)
+        rdist = get_distances_to_location(path1, xs, ys, nx, ny)
+        mask &= ~(np.isnan(rdist) | (rdist < 0))                                   # 16
+        tgap = rdist / (v1 - v2)
+        mask &= ~(tgap > ttleave)                                                  # 17
+        ttc[mask] = tgap[mask]
+
+    return ttc
+
+
+def get_overlap_ttcs_opposite(path1, path2, x1, y1, x2, y2, v1, v2):
+    """Vectorized get_ttc_opposite of compute_overlap_conflict, aircrafts
+    flying the overlap in opposite senses"""
+    rdist1 = get_distances_to_location(path1, x1, y1, x2, y2)
+    rdist2 = get_distances_to_location(path2, x2, y2, x1, y1)
+    ok1 = ~(np.isnan(rdist1) | (rdist1 < 0))
+    ok2 = ~(np.isnan(rdist2) | (rdist2 < 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(ok1, rdist1, np.where(ok2, rdist2, np.nan)) / (v1 + v2)
+
+
 def is_point_in_trajectory(locs, p):
     """Checks wether a certain point lies in a given trajectory"""
     for s in zip(locs[:-1],locs[1:]):
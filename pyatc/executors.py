@@ -0,0 +1,222 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This file is part of pyatc library
+#
+# Authors:
+# Jorge Ibáñez Gijón <jorge.ibannez@uam.es> [2020-2022]
+# Departamento de Psicología Básica, Facultad de Psicología
+# Universidad Autónoma de Madrid
+#
+# © Copyright 2022 Jorge Ibáñez Gijón. All rights reserved
+#
+
+"""
+Executors of the batch runners.
+
+An executor runs a function over a list of configurations and yields the
+results as they finish. The batch runners use the local pool of
+runners.PoolExecutor by default, or the executor set with
+runners.set_executor.
+
+QueueExecutor spreads the jobs over several machines through a job queue
+in a directory of shared storage, served by any number of worker processes
+started on each machine with:
+
+    python -m pyatc worker QUEUEPATH [--taskpath TASKPATH]
+
+The queue keeps one file per job. A job is pickled in pending/, claimed by a
+worker by renaming it to running/, and its result is pickled in done/,
+where the submitter collects it. Renames are atomic, so workers never run
+the same job twice. Functions are pickled by reference, so they must be
+module level functions of a package installed in the workers.
+"""
+
+import os
+import time
+import uuid
+import pickle
+import socket
+import threading
+import traceback
+
+from .cache import _write_atomic
+
+
+# Seconds between the checks of the queue directories
+QUEUE_POLL = 1.0
+
+# Directories of the jobs of a queue by status
+QUEUE_DIRS = ('pending', 'running', 'done')
+
+# Seconds between the heartbeats of the worker running a job, which keep
+# its running file recent, see requeue_jobs
+QUEUE_HEARTBEAT = 10.0
+
+# Seconds without heartbeats after which a claimed job is submitted again,
+# because its worker was killed or lost the shared storage
+QUEUE_JOB_TIMEOUT = 300.0
+
+
+class Executor(object):
+    """Interface of the executors of the batch runners"""
+
+    def run(self, fcn, configs, star=False):
+        """Generator of (index, result) pairs of fcn applied to each config,
+        in the order they finish. With star the configs are tuples of the
+        arguments of fcn."""
+        raise NotImplementedError
+
+
+class QueueExecutor(Executor):
+    """Executor that submits jobs to the queue in queuepath, see run_worker.
+    Jobs whose worker sends no heartbeat for job_timeout seconds are
+    submitted again, so that the jobs of killed workers are not lost. None
+    disables it. Late results of jobs that ran twice are removed. When a job fails, or the results are not collected,
+    the other jobs of the batch are removed from the queue."""
+
+    def __init__(self, queuepath, poll=QUEUE_POLL, job_timeout=QUEUE_JOB_TIMEOUT):
+        self.queuepath = queuepath
+        self.poll = poll
+        self.job_timeout = job_timeout
+        for dirname in QUEUE_DIRS:
+            os.makedirs(os.path.join(queuepath, dirname), exist_ok=True)
+
+    def run(self, fcn, configs, star=False):
+        batch = uuid.uuid4().hex[:12]
+        names = dict()
+        for (i, config) in enumerate(configs):
+            name = '%s_%06d.pkl' % (batch, i)
+            job = pickle.dumps((fcn, config, star), protocol=pickle.HIGHEST_PROTOCOL)
+            _write_atomic(os.path.join(self.queuepath, 'pending', name), lambda f: f.write(job))
+            names[name] = i
+
+        remaining = set(names)
+        consumed = set()
+        donepath = os.path.join(self.queuepath, 'done')
+        try:
+            while len(remaining) > 0:
+                listed = os.listdir(donepath)
+                cancel_jobs(self.queuepath, consumed.intersection(listed))
+                finished = remaining.intersection(listed)
+                for name in sorted(finished):
+                    with open(os.path.join(donepath, name), 'rb') as f:
+                        (ok, result) = pickle.load(f)
+                    os.remove(os.path.join(donepath, name))
+                    remaining.remove(name)
+                    consumed.add(name)
+                    if not ok:
+                        raise RuntimeError('Job %s failed in the queue worker:\n%s' % (name, result))
+                    yield (names[name], result)
+                if len(finished) == 0:
+                    if self.job_timeout is not None:
+                        requeue_jobs(self.queuepath, self.job_timeout, remaining)
+                    time.sleep(self.poll)
+        finally:
+            cancel_jobs(self.queuepath, remaining.union(consumed))
+
+
+def run_worker(queuepath, poll=QUEUE_POLL, idle_timeout=None, maxjobs=None, heartbeat=QUEUE_HEARTBEAT):
+    """Runs the jobs of the queue in queuepath until it has been idle for
+    idle_timeout seconds (forever if None), or after maxjobs jobs. Several
+    workers, in the same or different machines, can serve the same queue.
+    While a job runs, its running file is touched every heartbeat seconds."""
+    for dirname in QUEUE_DIRS:
+        os.makedirs(os.path.join(queuepath, dirname), exist_ok=True)
+    worker = '%s-%d' % (socket.gethostname(), os.getpid())
+    print('\tWorker %s serving the queue %s' % (worker, queuepath))
+
+    njobs = 0
+    idle = time.time()
+    while maxjobs is None or njobs < maxjobs:
+        claimed = claim_job(queuepath, worker)
+        if claimed is None:
+            if idle_timeout is not None and time.time() - idle > idle_timeout:
+                break
+            time.sleep(poll)
+            continue
+
+        (name, runningpath) = claimed
+        stop = threading.Event()
+        beating = threading.Thread(target=_heartbeat, args=(runningpath, heartbeat, stop), daemon=True)
+        beating.start()
+        try:
+            with open(runningpath, 'rb') as f:
+                (fcn, config, star) = pickle.load(f)
+            result = (True, fcn(*config) if star else fcn(config))
+        except Exception:
+            result = (False, traceback.format_exc())
+            print('\t[ERROR] Job %s failed:\n%s' % (name, result[1]))
+        finally:
+            stop.set()
+            beating.join()
+        try:
+            data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            data = pickle.dumps((False, traceback.format_exc()), protocol=pickle.HIGHEST_PROTOCOL)
+        _write_atomic(os.path.join(queuepath, 'done', name), lambda f: f.write(data))
+        try:
+            os.remove(runningpath)
+        except OSError:
+            # The job timed out and was submitted again
+            pass
+        njobs += 1
+        idle = time.time()
+    print('\tWorker %s finished after %d jobs' % (worker, njobs))
+    return njobs
+
+
+def _heartbeat(runningpath, heartbeat, stop):
+    while not stop.wait(heartbeat):
+        try:
+            os.utime(runningpath)
+        except OSError:
+            # The job was submitted again
+            return
+
+
+def claim_job(queuepath, worker):
+    """Claims the oldest pending job of the queue for a worker. Returns the
+    name of the job and the path of its file in running/, or None if there
+    are no pending jobs."""
+    pendingpath = os.path.join(queuepath, 'pending')
+    for name in sorted(n for n in os.listdir(pendingpath) if n.endswith('.pkl')):
+        runningpath = os.path.join(queuepath, 'running', '%s__%s' % (name, worker))
+        try:
+            os.rename(os.path.join(pendingpath, name), runningpath)
+        except OSError:
+            # Another worker claimed it first
+            continue
+        # The first heartbeat, see requeue_jobs
+        os.utime(runningpath)
+        return (name, runningpath)
+    return None
+
+
+def cancel_jobs(queuepath, names):
+    """Removes the jobs in names from pending, and their results from done.
+    Jobs already claimed finish, and their results are left in done."""
+    for name in names:
+        for dirname in ('pending', 'done'):
+            try:
+                os.remove(os.path.join(queuepath, dirname, name))
+            except OSError:
+                pass
+
+
+def requeue_jobs(queuepath, timeout, names=None):
+    """Moves back to pending the running jobs without heartbeats in the last
+    timeout seconds, only the ones in names if given"""
+    runningpath = os.path.join(queuepath, 'running')
+    now = time.time()
+    for fname in os.listdir(runningpath):
+        name = fname.split('__', 1)[0]
+        if names is not None and name not in names:
+            continue
+        fpath = os.path.join(runningpath, fname)
+        try:
+            if now - os.stat(fpath).st_mtime > timeout:
+                os.rename(fpath, os.path.join(queuepath, 'pending', name))
+                print('\t[WARNING] Job %s timed out, submitting it again' % name)
+        except OSError:
+            pass
@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This file is part of pyatc library
+#
+# Authors:
+# Jorge Ibáñez Gijón <jorge.ibannez@uam.es> [2020-2022]
+# Departamento de Psicología Básica, Facultad de Psicología
+# Universidad Autónoma de Madrid
+#
+# © Copyright 2022 Jorge Ibáñez Gijón. All rights reserved
+#
+
+"""
+Manifests of checkpointed batch runs.
+
+The manifest of a batch run is a json file in its output directory with one
+entry per job: the input files and their hashes, the settings of the job,
+the status of the job (pending, done or failed), its timings and the error
+of the failed jobs. The outputs of each job are pickled next to the manifest
+as soon as the job finishes, so that an interrupted run can be resumed
+running only the jobs that are not done, or whose input files or settings
+changed.
+"""
+
+import os
+import json
+import pickle
+
+from collections import OrderedDict as OD
+
+from .cache import get_file_hash, _write_atomic
+
+
+# Name of the manifest file in the output directory of a batch run
+MANIFEST_NAME = 'manifest.json'
+
+# Status of the jobs in the manifest
+JOB_STATUSES = ('pending', 'done', 'failed')
+
+
+def get_manifest_path(outpath):
+    return os.path.join(outpath, MANIFEST_NAME)
+
+
+def load_manifest(outpath):
+    """Loads the entries of the manifest of a batch run, indexed by job id.
+    Returns an empty manifest if there is none."""
+    manifestpath = get_manifest_path(outpath)
+    if not os.path.isfile(manifestpath):
+        return OD()
+    try:
+        with open(manifestpath, 'r') as f:
+            entries = json.load(f, object_pairs_hook=OD)
+    except ValueError as e:
+        print('\t[WARNING] Could not read the manifest %s, all the jobs will run again: %s' % (manifestpath, e))
+        return OD()
+    return OD((entry['id'], entry) for entry in entries)
+
+
+def save_manifest(outpath, manifest):
+    """Writes the manifest of a batch run atomically"""
+    data = json.dumps(list(manifest.values()), indent=1).encode('utf-8')
+    _write_atomic(get_manifest_path(outpath), lambda f: f.write(data))
+
+
+def create_entry(jobid, inputs, settings=None):
+    """Returns the manifest entry of a pending job, with the paths of its
+    input files (an OrderedDict name -> path) and their hashes, and the
+    settings that change its outputs (an OrderedDict of json values).
+    Missing input files, such as optional flows files, have no hash."""
+    entry = OD()
+    entry['id'] = jobid
+    entry['inputs'] = OD(inputs)
+    entry['hashes'] = OD((name, get_file_hash(path) if os.path.isfile(path) else None)
+                         for name, path in inputs.items())
+    # Round trip through json, so that it compares equal to the saved one
+    entry['settings'] = json.loads(json.dumps(settings), object_pairs_hook=OD)
+    entry['status'] = 'pending'
+    entry['start'] = None
+    entry['end'] = None
+    entry['walltime'] = None
+    entry['error'] = None
+    return entry
+
+
+def is_entry_done(entry, saved, outpath):
+    """Checks whether the saved entry of a job is done with the same input
+    files and settings of the new entry, and its output is stored"""
+    return (saved is not None and saved['status'] == 'done' and saved['hashes'] == entry['hashes']
+            and saved.get('settings') == entry['settings']
+            and os.path.isfile(get_output_path(outpath, entry['id'])))
+
+
+def get_output_path(outpath, jobid):
+    """Returns the path of the pickled outputs of a job"""
+    return os.path.join(outpath, jobid.replace('/', '__') + '.pkl')
+
+
+def store_output(outpath, jobid, output):
+    _write_atomic(get_output_path(outpath, jobid),
+                  lambda f: pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def load_output(outpath, jobid):
+    with open(get_output_path(outpath, jobid), 'rb') as f:
+        return pickle.load(f)
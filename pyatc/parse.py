@@ -135,15 +135,30 @@
 """
 
 import re
+import gc
 import sys
 import os
+import threading
+import contextlib
 import scipy.io
 import numpy as np
+import pandas as pd
+
+from time import sleep
+from collections import OrderedDict as OD
+
+from . import cache as logcache
 
 
 # Global flag to control the printing of several debugging information
 DEBUG = False
 
+# Global flag to control the use of the persistent cache of parsed logs by run.
+# It is only set by default when the PYATC_CACHE environment variable sets the
+# directory of the cache, the batch runners use it after runners.CACHE. See
+# cache.py for its location and size limit.
+CACHE = 'PYATC_CACHE' in os.environ
+
 # Atomic regular expressions that will be combined into more complex
 # expressions to capture the relevant values of each log line
 
@@ -240,6 +255,106 @@ regexdtypes = dict(
 )
 
 
+# Dictionary with the names of the values captured in each type of log line.
+# They are used as column names in the columnar output of run.
+regexnames = dict(
+    xpid = 'experiment',
+    taskid = 'task_id',
+    phase = 'phase',
+    log_state = 'log',
+    mouse_button_event = ('time', 'mouse', 'x', 'y', 'button', 'state'),
+    view_mouse_event = ('time', 'x', 'y'),
+    view_key_press = ('time', 'key'),
+    view_solution_request = ('time', 'request', 'callsign'),
+    view_solution = ('time', 'solution', 'callsign', 'value', 'result'),
+    view_scale_move_start = 'time',
+    view_scale_move_end = 'time',
+    view_scale_move_to = ('time', 'x', 'y'),
+    view_vector_tool_start = 'time',
+    view_vector_tool_end = 'time',
+    view_vector_tool_move_to = ('time', 'x', 'y'),
+    clock_start = ('time', 'interval'),
+    clock_tick = 'time',
+    call_update = ('time', 'name', 'model', 'control', 'x', 'y', 'z', 'speed', 'heading', 'climb', 'power'),
+    call_level = ('time', 'name', 'solution', 'new_cfl', 'old_cfl'),
+    call_speed = ('time', 'name', 'solution', 'new_velocity', 'new_throttle', 'old_velocity', 'old_throttle', 'altitude'),
+    call_heading = ('time', 'name', 'solution', 'new_heading', 'old_heading'),
+    call_newcontrol = ('time', 'name', 'new_control', 'old_control'),
+    tool_route_event = ('time', 'active', 'callsign'),
+    tool_route_probe = ('time', 'value', 'callsign'),
+    tool_history_event = ('time', 'active', 'callsign'),
+    action_rotate_callout = ('time', 'callsign'),
+    action_terminated = 'time',
+)
+
+# Key in regexdtypes and regexnames of the records stored in outdict,
+# for the types of record that are not named after their regular expression.
+# The 'info' records mix several types of log line and have no entry.
+outkeys = dict(
+    mouse_button = 'mouse_button_event',
+    view_mouse_up = 'view_mouse_event',
+    view_mouse_down = 'view_mouse_event',
+    view_mouse_double_click = 'view_mouse_event',
+    view_mouse_move = 'view_mouse_event',
+)
+
+# NumPy data types of the columns in the columnar output of run
+npdtypes = {None: object, 'string': object, 'str': object, 'int': np.int64, 'float': np.float64}
+
+# Regular expressions for the canonical form of the most frequent types of log
+# lines. The 'fast' engine of run matches them in bulk over the whole log buffer
+# instead of line by line. Each one matches a complete line (preceded by its
+# newline), and every other line is left to the line-by-line parser functions.
+bulk_line_start = r"\n<time>[^<\n]*<\/time><info>"
+bulk_line_end = r"<\/info>\r?(?=\n|\Z)"
+bulk_number = r"([-+.0-9eE]+)"
+bulk_string = r"([^<\n]+)"
+
+def _bulk_regex(fields):
+    return bulk_line_start + fields + bulk_line_end
+
+bulk_time = r"<elapsed_time>" + bulk_number + r"<\/elapsed_time>"
+bulk_xy = r"<x>" + bulk_number + r"<\/x><y>" + bulk_number + r"<\/y>"
+bulk_view = r"<view>experiment<\/view>"
+
+# Dictionary of bulk-matched types of log line. Each value is the key of the
+# data types in regexdtypes and the canonical regular expression of the line.
+bulkregexstrings = OD([
+    ('call_update', ('call_update', _bulk_regex(
+        bulk_time + r"<call>" + bulk_string + r"<\/call><type>" + bulk_string + r"<\/type>" +
+        r"<control>" + bulk_number + r"<\/control>" +
+        r"<xpos>" + bulk_number + r"<\/xpos><ypos>" + bulk_number + r"<\/ypos><alt>" + bulk_number + r"<\/alt>" +
+        r"<vel>" + bulk_number + r"<\/vel><head>" + bulk_number + r"<\/head>" +
+        r"<climb>" + bulk_number + r"<\/climb><power>" + bulk_number + r"<\/power>"))),
+    ('clock_tick', ('clock_tick', _bulk_regex(bulk_time + r"<clock>tick<\/clock>"))),
+    ('view_mouse_move', ('view_mouse_event', _bulk_regex(
+        bulk_time + bulk_view + r"<event>mouse_move<\/event>" + bulk_xy))),
+    ('view_mouse_down', ('view_mouse_event', _bulk_regex(
+        bulk_time + bulk_view + r"<event>mouse_down<\/event>" + bulk_xy))),
+    ('view_mouse_up', ('view_mouse_event', _bulk_regex(
+        bulk_time + bulk_view + r"<event>mouse_up<\/event>" + bulk_xy))),
+    ('view_mouse_double_click', ('view_mouse_event', _bulk_regex(
+        bulk_time + bulk_view + r"<event>mouse_double_click<\/event>" + bulk_xy))),
+    ('mouse_button', ('mouse_button_event', _bulk_regex(
+        r"<elapsed>" + bulk_number + r"<\/elapsed><mouse>" + bulk_string + r"<\/mouse>" + bulk_xy +
+        r"<button>" + bulk_number + r"<\/button><state>" + bulk_number + r"<\/state>"))),
+])
+
+# Compiled version of the bulk regular expressions
+bulkregexes = OD([(otype, (dkey, re.compile(regex))) for otype, (dkey, regex) in bulkregexstrings.items()])
+
+# Functions that cast the matched strings into the numeric data types of regexdtypes
+casts = {'int': int, 'float': float}
+
+# Names of the available engines in run
+PARSE_ENGINES = ('fast', 'lines')
+
+# Names of the available layouts of the matlab files written by write_output,
+# and the one used by default. See write_output for a description.
+MATFORMATS = ('cell', 'numeric')
+MATFORMAT = 'cell'
+
+
 def search(key, line):
     """
     Finds matches of regular expression 'key' into string 'line',
@@ -459,16 +574,50 @@ def parse_mouse_button(line):
         print(line)
 
 
-def write_output(outdict, filename="test.xml.log"):
+def write_output(outdict, filename="test.xml.log", matformat=None):
     """
-    Exports a python dictionary of lists as a matlab
-    struct of cell arrays. To load it back in matlab do:
+    Exports a python dictionary of lists as a matlab struct. The
+    matformat argument selects its layout, by default the one set in
+    the MATFORMAT global variable.
+
+    With 'cell', each field is a cell array with one row per record.
+    To load it back in matlab do:
         data = load(filename)
             data
                 field1 = {}
                 ...
                 fieldn = {}
 
+    With 'numeric', each field is a struct with one column vector per
+    value of the records, named as in regexnames. Numeric values are
+    stored as int64 or double vectors. Strings are stored as uint32
+    indices (starting at 1) into a cell array of the unique strings,
+    stored in a field with the same name and the '_table' suffix:
+        data = load(filename)
+            data
+                info = {}
+                call_update
+                    time = [...]
+                    name = [...]
+                    name_table = {}
+                    ...
+        names = data.call_update.name_table(data.call_update.name)
+
+    The numeric layout is written without compression, and it is much
+    faster than the cell one.
+    """
+    matformat = MATFORMAT if matformat is None else matformat
+    if matformat == 'cell':
+        write_output_cell(outdict, filename)
+    elif matformat == 'numeric':
+        write_output_numeric(outdict, filename)
+    else:
+        raise ValueError('Unknown matlab format %s, valid formats are: %s' % (matformat, ', '.join(MATFORMATS)))
+
+
+def write_output_cell(outdict, filename="test.xml.log"):
+    """
+    Exports outdict as a matlab struct of cell arrays.
     """
 
     # First, convert lists of lists into numpy object arrays
@@ -476,12 +625,103 @@ def write_output(outdict, filename="test.xml.log"):
     # which matches perfectly our usecase.
     cleaned_dict = dict()
     for key, value in outdict.items():
-        cleaned_dict[key] = np.array(value, np.object)
+        cleaned_dict[key] = np.array(value, object)
 
     # Save to disk, takes loooooooooots of time.
     scipy.io.savemat(filename, cleaned_dict, do_compression=True)
 
 
+def write_output_numeric(outdict, filename="test.xml.log"):
+    """
+    Exports outdict as a matlab struct of structs of column vectors.
+    """
+    # Work with the columnar form of the records, without modifying outdict
+    frames = to_columnar(OD(outdict))
+
+    matdict = OD()
+    matdict['info'] = np.array(frames['info'], object)
+    for key, df in frames.items():
+        if key == 'info':
+            continue
+        fields = OD()
+        for name, column in df.items():
+            if column.dtype == object:
+                codes, uniques = pd.factorize(column)
+                fields[name] = (codes + 1).astype(np.uint32)
+                fields[name + '_table'] = np.array(list(uniques), object)
+            else:
+                fields[name] = column.values
+        matdict[key] = fields
+
+    scipy.io.savemat(filename, matdict, do_compression=False, oned_as='column')
+
+
+def records_frame(key, columns):
+    """
+    Creates the dataframe of a type of record from the list of
+    its columns. The key of the record type in regexdtypes and
+    regexnames determines the names and data types of the columns.
+    """
+    dtypes = regexdtypes[key]
+    names = regexnames[key]
+    if not isinstance(dtypes, tuple):
+        dtypes = (dtypes,)
+        names = (names,)
+    return pd.DataFrame(OD(
+        (name, np.array(column, dtype=npdtypes[dtype])) for (name, dtype, column) in zip(names, dtypes, columns)))
+
+
+def to_columnar(outdict):
+    """
+    Converts in place the lists of records of an outdict created by
+    run into dataframes, with one typed column per value. Records
+    that are already dataframes and 'info' records are left as they are.
+    """
+    for otype, records in outdict.items():
+        if otype == 'info' or isinstance(records, pd.DataFrame):
+            continue
+        key = outkeys.get(otype, otype)
+        if isinstance(regexdtypes[key], tuple):
+            columns = list(zip(*records)) if records else [()] * len(regexdtypes[key])
+        else:
+            columns = [records]
+        outdict[otype] = records_frame(key, columns)
+    return outdict
+
+
+def from_columnar(outdict):
+    """
+    Converts in place the dataframes of a columnar outdict back into
+    lists of records, the inverse of to_columnar.
+    """
+    # As in parse_buffer, the collector only slows down the creation of records
+    with _gc_paused():
+        for otype, records in outdict.items():
+            if not isinstance(records, pd.DataFrame):
+                continue
+            columns = [column.tolist() for (_, column) in records.items()]
+            if isinstance(regexdtypes[outkeys.get(otype, otype)], tuple):
+                outdict[otype] = list(map(list, zip(*columns)))
+            else:
+                outdict[otype] = columns[0]
+    return outdict
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Disables the cyclic garbage collector within the block. The collector
+    is shared by all the threads, so it is only disabled in the main thread,
+    and other threads, like the Prefetcher of runners, never switch it."""
+    if threading.current_thread() is not threading.main_thread() or not gc.isenabled():
+        yield
+        return
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.enable()
+
+
 def clear_nones(outdict):
     for key, values in outdict.items():
         newvalues = list()
@@ -526,7 +766,7 @@ def create_dicts():
     return outdict    
 
 
-def run(logname="test.xml.log", export2matlab=False):
+def run(logname="test.xml.log", export2matlab=False, engine='lines', columnar=False, cache=None, matformat=None):
     """
     Opens a log file and parses all the lines. The output
     is stored as a dictionary, in which each key is the name
@@ -545,6 +785,63 @@ def run(logname="test.xml.log", export2matlab=False):
         type and amount of values per record depend on the type
         of log line, and they are defined in regexdtypes dict.
         record1 = [value1, ..., valueM]
+
+    The engine argument selects how the log is parsed. 'lines', the
+    default, parses the file line by line. 'fast' reads the whole file
+    in one go and matches the most frequent types of log line in bulk
+    (see bulkregexstrings). Both produce the same outdict, and 'fast' is
+    at most about 1.8 times faster, on logs made mostly of call_update
+    lines. Compare them on a log with test.compare_parse_engines.
+
+    If columnar is True, the records of each type are stored instead
+    in a pandas DataFrame with one typed column per value, named after
+    regexnames and typed after regexdtypes (see to_columnar). Only the
+    'info' records, which mix several types of line, remain a list.
+
+    If cache is True, parsed logs are stored in the persistent cache
+    of cache.py, and unchanged logs are loaded from it instead of being
+    parsed again. By default it follows the CACHE global flag.
+
+    The matformat argument selects the layout of the matlab files, see
+    write_output.
+    """
+    if engine not in PARSE_ENGINES:
+        raise ValueError('Unknown parse engine %s, valid engines are: %s' % (engine, ', '.join(PARSE_ENGINES)))
+    if cache is None:
+        cache = CACHE
+
+    outdict = logcache.load_log(logname) if cache else None
+    if outdict is None:
+        if engine == 'fast':
+            outdict = parse_buffer(logname, columnar or cache)
+        if outdict is None:
+            # Some log line does not follow the canonical format, parse
+            # line by line to keep the order of the records.
+            outdict = parse_lines(logname)
+        if cache:
+            logcache.store_log(logname, to_columnar(outdict))
+
+    if columnar:
+        to_columnar(outdict)
+    else:
+        from_columnar(outdict)
+
+    # Export the dictionary into matlab struct and store to disk
+    # This step takes 99% of the time, so if you are using only
+    # python, you should disable exporting, and simply pass the
+    # dictionary between functions.
+    # Matlab files are always written from the lists of records, so that
+    # their layout does not depend on the columnar argument.
+    if export2matlab:
+        write_output(from_columnar(OD(outdict)), logname+'.mat', matformat)
+
+    return outdict
+
+
+def parse_lines(logname="test.xml.log"):
+    """
+    Parses the log file line by line, triaging each line with the
+    parse_* functions below. Returns the outdict described in run.
     """
 
     # Create dictionary to store the different types of log lines
@@ -608,6 +905,7 @@ def run(logname="test.xml.log", export2matlab=False):
             else:
                 print('\t[WARNING] Unhandled log line:')
                 print(line)
+                otup = None
 
             # Append the record to its specific type of line
             if otup is not None:
@@ -615,17 +913,153 @@ def run(logname="test.xml.log", export2matlab=False):
 
     # Clear bad matched due to misrecognized log lines.
     clear_nones(outdict)
-    
-    # Export the dictionary into matlab struct and store to disk
-    # This step takes 99% of the time, so if you are using only
-    # python, you should disable exporting, and simply pass the
-    # dictionary between functions.
-    if export2matlab:
-        write_output(outdict, logname+'.mat')
 
     return outdict
 
 
+def parse_buffer(logname="test.xml.log", columnar=False):
+    """
+    Parses the whole log file at once. The lines of the types in
+    bulkregexes are matched over the complete buffer with a single
+    precompiled regular expression per type, and their values are
+    cast column by column. The remaining lines, typically a small
+    fraction of the log, go through parse_line.
+
+    Returns the outdict described in run, or None if any line of a
+    bulk type is not in canonical form, because in that case the order
+    of its records could not be preserved. If columnar is True, the
+    columns of the bulk types are stored directly as dataframes, and
+    the other types are left as lists for to_columnar.
+    """
+    outdict = create_dicts()
+
+    # Latin-1 maps each byte to one character, so decoding the whole
+    # buffer is equivalent to decoding line by line.
+    with open(logname, 'rb') as logfile:
+        text = logfile.read().decode('latin-1')
+
+    # The records are millions of small lists that cannot form reference
+    # cycles, so the cyclic garbage collector only slows down their creation.
+    with _gc_paused():
+        # Prepend a newline so that every line, including the first one,
+        # starts with the newline expected by the bulk regular expressions.
+        rest = '\n' + text
+        for otype, (dkey, regex) in bulkregexes.items():
+            dtypes = regexdtypes[dkey]
+            # Splitting by a pattern with groups interleaves the text between
+            # matches with the groups of each match: [rest, g1, ..., gN, rest, ...]
+            step = regex.groups + 1
+            parts = regex.split(rest)
+            rest = ''.join(parts[::step])
+            if isinstance(dtypes, tuple):
+                columns = list()
+                for i, dtype in enumerate(dtypes):
+                    column = parts[i+1::step]
+                    if dtype in casts:
+                        column = list(map(casts[dtype], column))
+                    elif any('requirement' in value for value in set(column)):
+                        # The line parser skips these lines entirely
+                        return None
+                    columns.append(column)
+                if columnar:
+                    outdict[otype] = records_frame(dkey, columns)
+                else:
+                    outdict[otype] = list(map(list, zip(*columns)))
+            elif columnar:
+                outdict[otype] = records_frame(dkey, [list(map(casts[dtypes], parts[1::2]))])
+            else:
+                outdict[otype] = list(map(casts[dtypes], parts[1::2]))
+            del parts
+
+        # Parse the remaining lines one by one, dropping the bad matches
+        # of misrecognized log lines as clear_nones does.
+        lines = rest.split('\n')[1:]
+        if lines and lines[-1] == '':
+            lines.pop()
+        for line in lines:
+            otup = parse_line(line)
+            if otup is None:
+                continue
+            elif otup[0] in bulkregexes:
+                return None
+            elif otup[1] is None or (isinstance(otup[1], list) and None in otup[1]):
+                continue
+            outdict[otup[0]].append(otup[1])
+
+    return outdict
+
+
+def iter_records(log="test.xml.log", follow=False, interval=1.0, timeout=None):
+    """
+    Generator version of run. Reads a log line by line, either from
+    a file path or from any binary stream, and yields one tuple
+    (record_type, record) per parsed line, with the same types and
+    records that run stores in outdict. Only one line is held in memory
+    at a time.
+
+    If follow is True, the generator waits for new lines when it reaches
+    the end of the stream, checking every interval seconds, so that it can
+    tail a log that pact.exe is still writing. Incomplete lines are kept
+    until their newline arrives. Following stops after the ('info', 'end')
+    record that closes the log, or after timeout seconds without new data.
+    """
+    if isinstance(log, (str, bytes, os.PathLike)):
+        logfile = open(log, 'rb')
+    else:
+        logfile = None
+    stream = log if logfile is None else logfile
+
+    try:
+        pending = b''
+        idle = 0.0
+        while True:
+            line = stream.readline()
+            if line.endswith(b'\n') or (line and not follow):
+                line = pending + line
+                pending = b''
+                idle = 0.0
+            elif line:
+                # Incomplete line of a log that is still being written
+                pending += line
+                continue
+            elif follow and (timeout is None or idle < timeout):
+                sleep(interval)
+                idle += interval
+                continue
+            elif pending:
+                line = pending
+                pending = b''
+            else:
+                break
+
+            otup = parse_line(line)
+
+            # Skip bad matches due to misrecognized log lines, as clear_nones does
+            if otup is None or otup[1] is None or (isinstance(otup[1], list) and None in otup[1]):
+                continue
+            yield otup
+
+            if follow and otup == ('info', 'end'):
+                break
+    finally:
+        if logfile is not None:
+            logfile.close()
+
+
+def collect_records(records, columnar=False):
+    """
+    Stores the (record_type, record) tuples yielded by iter_records
+    into an outdict like the one returned by run. It can be used on
+    a partial log, for example with itertools.islice or takewhile.
+    """
+    outdict = create_dicts()
+    for otype, record in records:
+        outdict[otype].append(record)
+    if columnar:
+        to_columnar(outdict)
+    return outdict
+
+
 def run_directory(path='./tests'):
     """
     Parse all files ending with .xml.log in the specified path.
@@ -642,8 +1076,14 @@ def run_directory(path='./tests'):
 
 
 def parse_line(line):
-    line = line.decode('latin-1')
-    
+    """
+    Parses a single log line, either as bytes read from the log file
+    or as an already decoded string. Returns a (type, record) tuple,
+    or None for skipped and unhandled lines.
+    """
+    if isinstance(line, bytes):
+        line = line.decode('latin-1')
+
     if DEBUG:
         print(line)
 
@@ -20,21 +20,32 @@ from collections import OrderedDict as OD
 from . import util
 from .cometa_params import CALL_NAMES
 
+def get_records(logdict, key, columns):
+    """Fetches the records of a type of log line as a new dataframe, both
+    from lists of records and from the columnar output of the parser"""
+    records = logdict[key]
+    if isinstance(records, pd.DataFrame):
+        df = records.copy()
+        df.columns = columns
+        return df
+    return pd.DataFrame(records, columns=columns)
+
+
 def get_call_updates(logdict):
     """Fetches the call update lines in the log"""
-    return pd.DataFrame(logdict['call_update'], columns=CALL_NAMES)
+    return get_records(logdict, 'call_update', CALL_NAMES)
 
 
 def get_mouse_clicks(logdict):
     """Fetches the number of actions performed to change aircrafts' altitude"""
-    df = pd.DataFrame(logdict['view_mouse_down'], columns=['time', 'x', 'y'])
+    df = get_records(logdict, 'view_mouse_down', ['time', 'x', 'y'])
     df.time = df.time -1
     return df.set_index(df.time, drop=False, inplace=False, verify_integrity=True).sort_index()
 
 
 def get_mouse_double_clicks(logdict):
     """Fetches the mouse double clicks events in a trial"""
-    df = pd.DataFrame(logdict['view_mouse_double_click'], columns=['time', 'x', 'y'])
+    df = get_records(logdict, 'view_mouse_double_click', ['time', 'x', 'y'])
     df.time = df.time -1
     return df.set_index(df.time, drop=False, inplace=False, verify_integrity=True).sort_index()
 
@@ -48,13 +59,13 @@ def get_mouse_press_events(logdict):
 
 def get_call_level(logdict):
     """Computes the number of actions performed to change aircrafts' altitude"""
-    df = pd.DataFrame(logdict['call_level'], columns=['time', 'aircraft', '', 'end', 'start'])
+    df = get_records(logdict, 'call_level', ['time', 'aircraft', '', 'end', 'start'])
     return len(df.index)
 
 
 def get_call_speed(logdict):
     """Función número de cambios de velocidad"""
-    df = pd.DataFrame(logdict['call_speed'], columns=['time', 'aircraft', '', 'end', '', 'start', '', 'level'])
+    df = get_records(logdict, 'call_speed', ['time', 'aircraft', '', 'end', '', 'start', '', 'level'])
     return len(df.index)
 
 
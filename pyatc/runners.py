@@ -11,21 +11,66 @@
 # © Copyright 2022 Jorge Ibáñez Gijón. All rights reserved
 #
 
+import io
 import os
+import sys
 import glob
+import time
+import queue
 import psutil
+import threading
+import traceback
 import multiprocessing as mp
 
-from contextlib import closing
 from collections import OrderedDict as OD
 
 from . import util
+from . import sky
+from . import parse
+from . import manifest
+from .executors import Executor, QueueExecutor
 from .xml import load_xml
 from .cometa import compute_cometa
+from .cometa_params import COMETAP
 from .parse import run as parse_log
 
 CORE_NUMBER = psutil.cpu_count(logical=False)
 
+# Keep the conflicts of the logs processed in batch as the intervals of
+# cometa.get_conflict_intervals, instead of their full dataframes
+CONFLICT_INTERVALS = True
+
+# Use the persistent cache of parsed logs in the batch runners, which parse
+# the same logs again at each run, whatever the value of parse.CACHE
+CACHE = True
+
+# Send back from the parallel workers only the COMETA dataframe and the
+# conflicts of each log, not the per-aircraft COMETA and the trajectories
+COMPACT_RESULTS = True
+
+# Number of log files parsed in advance by compute_cometa_pp while the
+# COMETA of the current one is computed, 0 disables the prefetching
+PREFETCH_DEPTH = 2
+
+# Seconds between the checks of the stop event of a blocked Prefetcher
+PREFETCH_POLL = 0.1
+
+# Executor of the parallel batch runners, see set_executor. By default the
+# local pool of PoolExecutor, or the job queue in the PYATC_QUEUE directory
+EXECUTOR = QueueExecutor(os.environ['PYATC_QUEUE']) if 'PYATC_QUEUE' in os.environ else None
+
+# Long-lived pool of worker processes of the batch runners, see get_pool,
+# and the queue where its workers send their pids and the pids received
+POOL = None
+POOL_CONFIG = None
+POOL_WORKERS = None
+
+# Resident memory in bytes of a pool worker above which the pool is recycled
+POOL_MAXMEMORY = 2 * 1024**3
+
+# Seconds between the checks of the pool workers while waiting for results
+POOL_POLL = 1.0
+
 ############################################################
 ### NAMES OF THE TASK FILES THAT WILL BE SEARCHED FOR IN
 ### BATCH PROCESSING MODE.
@@ -96,67 +141,62 @@ def compute_cometa_dir(logpath='.', taskpath='.', tmax=600, save2mat=False, para
 
         parallelize [boolean]:
             flag to indicate if we want to disable parallel computation
-            of log files.
+            of log files. Parallel workers parse the logs themselves, and
+            when COMPACT_RESULTS is set, only send back the COMETA and the
+            conflicts of each log.
     """
 
     cometa = OD()
     cometa_aircrafts = OD()
     conflicts = OD()
     trjs = OD()
+    configs = list()
+    settings = get_job_settings()
     for taskname in TASKNAMES:
         # Check whether task file exists and load it
         taskfilepath = os.path.join(taskpath,taskname)
-        if os.path.isfile(taskfilepath):
-            xmlfile = taskname
-            taskdict = load_xml(taskfilepath)
-        else:
+        if not os.path.isfile(taskfilepath):
             continue
 
         print("\n"+"="*60)
         print("\nProcessing log files from task " + taskfilepath)
 
-        # Check whether flows file exists and load it
         flowsname = 'Flows_' + taskname + '.csv'
         flowspath = os.path.join(taskpath, flowsname)
-        if os.path.isfile(flowspath):
-            flowdict = util.parse_flows_file(flowspath, taskdict)
-        else:
-            print('Warning, the flows file %s does not exists' % flowspath)
-            flowdict = OD()
 
-        # Parse every logdict matching the pattern in dir, compute cometa and store results
+        # Workers parse the logs themselves, they only get the paths of the
+        # files of all the tasks, which are run in a single pool below
         if parallelize == True:
-            # First, create a list with all the configurations in advance
-            configs = list()
             for logfilepath in glob.iglob(os.path.join(logpath,'*'+taskname+'.log')):
-                print("\n\t"+"·"*30)
-                print("\tParsing log file " + logfilepath)
-                print()
-                logfile = os.path.basename(logfilepath)
-                logdict = parse_log(logfilepath, save2mat)
-                params = util.get_cometa_simulation_parameters(taskdict, flowdict, tmax, logpath, logfile)
-                configs.append((logfile, taskdict, logdict, flowdict, params, save2mat))
-
-            # Run in parallel the worker function
-            res = runparallel(_cometa_worker, configs)
-
-            # Store the results
-            for (logfile, tr_cometa, tr_cometa_aircrafts, tr_conflicts, tr_trjs) in res:
-                cometa[logfile] = tr_cometa
-                cometa_aircrafts[logfile] = tr_cometa_aircrafts
-                conflicts[logfile] = tr_conflicts
-                trjs[logfile] = tr_trjs
-        else:
-            for logfilepath in glob.iglob(os.path.join(logpath,'*'+taskname+'.log')):
-                print("\n\t"+"·"*30)
-                print("\tParsing log file " + logfilepath)
-                print()
-                logfile = os.path.basename(logfilepath)
-                logdict = parse_log(logfilepath, save2mat)
-                params = util.get_cometa_simulation_parameters(taskdict, flowdict, tmax, logpath, logfile)
-                #print("Processing log file " + logpath)
-                (cometa[logfile], cometa_aircrafts[logfile], conflicts[logfile], trjs[logfile]) = \
-                    compute_cometa(taskdict, logdict, flowdict, params, save2mat)
+                configs.append((logfilepath, taskfilepath, flowspath, logpath, tmax, save2mat, settings))
+            continue
+
+        # Load the task and flows files, compiled once for all the logs of the task
+        compiled = sky.get_sky(taskfilepath, flowspath)
+        taskdict = compiled['taskdict']
+        flowdict = compiled['flowdict']
+
+        # Parse every logdict matching the pattern in dir, compute cometa and store results
+        for logfilepath in glob.iglob(os.path.join(logpath,'*'+taskname+'.log')):
+            print("\n\t"+"·"*30)
+            print("\tParsing log file " + logfilepath)
+            print()
+            logfile = os.path.basename(logfilepath)
+            logdict = parse_log(logfilepath, save2mat, columnar=True, cache=CACHE)
+            params = sky.get_log_parameters(compiled, tmax, logpath, logfile)
+            #print("Processing log file " + logpath)
+            (cometa[logfile], cometa_aircrafts[logfile], conflicts[logfile], trjs[logfile]) = \
+                compute_cometa(taskdict, logdict, flowdict, params, save2mat, conflict_intervals=CONFLICT_INTERVALS)
+
+    if parallelize == True:
+        # Store the results as they arrive, in the order of the log files
+        results = OD()
+        for (n, result) in enumerate(runparallel_unordered(_cometa_file_worker, configs, taskpath)):
+            results[result[0]] = result
+            print('\tFinished log file %s (%d/%d)' % (result[0], n + 1, len(configs)))
+        for config in configs:
+            logfile = os.path.basename(config[0])
+            (_, cometa[logfile], cometa_aircrafts[logfile], conflicts[logfile], trjs[logfile]) = results[logfile]
 
     return cometa, cometa_aircrafts, conflicts, trjs
 
@@ -194,43 +234,152 @@ def compute_cometa_exp_parallel(logpath='.', taskpath='.', tmax=600, save2mat=Fa
     """Runs COMETA computation in all participants of experiment. It is assumed
     that the data directory contains one directory per participant labeled
     with a capital P and 3 digits that identify it.
+
+    Each log file of each participant is a separate job, see get_cometa_jobs.
+    Jobs run in a single pool, largest log files first, and their results
+    are grouped back by participant.
     """
     cometa = OD()
     cometa_aircrafts = OD()
     conflicts = OD()
     trjs = OD()
 
-    # Create configurations
-    configs = list()
-    for ppdir in sorted(glob.iglob(os.path.join(logpath,'P*'))):
-        ppname = os.path.basename(ppdir)
-        pppath = os.path.join(ppdir,'Simulador')
-        if os.path.exists(pppath):
-            ppdir = pppath
-            configs.append((ppname, pppath, taskpath, tmax, save2mat))
+    # Create configurations, one per log file
+    jobs = get_cometa_jobs(logpath, taskpath, tmax, save2mat)
+    for ppname in sorted(set(job[0] for job in jobs)):
+        cometa[ppname] = OD()
+        cometa_aircrafts[ppname] = OD()
+        conflicts[ppname] = OD()
+        trjs[ppname] = OD()
 
     # Run the parallel computations
-    res = runparallel(_worker_compute_cometa_pp, configs)
+    results = OD()
+    for (n, result) in enumerate(runparallel_unordered(_cometa_job_worker, jobs, taskpath)):
+        (ppname, walltime, res) = result
+        results[(ppname, res[0])] = result
+        print('\tFinished log file %s of %s in %.1f s (%d/%d)' % (res[0], ppname, walltime, n + 1, len(jobs)))
+
+    # Store the results in the order of the log files of each participant
+    for (ppname, logfilepath) in sorted((job[0], job[1][0]) for job in jobs):
+        (_, _, res) = results[(ppname, os.path.basename(logfilepath))]
+        (logfile, cometa[ppname][logfile], cometa_aircrafts[ppname][logfile],
+         conflicts[ppname][logfile], trjs[ppname][logfile]) = res
+
+    # Report the wall time of the jobs
+    print()
+    print('\tWall time of the jobs')
+    for (ppname, walltime, res) in sorted(results.values(), key=lambda r: r[1], reverse=True):
+        print('\t\t%s %s: %.1f s' % (ppname, res[0], walltime))
+    return cometa, cometa_aircrafts, conflicts, trjs
+
+
+def compute_cometa_exp_resumable(logpath='.', taskpath='.', outpath=None, tmax=600, save2mat=False, retry_failed=False):
+    """Runs COMETA computation in all participants of experiment, as
+    compute_cometa_exp_parallel, checkpointing the jobs in a manifest (see
+    pyatc.manifest) in outpath, by default the cometa_run directory in
+    logpath. The outputs of each job are stored as soon as it finishes, and
+    when the run is repeated the jobs already done with the same input files
+    and settings (tmax, save2mat and get_job_settings) are skipped. A failed
+    job does not stop the run, its error is kept in the manifest.
+
+    Arguments are the same of compute_cometa_exp, and:
+
+        outpath [string]:
+            directory of the manifest and the outputs of the jobs.
 
-    # Store the results
-    for (ppname, tr_cometa, tr_cometa_aircrafts, tr_conflicts, tr_trjs) in res:
-        cometa[ppname] = tr_cometa
-        cometa_aircrafts[ppname] = tr_cometa_aircrafts
-        conflicts[ppname] = tr_conflicts
-        trjs[ppname] = tr_trjs
+        retry_failed [boolean]:
+            run again only the jobs that failed in previous runs, and the
+            ones done whose input files or settings changed.
 
+    Returns the results of the jobs done, grouped by participant.
+    """
+    outpath = os.path.join(logpath, 'cometa_run') if outpath is None else outpath
+    os.makedirs(outpath, exist_ok=True)
+    saved = manifest.load_manifest(outpath)
+
+    # Create the entries of the jobs, and select the ones to run
+    entries = OD()
+    torun = list()
+    for (ppname, config) in get_cometa_jobs(logpath, taskpath, tmax, save2mat):
+        jobid = ppname + '/' + os.path.basename(config[0])
+        settings = OD([('tmax', config[4]), ('save2mat', config[5])])
+        settings.update(config[6])
+        entry = manifest.create_entry(jobid, OD([('log', config[0]), ('task', config[1]), ('flows', config[2])]),
+                                      settings)
+        old = saved.get(jobid)
+        if old is not None and old['status'] == 'done' and old.get('settings') != entry['settings']:
+            print('\t[WARNING] The settings of job %s changed since it was done, it will run again' % jobid)
+        if manifest.is_entry_done(entry, old, outpath):
+            entries[jobid] = old
+        elif retry_failed and (old is None or old['status'] == 'pending'):
+            entries[jobid] = entry if old is None else old
+        else:
+            entries[jobid] = entry
+            torun.append((jobid, outpath, config))
+    manifest.save_manifest(outpath, entries)
+    print('\tRunning %d of %d jobs, manifest in %s' % (len(torun), len(entries), outpath))
+
+    # Run the jobs, updating the manifest as they finish
+    for (n, (jobid, status, start, end, error)) in enumerate(runparallel_unordered(_cometa_checkpoint_worker, torun, taskpath)):
+        entry = entries[jobid]
+        entry['status'] = status
+        entry['start'] = start
+        entry['end'] = end
+        entry['walltime'] = end - start
+        entry['error'] = error
+        manifest.save_manifest(outpath, entries)
+        print('\tJob %s %s in %.1f s (%d/%d)' % (jobid, status, end - start, n + 1, len(torun)))
+
+    # Report the failed jobs and collect the outputs of the ones done
+    cometa = OD()
+    cometa_aircrafts = OD()
+    conflicts = OD()
+    trjs = OD()
+    for jobid in sorted(entries):
+        entry = entries[jobid]
+        if entry['status'] == 'failed':
+            print('\t[ERROR] Job %s failed: %s' % (jobid, entry['error'].strip().split('\n')[-1]))
+        if entry['status'] != 'done':
+            continue
+        ppname = jobid.split('/')[0]
+        for results in (cometa, cometa_aircrafts, conflicts, trjs):
+            results.setdefault(ppname, OD())
+        (logfile, cometa[ppname][logfile], cometa_aircrafts[ppname][logfile],
+         conflicts[ppname][logfile], trjs[ppname][logfile]) = manifest.load_output(outpath, jobid)
     return cometa, cometa_aircrafts, conflicts, trjs
 
 
-def _worker_compute_cometa_pp(config):
-    (ppname, logpath, taskpath, tmax, save2mat) = config
-    return (ppname,) + compute_cometa_pp(logpath, taskpath, tmax, save2mat)
+def get_cometa_jobs(logpath='.', taskpath='.', tmax=600, save2mat=False):
+    """Returns the jobs of all the log files of the participants of an
+    experiment, as (ppname, config) tuples where config is the argument of
+    _cometa_file_worker. Jobs are sorted by the size of their log files,
+    largest first, so that the longest jobs do not run last. Log files whose
+    task file is not found in taskpath are skipped."""
+    jobs = list()
+    settings = get_job_settings()
+    for ppdir in sorted(glob.iglob(os.path.join(logpath,'P*'))):
+        ppname = os.path.basename(ppdir)
+        pppath = os.path.join(ppdir,'Simulador')
+        if not os.path.exists(pppath):
+            continue
+        for logfilepath in sorted(glob.iglob(os.path.join(pppath,'*.xml.log'))):
+            taskname = os.path.basename(logfilepath).split('.')[0] + '.xml'
+            taskfilepath = os.path.join(taskpath, taskname)
+            if not os.path.isfile(taskfilepath):
+                print('\t[ERROR] Task file %s of log file %s not found!!' % (taskfilepath, logfilepath))
+                continue
+            flowspath = os.path.join(taskpath, 'Flows_' + taskname + '.csv')
+            jobs.append((ppname, (logfilepath, taskfilepath, flowspath, pppath, tmax, save2mat, settings)))
+    jobs.sort(key=lambda job: os.path.getsize(job[1][0]), reverse=True)
+    return jobs
 
 
 def compute_cometa_pp(logpath='.', taskpath='.', tmax=600, save2mat=False, pasive=False):
     """Computes the cometa index for all the log files in the participant
     directory. Each condition in the log files must match one of the tasks
-    in TASKNAMES global list, or the program will yield a warning.
+    in TASKNAMES global list, or the program will yield a warning. The next
+    PREFETCH_DEPTH log files are read and parsed in a background thread
+    while the cometa of the current one is computed.
 
     Arguments:
         logpath [string]:
@@ -257,8 +406,35 @@ def compute_cometa_pp(logpath='.', taskpath='.', tmax=600, save2mat=False, pasiv
     conflicts = OD()
     trjs = OD()
     #######################################################
-    # Iterate over all log files found in logpath
+    # Iterate over all log files found in logpath, the next
+    # ones are parsed while the current one is computed
     #######################################################
+    logs = _iter_pp_logs(logpath, taskpath, tmax, save2mat, pasive)
+    if PREFETCH_DEPTH > 0:
+        logs = Prefetcher(logs, PREFETCH_DEPTH)
+    try:
+        for (logfilename, compiled, logdict, params) in logs:
+            if PREFETCH_DEPTH > 0:
+                print('\tPrefetched log files in the queue: %d' % logs.queue.qsize())
+
+            # Perform the actual cometa computation
+            (cometa[logfilename], cometa_aircrafts[logfilename], conflicts[logfilename], trjs[logfilename]) = \
+                compute_cometa(compiled['taskdict'], logdict, compiled['flowdict'], params, save2mat,
+                               conflict_intervals=CONFLICT_INTERVALS)
+    finally:
+        # Stop the producer and release the prefetched logs, also when
+        # compute_cometa fails
+        if PREFETCH_DEPTH > 0:
+            logs.close()
+
+    if PREFETCH_DEPTH > 0:
+        logs.report()
+    return cometa, cometa_aircrafts, conflicts, trjs
+
+
+def _iter_pp_logs(logpath, taskpath, tmax, save2mat, pasive):
+    """Private generator of the parsed log files of compute_cometa_pp, with
+    their compiled skies and parameters"""
     for logfilepath in sorted(glob.iglob(os.path.join(logpath,'*.xml.log'))):
         print("\n\t"+"*"*50)
         print("\tPROCESSING FILE: " + logfilepath)
@@ -286,81 +462,335 @@ def compute_cometa_pp(logpath='.', taskpath='.', tmax=600, save2mat=False, pasiv
         flowsname = 'Flows_' + taskname + '.csv'
         flowspath = os.path.join(taskpath, flowsname)
 
-        # Load task
+        # Load task and flows, compiled once for all the logs of the same task
         print("\n\t"+"-"*30)
         print("\tParsing task file " + taskfilepath)
-        if os.path.isfile(taskfilepath):
-            xmlfile = taskname
-            taskdict = load_xml(taskfilepath)
-        else:
+        if not os.path.isfile(taskfilepath):
             print('\t[ERROR] Task file not found!!')
             continue
-
-        # Load flows file
-        print("\n\t"+"·"*30)
-        print("\tParsing flows file " + flowspath)
-        if os.path.isfile(flowspath):
-            flowdict = util.parse_flows_file(flowspath, taskdict)
-        else:
-            print('\tWarning, the flows file %s does not exists' % flowspath)
-            flowdict = OD()
+        compiled = sky.get_sky(taskfilepath, flowspath)
 
         # Parse log
         print("\n\t"+"·"*30)
         print("\tParsing log file " + logfilepath)
         print()
-        logdict = parse_log(logfilepath, save2mat)
+        logdict = parse_log(logfilepath, save2mat, columnar=True, cache=CACHE)
 
         # Get sky parameters for cometa computation
-        params = util.get_sky_parameters(taskdict, flowdict, tmax, logpath, logfilename)
-
-        # Perform the actual cometa computation
-        (cometa[logfilename], cometa_aircrafts[logfilename], conflicts[logfilename], trjs[logfilename]) = \
-            compute_cometa(taskdict, logdict, flowdict, params, save2mat)
-
-    return cometa, cometa_aircrafts, conflicts, trjs
+        params = sky.get_log_parameters(compiled, tmax, logpath, logfilename)
+        yield (logfilename, compiled, logdict, params)
+
+
+class Prefetcher(object):
+    """Iterator over the items of an iterable produced in advance by a
+    background thread, which keeps at most depth items in a bounded queue.
+    It measures the time the producer spends producing items (busy) and
+    blocked on a full queue (blocked), and the time the consumer spends
+    waiting for them (wait). What the producer prints is kept with each
+    item and printed by the consumer when it takes the item, so that it
+    does not interleave with the output of the consumer. Call close when
+    the consumer stops early, so that the producer stops, the queued items
+    are released and sys.stdout is restored."""
+
+    def __init__(self, items, depth=PREFETCH_DEPTH):
+        self.queue = queue.Queue(maxsize=max(depth, 1))
+        self.stop = threading.Event()
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.wait = 0.0
+        self.finished = False
+        self.start = time.perf_counter()
+        self.thread = threading.Thread(target=self._produce, args=(iter(items),), daemon=True)
+        self.output = _ThreadOutput(sys.stdout, self.thread)
+        sys.stdout = self.output
+        self.thread.start()
+
+    def _produce(self, items):
+        try:
+            while not self.stop.is_set():
+                t0 = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                t1 = time.perf_counter()
+                self._put((True, item, self.output.take()))
+                self.busy += t1 - t0
+                self.blocked += time.perf_counter() - t1
+            self._put((False, None, self.output.take()))
+        except BaseException as e:
+            self._put((False, e, self.output.take()))
+
+    def _put(self, item):
+        # Wait for room in the queue, unless the prefetcher is closed
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=PREFETCH_POLL)
+                return
+            except queue.Full:
+                pass
+
+    def close(self):
+        """Stops the producer and drops the items in the queue"""
+        self.stop.set()
+        self.finished = True
+        while self.thread.is_alive():
+            self._drain()
+            self.thread.join(PREFETCH_POLL)
+        self._drain()
+        if sys.stdout is self.output:
+            sys.stdout = self.output.stream
+
+    def _drain(self):
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration
+        t0 = time.perf_counter()
+        (ok, item, text) = self.queue.get()
+        self.wait += time.perf_counter() - t0
+        self.output.stream.write(text)
+        if ok:
+            return item
+        self.finished = True
+        if item is not None:
+            raise item
+        raise StopIteration
+
+    def report(self):
+        """Prints the occupancy of the producer and the consumer"""
+        total = max(time.perf_counter() - self.start, 1e-9)
+        print('\n\tPrefetching occupancy in %.1f s: parsing %.0f%% (blocked %.0f%%), computing %.0f%%' % (
+            total, 100 * self.busy / total, 100 * self.blocked / total, 100 * (total - self.wait) / total))
+
+
+class _ThreadOutput(object):
+    """Replacement of sys.stdout that keeps what a thread writes in a buffer,
+    see Prefetcher, and passes the output of the other threads through"""
+
+    def __init__(self, stream, thread):
+        self.stream = stream
+        self.thread = thread
+        self.buffer = io.StringIO()
+
+    def write(self, text):
+        if threading.current_thread() is self.thread:
+            return self.buffer.write(text)
+        return self.stream.write(text)
+
+    def take(self):
+        """Returns and empties the buffered output of the thread"""
+        text = self.buffer.getvalue()
+        self.buffer = io.StringIO()
+        return text
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
 
 
 def compute_cometa_pasive(logpath='.', taskpath='.', tmax=600, save2mat=False):
     return compute_cometa_pp(logpath, taskpath, tmax, save2mat, pasive=True)
 
 
-def _cometa_worker(config):
-    """Private function that implements the worker that will be used in parallel
-    computation of cometa files in batch processing mode"""
-    (logfile, taskdict, logdict, flowdict, params, save2mat) = config
-    #print("Parallel processing of logfile " + logfile)
-    cometa, cometa_aircrafts, conflicts, trjs = \
-        compute_cometa(taskdict, logdict, flowdict, params, save2mat)
+def _cometa_job_worker(job):
+    """Private function that runs a job of get_cometa_jobs, and returns the
+    participant, the wall time of the job and the results of the log"""
+    (ppname, config) = job
+    t0 = time.perf_counter()
+    res = _cometa_file_worker(config)
+    return (ppname, time.perf_counter() - t0, res)
+
+
+def _cometa_checkpoint_worker(job):
+    """Private function that runs a job of compute_cometa_exp_resumable and
+    stores its outputs. Returns the job id, its status, start and end times
+    and the traceback of the error if it failed."""
+    (jobid, outpath, config) = job
+    start = time.time()
+    try:
+        res = _cometa_file_worker(config)
+        if res[1] is None:
+            raise ValueError('Could not compute the COMETA of ' + config[0])
+        manifest.store_output(outpath, jobid, res)
+        (status, error) = ('done', None)
+    except Exception:
+        (status, error) = ('failed', traceback.format_exc())
+    return (jobid, status, start, time.time(), error)
+
+
+def _cometa_file_worker(config):
+    """Private function that implements the worker that parses and computes
+    the cometa of a log file from its path in batch processing mode. The
+    COMETA csv is written by the worker, and only the results kept by
+    COMPACT_RESULTS are sent back. The settings of the job, see
+    get_job_settings, are used instead of the ones of the worker."""
+    (logfilepath, taskfilepath, flowspath, logpath, tmax, save2mat, settings) = config
+    logfile = os.path.basename(logfilepath)
+    compiled = sky.get_sky(taskfilepath, flowspath)
+    logdict = parse_log(logfilepath, save2mat, columnar=True, cache=settings['CACHE'],
+                        matformat=settings['MATFORMAT'])
+    params = sky.get_log_parameters(compiled, tmax, logpath, logfile)
+    res = compute_cometa(compiled['taskdict'], logdict, compiled['flowdict'], params, save2mat,
+                         cometap=settings['COMETAP'], conflict_intervals=settings['CONFLICT_INTERVALS'])
+    if res is None:
+        return (logfile, None, None, None, None)
+    (cometa, cometa_aircrafts, conflicts, trjs) = res
+    if settings['COMPACT_RESULTS']:
+        return (logfile, cometa, None, conflicts, None)
     return (logfile, cometa, cometa_aircrafts, conflicts, trjs)
 
 
+def get_job_settings():
+    """Returns the module settings that the batch jobs must follow, which are
+    sent with each job, because the workers of the pool and of the job queue
+    keep the values of when they were started"""
+    settings = OD()
+    settings['CONFLICT_INTERVALS'] = CONFLICT_INTERVALS
+    settings['COMPACT_RESULTS'] = COMPACT_RESULTS
+    settings['CACHE'] = CACHE
+    settings['MATFORMAT'] = parse.MATFORMAT
+    settings['COMETAP'] = OD(COMETAP)
+    return settings
+
+
 """
 ------------------------------------------------------------------------
     EXTERNAL API PARALLELIZED FUNCTIONS
 ------------------------------------------------------------------------
 """
 
-def runparallel(fcn, configs):
+def runparallel(fcn, configs, taskpath=None):
     """
     """
-    return _runparallel_pool(fcn, configs)
+    return _collect(get_executor(taskpath).run(fcn, configs))
 
 
-def runparallel_sorted(fcn, configs, rev=False):
+def runparallel_sorted(fcn, configs, rev=False, taskpath=None):
     """
     """
     # Fetch results by any of the methods below
-    results = _runparallel_pool(fcn, configs)
+    results = runparallel(fcn, configs, taskpath)
     # Short the list and return
     results.sort(key=lambda x: x[0], reverse=rev)
     return results
 
 
-def runparallel_async(fcn, configs):
+def runparallel_unordered(fcn, configs, taskpath=None):
+    """Generator of the results of fcn as soon as they are ready, in any order
     """
+    for (_, result) in get_executor(taskpath).run(fcn, configs):
+        yield result
+
+
+def runparallel_async(fcn, configs, taskpath=None):
     """
-    return _runparallel_pool_async(fcn, configs)
+    """
+    return _collect(get_executor(taskpath).run(fcn, configs, star=True))
+
+
+def set_executor(executor):
+    """Sets the executor of the parallel batch runners, an instance of
+    executors.Executor such as executors.QueueExecutor. None restores the
+    local pool."""
+    global EXECUTOR
+    EXECUTOR = executor
+
+
+def get_executor(taskpath=None):
+    """Returns the executor of the parallel batch runners, see set_executor"""
+    if EXECUTOR is not None:
+        return EXECUTOR
+    return PoolExecutor(CORE_NUMBER, taskpath)
+
+
+class PoolExecutor(Executor):
+    """Executor that runs the jobs in the local pool of get_pool"""
+
+    def __init__(self, WRKs=CORE_NUMBER, taskpath=None):
+        self.WRKs = WRKs
+        self.taskpath = taskpath
+
+    def run(self, fcn, configs, star=False):
+        return _runparallel_pool(fcn, configs, star, self.WRKs, self.taskpath)
+
+
+def get_pool(WRKs=CORE_NUMBER, taskpath=None):
+    """Returns the long-lived pool of worker processes of the batch runners.
+    Workers import pyatc once and preload the compiled skies of the tasks of
+    TASKNAMES found in taskpath, so jobs only need the paths of their logs.
+    The pool is created again when the number of workers or taskpath
+    change, or when any of its workers uses more than POOL_MAXMEMORY."""
+    global POOL, POOL_CONFIG, POOL_WORKERS
+    if POOL is not None:
+        if POOL_CONFIG[0] != WRKs or (taskpath is not None and POOL_CONFIG[1] != taskpath):
+            close_pool()
+        elif get_pool_memory() > POOL_MAXMEMORY:
+            print('\t[WARNING] Recycling the worker pool, it uses more than %d bytes' % POOL_MAXMEMORY)
+            close_pool()
+    if POOL is None:
+        started = mp.SimpleQueue()
+        POOL = mp.Pool(processes=WRKs, initializer=_init_pool_worker, initargs=(taskpath, started))
+        POOL_CONFIG = (WRKs, taskpath)
+        POOL_WORKERS = (started, set())
+    return POOL
+
+
+def get_pool_memory():
+    """Returns the largest resident memory in bytes of the pool workers"""
+    memory = 0
+    for pid in _get_pool_pids():
+        try:
+            memory = max(memory, psutil.Process(pid).memory_info().rss)
+        except psutil.Error:
+            # The worker exited, see get_dead_workers
+            pass
+    return memory
+
+
+def get_dead_workers():
+    """Returns the pids of the pool workers that exited. Workers only exit
+    when the pool is closed, so the jobs they were running are lost."""
+    dead = list()
+    for pid in _get_pool_pids():
+        try:
+            if psutil.Process(pid).status() == psutil.STATUS_ZOMBIE:
+                dead.append(pid)
+        except psutil.NoSuchProcess:
+            dead.append(pid)
+    return dead
+
+
+def _get_pool_pids():
+    """Returns the pids sent by the pool workers, see _init_pool_worker"""
+    if POOL is None:
+        return set()
+    (started, pids) = POOL_WORKERS
+    while not started.empty():
+        pids.add(started.get())
+    return pids
+
+
+def close_pool(terminate=False):
+    """Waits for the jobs of the pool and stops its workers, or stops them
+    right away if terminate is set"""
+    global POOL, POOL_CONFIG, POOL_WORKERS
+    if POOL is not None:
+        if terminate:
+            POOL.terminate()
+        else:
+            POOL.close()
+        POOL.join()
+    POOL = None
+    POOL_CONFIG = None
+    POOL_WORKERS = None
 
 
 """
@@ -369,24 +799,77 @@ def runparallel_async(fcn, configs):
 ------------------------------------------------------------------------
 """
 
-def _runparallel_pool(fcn, configs, WRKs=CORE_NUMBER, max_tasks=1):
-    # Multiprocessing Pool backend. It fails to pickle lambda functions,
-    # and therefore, should be replaced by an alternative backend
-    # (pathos most likely) when a python 3 compatible version is released
-    with closing(mp.Pool(processes=WRKs, maxtasksperchild=max_tasks)) as pool:
-        results = pool.map(fcn, configs)
-        pool.close()
-        pool.join()
-        pool.terminate()
-        #pool.clear()
-    return results
-
-
-def _runparallel_pool_async(fcn, configs, WRKs=CORE_NUMBER, max_tasks=1):
-    # asyn execution of lambda
-    with closing(mp.Pool(processes=WRKs, maxtasksperchild=max_tasks)) as pool:
-        jobs = [pool.apply_async(fcn, conf) for conf in configs]
-        results = [job.get() for job in jobs]
-    return results
-
-
+def preload_skies(taskpath):
+    """Preloads the compiled skies of the tasks of TASKNAMES found in
+    taskpath, see _init_pool_worker and the worker command"""
+    if taskpath is None:
+        return
+    for taskname in TASKNAMES:
+        taskfilepath = os.path.join(taskpath, taskname)
+        if os.path.isfile(taskfilepath):
+            sky.get_sky(taskfilepath, os.path.join(taskpath, 'Flows_' + taskname + '.csv'))
+
+
+def _init_pool_worker(taskpath, started):
+    """Initializer of the pool workers, sends their pid to get_pool_memory
+    and preloads the skies of the tasks in taskpath"""
+    started.put(os.getpid())
+    preload_skies(taskpath)
+
+
+def _runparallel_pool(fcn, configs, star=False, WRKs=CORE_NUMBER, taskpath=None):
+    # Jobs are submitted a few at a time, so that when the workers use too
+    # much memory the pool can be recycled once the submitted jobs finish.
+    # Multiprocessing Pool fails to pickle lambda functions, use module
+    # level functions as fcn
+    done = queue.Queue()
+    pending = 0
+    pool = get_pool(WRKs, taskpath)
+    try:
+        for (i, config) in enumerate(configs):
+            if pending >= 2 * WRKs:
+                result = _get_pool_result(done)
+                pending -= 1
+                yield result
+                if get_pool_memory() > POOL_MAXMEMORY:
+                    while pending > 0:
+                        result = _get_pool_result(done)
+                        pending -= 1
+                        yield result
+                    pool = get_pool(WRKs, taskpath)
+            pool.apply_async(fcn, config if star else (config,),
+                             callback=lambda r, i=i: done.put((True, (i, r))),
+                             error_callback=lambda e: done.put((False, e)))
+            pending += 1
+        while pending > 0:
+            result = _get_pool_result(done)
+            pending -= 1
+            yield result
+    finally:
+        # The generator was closed early or a job failed, the results of
+        # the jobs still running would end in the next batch
+        if pending > 0:
+            close_pool(terminate=True)
+
+
+def _get_pool_result(done):
+    """Waits for the next result of the pool, raises the error of its job,
+    or a RuntimeError when a worker exits, since its job never ends"""
+    while True:
+        try:
+            (ok, result) = done.get(timeout=POOL_POLL)
+            break
+        except queue.Empty:
+            dead = get_dead_workers()
+            if dead:
+                print('\t[ERROR] The pool workers %s exited, their jobs are lost' % dead)
+                raise RuntimeError('Pool workers %s exited while running jobs' % dead)
+    if not ok:
+        raise result
+    return result
+
+
+def _collect(results):
+    """Returns the results of Executor.run in the order of their configs"""
+    results = sorted(results, key=lambda r: r[0])
+    return [result for (_, result) in results]
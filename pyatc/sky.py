@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This file is part of pyatc library
+#
+# Authors:
+# Jorge Ibáñez Gijón <jorge.ibannez@uam.es> [2020-2022]
+# Departamento de Psicología Básica, Facultad de Psicología
+# Universidad Autónoma de Madrid
+#
+# © Copyright 2022 Jorge Ibáñez Gijón. All rights reserved
+#
+
+"""
+Compiled skies: everything that only depends on the task xml and its flows
+file, shared by all the logs of the same task.
+
+A compiled sky holds the task and flows dicts, the sky parameters (sector,
+routes, crossing points between flows...), the arrays of the flightpaths
+and the potential interactions between aircrafts. Compiled skies are
+memoized by the hash of the task and flows files, so the participants of an
+experiment that run the same task only pay for the geometry once.
+"""
+
+import os
+
+from collections import OrderedDict as OD
+
+from . import util
+from .xml import load_xml
+from .cache import get_file_hash
+from .conflicts_segments import get_potential_interactions, get_flightpath_arrays, get_crossings_features
+
+
+# Compiled skies already loaded, indexed by the hash of their task and flows files
+SKIES = OD()
+
+# Maximum number of compiled skies kept in memory
+SKIES_MAXSIZE = 32
+
+
+def get_flows_path(taskfilepath):
+    """Returns the path of the flows file of a task: Flows_[TASKNAME].xml.csv
+    in the directory of the task file."""
+    (taskpath, taskfilename) = os.path.split(taskfilepath)
+    return os.path.join(taskpath, 'Flows_' + taskfilename + '.csv')
+
+
+def compile_sky(taskfilepath, flowspath=None):
+    """Loads a task and its flows file and precomputes the sky parameters,
+    the potential interactions between aircrafts, the (memoized) arrays of
+    the flightpaths and the static values of each crossing point."""
+    flowspath = get_flows_path(taskfilepath) if flowspath is None else flowspath
+    sky = OD()
+    sky['taskfilepath'] = taskfilepath
+    sky['flowspath'] = flowspath
+    sky['taskdict'] = load_xml(taskfilepath)
+    if os.path.isfile(flowspath):
+        sky['flowdict'] = util.parse_flows_file(flowspath, sky['taskdict'])
+    else:
+        print('\tWarning, the flows file %s does not exists' % flowspath)
+        sky['flowdict'] = OD()
+
+    params = util.get_sky_parameters(sky['taskdict'], sky['flowdict'])
+    for aircraft in params['aircrafts'].values():
+        get_flightpath_arrays(aircraft['flightpath'])
+    params['interactions'] = get_potential_interactions(params)
+    params['crossing_features'] = get_crossings_features(params['interactions'], params['sector'], params['crossingpoints'])
+    sky['params'] = params
+    return sky
+
+
+def get_sky(taskfilepath, flowspath=None):
+    """Returns the compiled sky of a task, compiling it only if the task or
+    flows files have not been seen before."""
+    flowspath = get_flows_path(taskfilepath) if flowspath is None else flowspath
+    key = get_file_hash(taskfilepath)
+    if os.path.isfile(flowspath):
+        key += get_file_hash(flowspath)
+
+    if key in SKIES:
+        SKIES.move_to_end(key)
+    else:
+        SKIES[key] = compile_sky(taskfilepath, flowspath)
+        while len(SKIES) > SKIES_MAXSIZE:
+            SKIES.popitem(last=False)
+    return SKIES[key]
+
+
+def get_log_parameters(sky, tmax=600, pathname='.', logfile='logfile_name_not_set.xml.log'):
+    """Returns the parameters of a log file of the task of a compiled sky,
+    the same that util.get_sky_parameters would return. Values are shared by
+    all the logs of the task and must not be modified."""
+    params = OD(sky['params'])
+    params['tmax'] = tmax
+    params['pathname'] = pathname
+    params['logfile'] = logfile
+    return params
+
+
+def clear():
+    """Forgets all the compiled skies"""
+    SKIES.clear()
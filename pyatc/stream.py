@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# This file is part of pyatc library
+#
+# Authors:
+# Jorge Ibáñez Gijón <jorge.ibannez@uam.es> [2020-2022]
+# Departamento de Psicología Básica, Facultad de Psicología
+# Universidad Autónoma de Madrid
+#
+# © Copyright 2022 Jorge Ibáñez Gijón. All rights reserved
+#
+
+"""
+Online COMETA computation, tick by tick, as the call_update records of a
+log arrive.
+
+All the conflict and COMETA values of a time tick only depend on the
+records of the aircrafts at that tick, so each tick is computed with the
+same functions of the offline pipeline (compute_aircrafts_trjs,
+compute_trajectories_conflicts and the dense COMETA engine) applied to the
+records of that tick alone. The static part of the sky (routes, potential
+interactions, flows) is compiled once when the stream is created.
+
+Typical use, following a log that pact.exe is still writing:
+
+    stream = CometaStream('task/T1.xml')
+    for row in stream.run(parse.iter_records('T1.xml.log', follow=True)):
+        print(row['time'], row['COMETA'])
+"""
+
+import numpy as np
+import pandas as pd
+
+from collections import OrderedDict as OD
+
+from . import sky
+from . import util
+from .parse import iter_records
+from .cometa import get_cometa_features, evaluate_cometa_features, compute_flow_interactions
+from .cometa_params import CometaParams, COMETA_NAMES, CALL_NAMES
+from .conflicts_segments import compute_aircrafts_trjs, compute_trajectories_conflicts
+
+
+class CometaStream(object):
+    """Computes the COMETA row of each time tick of a log from its records.
+    Records are fed with update, and the row of a tick is returned when the
+    first record of a later tick arrives, or when flush is called.
+
+    Each tick is computed again from its own records, so the stream keeps
+    no kinematic state of the aircrafts between ticks, only the records of
+    the pending tick (records) and the conflicts active at the last tick
+    with the time they became active (active_conflicts).
+    """
+
+    def __init__(self, taskfilepath, flowspath=None, tmax=600, cometap=None):
+        self.sky = sky.get_sky(taskfilepath, flowspath)
+        self.params = sky.get_log_parameters(self.sky, tmax)
+        self.cometap = CometaParams() if cometap is None else CometaParams(cometap)
+        self.tmax = tmax
+
+        # Static COMETA inputs of the task
+        self.task_aircrafts = util.get_aircrafts_xml(self.sky['taskdict'])
+        self.non_standard = util.get_non_standard_aircrafts(self.task_aircrafts, self.sky['flowdict'])
+        self.inevolution = util.get_inevolution_aircrafts(self.task_aircrafts)
+        self.flow_interactions = compute_flow_interactions(
+            self.params['crossingpoints'], self.params['flows'], self.cometap)
+
+        # Dynamic state
+        self.tick = None
+        self.records = OD()
+        self.active_conflicts = OD()
+
+    def update(self, otype, record):
+        """Feeds a parsed record, as yielded by parse.iter_records. Returns
+        the row of the previous tick if the record starts a new one, or None.
+        Records of other types than call_update are ignored."""
+        if otype != 'call_update':
+            return None
+        tick = np.round(record[0] / 1000)
+        row = None
+        if self.tick is not None and tick > self.tick:
+            row = self.flush()
+        elif self.tick is not None and tick < self.tick:
+            print('\t[WARNING] Skipping record of %s at %d ms, older than the current tick' % (record[1], record[0]))
+            return None
+
+        # Keep the first record of each aircraft in the tick, as the offline pipeline
+        self.tick = tick
+        if record[1] not in self.records:
+            self.records[record[1]] = record
+        return row
+
+    def flush(self):
+        """Computes the row of the pending tick, None if there is none"""
+        if len(self.records) == 0:
+            return None
+        row = self.compute_tick(list(self.records.values()))
+        self.records = OD()
+        return row
+
+    def compute_tick(self, records):
+        """Computes the COMETA row of the call_update records of one tick"""
+        calls = pd.DataFrame(records, columns=CALL_NAMES)
+        trajectories = compute_aircrafts_trjs(calls, self.params['sector'])
+        conflicts = compute_trajectories_conflicts(trajectories, self.params, self.tmax, self.cometap)
+        features = get_cometa_features(self.task_aircrafts, conflicts, self.sky['flowdict'],
+                                       self.non_standard, self.inevolution, trajectories)
+        arrays = evaluate_cometa_features(features, self.flow_interactions, self.cometap)
+
+        row = OD()
+        row['time'] = features['time'][0]
+        for name in COMETA_NAMES:
+            row[name] = arrays[name][:, 0].sum()
+        row['Active_conflicts'] = arrays['Active_conflicts'][:, 0].sum() / 2
+
+        # Update the active conflicts, keeping the time they started
+        active = OD()
+        for c, cname in enumerate(arrays['conflicts']):
+            if arrays['inconflict'][c, 0]:
+                active[cname] = self.active_conflicts.get(cname, row['time'])
+        self.active_conflicts = active
+        return row
+
+    def run(self, records):
+        """Generator of the rows of all the ticks of an iterable of records"""
+        for (otype, record) in records:
+            row = self.update(otype, record)
+            if row is not None:
+                yield row
+        row = self.flush()
+        if row is not None:
+            yield row
+
+
+def compute_cometa_stream(logpath, taskfilepath, flowspath=None, tmax=600, cometap=None, follow=False):
+    """Computes the COMETA of a log with a CometaStream. Returns a dataframe
+    with the row of each tick, indexed by time."""
+    stream = CometaStream(taskfilepath, flowspath, tmax, cometap)
+    rows = list(stream.run(iter_records(logpath, follow=follow)))
+    streamdf = pd.DataFrame(rows, columns=['time'] + COMETA_NAMES + ['Active_conflicts'])
+    return streamdf.set_index(streamdf.time)
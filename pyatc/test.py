@@ -11,11 +11,83 @@
 # © Copyright 2022 Jorge Ibáñez Gijón. All rights reserved
 #
 
+import os
+import time
+import random
+import tempfile
+import numpy as np
+import multiprocessing as mp
+
 from collections import OrderedDict as OD
 
 from . import test_path
 from . import util
-from .cometa import compute_cometa, COMETAP
+from . import parse
+from . import runners
+from .cometa import compute_cometa, compute_cometa_sweep, COMETAP, COMETA_ENGINES
+from .cometa_params import COMETA_NAMES, CometaParams, get_cometa_params_grid
+from .conflicts_segments import compute_conflicts, get_candidate_segments, get_trajectories_interactions
+from .executors import QueueExecutor, run_worker
+from .stream import compute_cometa_stream
+from .xml import load_xml, get_aircrafts_xml, get_routenames_xml
+
+
+# Directory of the generated test logs, used when the log of a test scenario
+# is not found in tests/logs, and of the tasks of ROUTE_SCENARIOS. See
+# get_test_paths.
+GENERATED_LOGS_PATH = os.path.join(tempfile.gettempdir(), 'pyatc_test_logs')
+
+# Locations and routes of the tasks written by generate_test_task. The
+# locations and routes R1 and R2 are the ones of the map of T14, which is
+# extended with the rest of the routes.
+TEST_LOCATIONS = OD([('A', (-8, 0)), ('B', (0, 0)), ('C', (8, 0)), ('D', (-4, 4)),
+                     ('E', (4, -4)), ('F', (-8, 4)), ('G', (8, 4)),
+                     ('J', (2, 2)), ('K', (4, 0)), ('L', (12, 0))])
+TEST_ROUTES = OD([('R1', 'ABC'), ('R2', 'FBC'), ('R1R', 'CBA'), ('R2R', 'CBF'), ('R3', 'DBE'), ('R4', 'ABG'),
+                  ('R5', 'ABKC'), ('R6', 'ABJKCL'), ('R7', 'ABKCL'), ('R8', 'JKCLGFAB')])
+
+# Test scenarios with aircrafts sharing routes, in the same and in opposite
+# senses, so that every case of the overlap conflicts is reached (but the
+# newpos of None when the aircraft behind has not entered the overlap, which
+# needs a position off its own flightpath). Aircrafts are (route, start in
+# ms, altitude, exit altitude, velocity).
+ROUTE_SCENARIOS = OD([
+    # Faster aircrafts catching up slower ones in the same route, and
+    # aircrafts merging into it or leaving it
+    ('S1', OD([('SOL101', ('R1', 0, 37000, 37000, 300)),
+               ('SOL102', ('R1', 15000, 37000, 37000, 500)),
+               ('SOL103', ('R1', 30000, 36500, 37500, 450)),
+               ('SOL104', ('R2', 5000, 37000, 37000, 480)),
+               ('SOL105', ('R4', 0, 37000, 37000, 400))])),
+    # Aircrafts flying the same route in opposite senses
+    ('S2', OD([('OPP201', ('R1', 0, 37000, 37000, 400)),
+               ('OPP202', ('R1', 40000, 37000, 37000, 400)),
+               ('OPP203', ('R1R', 0, 37000, 37000, 450)),
+               ('OPP204', ('R1R', 20000, 36800, 36000, 350)),
+               ('OPP205', ('R2R', 10000, 37000, 37000, 500)),
+               ('OPP206', ('R3', 0, 37000, 37000, 420)),
+               ('OPP207', ('R2', 5000, 37000, 37000, 450))])),
+    # Aircrafts trailing at the same velocity, and entering the shared
+    # segment while others are already in it
+    ('S3', OD([('MIX301', ('R1', 0, 37000, 37000, 250)),
+               ('MIX302', ('R1', 5000, 37000, 37000, 250)),
+               ('MIX303', ('R2', 0, 37000, 37000, 600)),
+               ('MIX304', ('R1R', 60000, 37000, 37000, 300)),
+               ('MIX305', ('R4', 20000, 37400, 37400, 500)),
+               ('MIX306', ('R2R', 45000, 37200, 36800, 380))])),
+    # Aircrafts that leave a route and join it again, or fly a loop, so that
+    # the distances to the entry of an overlap differ between both routes
+    ('S4', OD([('DET401', ('R7', 0, 37000, 37000, 300)),
+               ('DET402', ('R6', 0, 37000, 37000, 360)),
+               ('DET403', ('R6', 10000, 37000, 37000, 280)),
+               ('DET404', ('R7', 20000, 37000, 37000, 330)),
+               ('DET405', ('R8', 0, 37000, 37000, 250)),
+               ('DET406', ('R5', 30000, 37000, 37000, 330)),
+               ('DET407', ('R6', 10000, 37000, 37000, 400))])),
+    ])
+
+# Timestamp of the lines of the generated logs
+GENERATED_LOG_TIME = '<time>mi\xe9 7. oct 10:15:38 2015</time>'
 
 
 def run_test(testno=1, conflict_dist=4.0, tmax=60):
@@ -27,25 +99,244 @@ def run_test(testno=1, conflict_dist=4.0, tmax=60):
     res['conflict_dist'] = conflict_dist
 
     # Change value of distance to conflict
-    default_dist = COMETAP['umbral_distancia_conflicto']
-    COMETAP['umbral_distancia_conflicto'] = conflict_dist
+    cometap = CometaParams(umbral_distancia_conflicto=conflict_dist)
     
     # Prepare paths
     res['taskname'] = "T%d.xml" % testno
     res['logname'] = res['taskname'] + '.log'
-    res['logpath'] = str(test_path.joinpath('logs', res['logname']))
-    res['taskpath'] = str(test_path.joinpath('tasks', res['taskname']))
+    (res['logpath'], res['taskpath']) = get_test_paths(testno)
     
     # Fetch task properties
-    res['taskdict'], res['logdict'], res['flowdict'], res['params'] = util.prepare_cometa_data(
+    res['taskdict'], res['logdict'], res['flowdict'], res['params'] = util.prepare_data(
         res['logpath'], res['taskpath'], res['tmax'], False)
     
     res['cometadf'], res['aircrafts_cometa'], res['conflicts'], res['trajectories'] = compute_cometa(
-        res['taskdict'], res['logdict'], res['flowdict'], res['params'], False)
+        res['taskdict'], res['logdict'], res['flowdict'], res['params'], False, cometap=cometap)
 
-    # Restore distance value
-    COMETAP['umbral_distancia_conflicto'] = default_dist
-    
+    return res
+
+
+def get_test_paths(testno=1, logpath=None, taskpath=None):
+    """Returns the paths of the log and task files of test scenario testno,
+    unless they are given. testno is the number of a task of tests/tasks, or
+    the name of a scenario of ROUTE_SCENARIOS, whose task is written with
+    generate_test_task. Logs are looked for in tests/logs, and when they
+    are not there they are generated from the task file in
+    GENERATED_LOGS_PATH with generate_test_log. Generated files are written
+    again when this module changes."""
+    name = testno if testno in ROUTE_SCENARIOS else 'T%d' % testno
+    if taskpath is None:
+        if testno in ROUTE_SCENARIOS:
+            taskpath = os.path.join(GENERATED_LOGS_PATH, name + '.xml')
+            if not _is_generated(taskpath):
+                os.makedirs(GENERATED_LOGS_PATH, exist_ok=True)
+                generate_test_task(taskpath, ROUTE_SCENARIOS[testno])
+        else:
+            taskpath = str(test_path.joinpath('tasks', name + '.xml'))
+    if logpath is None:
+        logpath = str(test_path.joinpath('logs', name + '.xml.log'))
+        if not os.path.isfile(logpath):
+            logpath = os.path.join(GENERATED_LOGS_PATH, name + '.xml.log')
+            if not _is_generated(logpath):
+                os.makedirs(GENERATED_LOGS_PATH, exist_ok=True)
+                generate_test_log(taskpath, logpath, seed=testno)
+    return logpath, taskpath
+
+
+def _is_generated(path):
+    """Checks whether a generated file exists and is newer than this module"""
+    return os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(__file__)
+
+
+def generate_test_task(taskpath, aircrafts):
+    """Writes a task file, and its flows file, with the map of the T14 test
+    task extended with the locations and routes of TEST_LOCATIONS and
+    TEST_ROUTES, and the aircrafts given as an OrderedDict name -> (route,
+    start in ms, altitude, exit altitude, velocity). The aircrafts of each
+    route are a flow."""
+    basepath = str(test_path.joinpath('tasks', 'T14.xml'))
+    with open(basepath, 'r', encoding='utf-8') as f:
+        task = f.read()
+    taskxml = load_xml(basepath)
+    routenames = get_routenames_xml(taskxml)
+    locationnames = [location['idx'] for location in taskxml['experiment']['data']['map']['location']]
+
+    locations = list()
+    for location, (x, y) in TEST_LOCATIONS.items():
+        if location not in locationnames:
+            locations.append("\t\t\t<atc:location atc:y='%g' atc:x='%g' atc:visible='off' atc:idx='%s' />\n" % (y, x, location))
+    marker = '\t\t\t<!-- LLEGADAS -->'
+    task = task.replace(marker, ''.join(locations) + '\n' + marker)
+
+    routes = list()
+    for route, points in TEST_ROUTES.items():
+        if route in routenames:
+            continue
+        routes.append("\t\t\t<atc:route atc:idx='%s'>\n" % route)
+        for point in points:
+            routes.append("\t\t\t\t<atc:pointref atc:location='%s' />\n" % point)
+        routes.append("\t\t\t</atc:route>\n")
+    marker = '\t\t\t<!-- MI SECTOR -->'
+    task = task.replace(marker, ''.join(routes) + '\n' + marker)
+
+    sky = ["<atc:sky atc:idx='skyPRAC'>\n"]
+    flows = OD()
+    for name, (route, start, altitude, altitude_end, velocity) in aircrafts.items():
+        flows.setdefault(route, list()).append(name)
+        sky.append("\n\t\t\t<atc:aircraft atc:type='A320' atc:idx='%s'>\n" % name)
+        sky.append("\t\t\t\t<atc:start>%d</atc:start>\n" % start)
+        sky.append("\t\t\t\t<atc:altitude>%d</atc:altitude>\n" % altitude)
+        sky.append("\t\t\t\t<atc:velocity>%d</atc:velocity>\n" % velocity)
+        sky.append("\t\t\t\t<atc:flightpath>\n")
+        for k, point in enumerate(TEST_ROUTES[route]):
+            (x, y) = TEST_LOCATIONS[point]
+            if k == 0 and altitude_end != altitude:
+                sky.append("\t\t\t\t\t<atc:point atc:y='%g' atc:x='%g'>\n" % (y, x))
+                sky.append("\t\t\t\t\t\t<atc:altitude>%d</atc:altitude>\n" % altitude_end)
+                sky.append("\t\t\t\t\t</atc:point>\n")
+            else:
+                sky.append("\t\t\t\t\t<atc:point atc:y='%g' atc:x='%g'/>\n" % (y, x))
+        sky.append("\t\t\t\t</atc:flightpath>\n")
+        sky.append("\t\t\t</atc:aircraft>\n")
+    sky.append("\n\t\t</atc:sky>")
+    (start, end) = (task.index('<atc:sky '), task.index('</atc:sky>') + len('</atc:sky>'))
+    task = task[:start] + ''.join(sky) + task[end:]
+
+    with open(taskpath, 'w', encoding='utf-8') as f:
+        f.write(task)
+    (taskdir, taskname) = os.path.split(taskpath)
+    with open(os.path.join(taskdir, 'Flows_' + taskname + '.csv'), 'w') as f:
+        for route, names in flows.items():
+            f.write('%s,[%d],%s\n' % (route, len(names), ','.join(names)))
+
+
+def generate_test_log(taskpath, logpath, duration=900, seed=0):
+    """Writes a synthetic pact.exe log of a task, in which every aircraft of
+    the task flies its flightpath at its velocity from its start time, and
+    the ones with a different exit altitude climb or descend at 25 feet per
+    second. Besides the call_update records of every second, it contains
+    clock ticks, mouse events and user interventions, so that all the record
+    types used by the COMETA computation are present."""
+    rnd = random.Random(seed)
+    aircrafts = get_aircrafts_xml(load_xml(taskpath))
+    T = GENERATED_LOG_TIME
+    lines = list()
+    lines.append(T + '<info><log>start</log></info>')
+    lines.append(T + '<info><experiment>test_001</experiment></info>')
+    lines.append(T + '<info><phase>test-initial</phase><type>trial</type><task_id>E000-T09</task_id></info>')
+    lines.append(T + '<info><elapsed_time>47</elapsed_time><clock>start_request</clock><interval>5000</interval></info>')
+    for t in range(1, duration):
+        ms = t*1000 + rnd.randint(0, 3)
+        for name, aircraft in aircrafts.items():
+            # Start times of the tasks are in ms
+            ts = t - aircraft['start'] / 1000.
+            if ts < 0:
+                continue
+            # Random speed noise in 1% of the records
+            vel = aircraft['velocity'] * (1 + 0.2*rnd.random() if rnd.random() < 0.01 else 1)
+            position = _get_flightpath_position(aircraft['flightpath'], ts * aircraft['velocity'] / 3600.)
+            if position is None:
+                continue
+            (x, y, heading) = position
+            (alt, climb) = (aircraft['altitude'], 0.0)
+            if aircraft['altitude_end'] != aircraft['altitude']:
+                sign = 1 if aircraft['altitude_end'] > aircraft['altitude'] else -1
+                climb = sign * 1500.
+                alt = alt + sign * min(abs(aircraft['altitude_end'] - alt), 25*ts)
+            control = 1 if ts < 20 else (2 if ts < 35 else 3)
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><call>%s</call><type>%s</type><control>%d</control>'
+                         '<xpos>%.4f</xpos><ypos>%.4f</ypos><alt>%.1f</alt><vel>%.3f</vel><head>%.5f</head>'
+                         '<climb>%.2f</climb><power>-0.73</power></info>' % (
+                             ms + rnd.randint(0, 5), name, aircraft['type'], control, x, y, alt, vel, heading, climb))
+        if t % 5 == 0:
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><clock>tick</clock></info>' % (ms+7))
+        if t % 13 == 0:
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><view>experiment</view><event>mouse_down</event><x>%.1f</x><y>%.1f</y></info>' % (ms+11, rnd.uniform(0,300), rnd.uniform(0,300)))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><view>experiment</view><event>mouse_up</event><x>65.6</x><y>42.6</y></info>' % (ms+12))
+            lines.append(T + '<info><elapsed>%d</elapsed><mouse>pressed</mouse><x>1</x><y>472</y><button>1</button><state>0</state></info>' % (ms+13))
+        if t % 17 == 0:
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><view>experiment</view><event>mouse_double_click</event><x>205.7</x><y>36</y></info>' % (ms+14))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><view>experiment</view><event>mouse_move</event><x>65.9</x><y>42.9</y></info>' % (ms+15))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><view>experiment</view><event>key_press</event><key>R</key></info>' % (ms+16))
+        if t % 97 == 0:
+            name = rnd.choice(list(aircrafts))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><view>experiment</view><solution-request>cleared_flight_level</solution-request><callsign>%s</callsign></info>' % (ms+17, name))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><view>experiment</view><solution>cleared_flight_level</solution><callsign>%s</callsign><value>31000</value><result>1</result></info>' % (ms+18, name))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><call>%s</call><solution>level_variation</solution><new_cfl>31000</new_cfl><old_cfl>35000</old_cfl></info>' % (ms+19, name))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><call>%s</call><solution>speed_variation</solution><new_velocity>260</new_velocity><new_throttle>-0.62128</new_throttle><old_velocity>233.892</old_velocity><old_throttle>-0.746003</old_throttle><altitude>15562.9</altitude></info>' % (ms+20, name))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><call>%s</call><solution>vector</solution><new_heading>1.96773</new_heading><old_heading>0.197396</old_heading></info>' % (ms+21, name))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><call>%s</call><new_control>accepted</new_control><old_control>2</old_control></info>' % (ms+22, name))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><action>rotate_callout</action><callsign>%s</callsign></info>' % (ms+23, name))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><tool>route</tool><active>1</active><callsign>%s</callsign></info>' % (ms+24, name))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><tool>short_route_probe</tool><value>1</value><callsign>%s</callsign></info>' % (ms+25, name))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><tool>history</tool><active>0</active><callsign>%s</callsign></info>' % (ms+26, name))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><view>experiment</view><scale>move_to</scale><x>1110</x><y>265</y></info>' % (ms+27))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><view>experiment</view><scale>start_move</scale></info>' % (ms+28))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><view>experiment</view><scale>end_move</scale></info>' % (ms+29))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><view>experiment</view><vector_tool>start</vector_tool></info>' % (ms+30))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><view>experiment</view><vector_tool>move_to</vector_tool><x>906</x><y>248</y></info>' % (ms+31))
+            lines.append(T + '<info><elapsed_time>%d</elapsed_time><view>experiment</view><vector_tool>end_move</vector_tool></info>' % (ms+32))
+    lines.append(T + '<info><elapsed>%d</elapsed><action>terminated</action></info>' % (duration*1000))
+    lines.append(T + '<info><log>end</log></info>')
+
+    # pact.exe writes windows line endings in the encoding of the computer locale
+    tmppath = logpath + '.tmp'
+    with open(tmppath, 'wb') as f:
+        f.write(('\r\n'.join(lines) + '\r\n').encode('latin-1'))
+    os.replace(tmppath, logpath)
+
+
+def _get_flightpath_position(flightpath, distance):
+    """Position and heading at a distance along a flightpath, None past its end"""
+    for ((x0,y0), (x1,y1)) in zip(flightpath[:-1], flightpath[1:]):
+        length = np.hypot(x1-x0, y1-y0)
+        if distance <= length:
+            return x0 + (x1-x0)*distance/length, y0 + (y1-y0)*distance/length, np.arctan2(y1-y0, x1-x0)
+        distance -= length
+    return None
+
+
+def compare_interaction_candidates(taskpaths=None, nrandom=200, seed=0):
+    """Checks that get_trajectories_interactions finds the same crossings and
+    overlaps between every pair of flightpaths when it only tests the
+    candidate segments of get_candidate_segments. Flightpaths are taken from
+    the test tasks (T1-T16 by default), from a long segment with a parallel
+    one 1 NM apart, and from nrandom random pairs of nearly parallel routes.
+    """
+    rnd = random.Random(seed)
+    if taskpaths is None:
+        taskpaths = [get_test_paths(testno, logpath='')[1] for testno in range(1,17)]
+    scenarios = OD()
+    for taskpath in taskpaths:
+        aircrafts = get_aircrafts_xml(load_xml(taskpath))
+        scenarios[os.path.basename(taskpath)] = OD(
+            (aname, [tuple(p) for p in aircraft['flightpath']]) for aname, aircraft in aircrafts.items())
+    scenarios['parallel'] = OD([('A', [(0.,0.), (100.,0.)]), ('B', [(40.,1.), (60.,1.)])])
+    for k in range(nrandom):
+        route = [(rnd.uniform(-100,100), rnd.uniform(-100,100)) for _ in range(rnd.randint(2,4))]
+        offset = rnd.uniform(0, 3)
+        scenarios['random%d' % k] = OD([
+            ('A', route),
+            ('B', [(x + rnd.uniform(-1,1), y + offset) for (x,y) in route[rnd.randint(0,1):]])])
+
+    res = OD()
+    res['diffs'] = list()
+    for name, flightpaths in scenarios.items():
+        candidates = get_candidate_segments(OD((aname, {'flightpath': locs}) for aname, locs in flightpaths.items()))
+        for aname1, locs1 in flightpaths.items():
+            for aname2, locs2 in flightpaths.items():
+                if aname1 == aname2:
+                    continue
+                for same_route in (False, True):
+                    expected = get_trajectories_interactions(locs1, locs2, same_route)
+                    if (aname1, aname2) in candidates:
+                        found = get_trajectories_interactions(locs1, locs2, same_route, candidates[(aname1, aname2)])
+                    else:
+                        found = (OD(), OD())
+                    if found != expected:
+                        res['diffs'].append('%s.%s_%s' % (name, aname1, aname2))
+    res['scenarios'] = len(scenarios)
+    res['equal'] = len(res['diffs']) == 0
     return res
 
 
@@ -56,6 +347,115 @@ def run_all_tests(conflict_dist=4.0, tmax=30):
     return res
 
 
+def compare_parse_engines(logpath, repeat=3):
+    """Parses a log file with every engine of parse.run, checks that all
+    of them produce the same output and reports the best time of each one.
+    """
+    res = OD()
+    outdicts = OD()
+    for engine in parse.PARSE_ENGINES:
+        times = list()
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            outdicts[engine] = parse.run(logpath, engine=engine, cache=False)
+            times.append(time.perf_counter() - t0)
+        res[engine] = min(times)
+    reference = outdicts['lines']
+    res['equal'] = all(outdict == reference for outdict in outdicts.values())
+    for engine in parse.PARSE_ENGINES:
+        print('\t%s engine: %.3f s (x%.1f)' % (engine, res[engine], res['lines'] / res[engine]))
+    return res
+
+
+def compare_conflict_engines(testno=1, tmax=600, logpath=None, taskpath=None, rtol=1e-9, sparse=False):
+    """Computes the conflicts of a test scenario with the scalar and the
+    vectorized versions of compute_conflicts, and checks that every column
+    of every conflict agrees. By default, the log and task of test testno
+    are used, and the full conflict frames are compared, not only the ticks
+    kept by the sparse filter.
+    """
+    res = OD()
+    (logpath, taskpath) = get_test_paths(testno, logpath, taskpath)
+    _, logdict, _, params = util.prepare_data(logpath, taskpath, tmax)
+
+    conflicts = OD()
+    for engine, vectorized in (('scalar', False), ('vectorized', True)):
+        t0 = time.perf_counter()
+        conflicts[engine], _ = compute_conflicts(logdict, params, tmax, vectorized=vectorized, sparse=sparse)
+        res[engine] = time.perf_counter() - t0
+
+    res['conflicts'] = list(conflicts['scalar'].keys())
+    res['diffs'] = list()
+    if res['conflicts'] != list(conflicts['vectorized'].keys()):
+        res['diffs'].append('names')
+    else:
+        for cname in res['conflicts']:
+            (df1, df2) = (conflicts['scalar'][cname], conflicts['vectorized'][cname])
+            for column in df1.columns:
+                if df1[column].dtype.kind == 'f':
+                    equal = np.allclose(df1[column].values, df2[column].values, rtol=rtol, atol=rtol, equal_nan=True)
+                else:
+                    equal = df1[column].equals(df2[column])
+                if not equal:
+                    res['diffs'].append('%s.%s' % (cname, column))
+    res['equal'] = len(res['diffs']) == 0
+    return res
+
+
+def compare_all_conflict_engines(tmax=600, logpath=None, taskpath=None, sparse=False):
+    """Runs compare_conflict_engines on the T1-T16 test scenarios and the
+    ones of ROUTE_SCENARIOS. Log and task files of T1-T16 are looked for in
+    logpath and taskpath if provided."""
+    res = OD()
+    for testno in list(range(1,17)) + list(ROUTE_SCENARIOS):
+        logfile = None
+        taskfile = None
+        if testno not in ROUTE_SCENARIOS:
+            logfile = None if logpath is None else os.path.join(logpath, 'T%d.xml.log' % testno)
+            taskfile = None if taskpath is None else os.path.join(taskpath, 'T%d.xml' % testno)
+        res[testno] = compare_conflict_engines(testno, tmax, logfile, taskfile, sparse=sparse)
+        name = testno if testno in ROUTE_SCENARIOS else 'T%d' % testno
+        print('\t%s: %d conflicts, scalar %.3f s, vectorized %.3f s, %s' % (
+            name, len(res[testno]['conflicts']), res[testno]['scalar'], res[testno]['vectorized'],
+            'equal' if res[testno]['equal'] else 'DIFFERENT: ' + ', '.join(res[testno]['diffs'])))
+    return res
+
+
+def compare_cometa_engines(testno=1, tmax=600, logpath=None, taskpath=None, rtol=1e-9):
+    """Computes COMETA for a test scenario with every engine of compute_cometa,
+    and checks that the overall and per-aircraft COMETA values agree.
+    """
+    res = OD()
+    (logpath, taskpath) = get_test_paths(testno, logpath, taskpath)
+    taskdict, logdict, flowdict, params = util.prepare_data(logpath, taskpath, tmax)
+
+    outputs = OD()
+    for engine in COMETA_ENGINES:
+        t0 = time.perf_counter()
+        outputs[engine] = compute_cometa(taskdict, logdict, flowdict, params, False, False, engine)
+        res[engine] = time.perf_counter() - t0
+
+    res['diffs'] = list()
+    (reference, _, _, _) = outputs['frames']
+    for engine, (cometadf, cometa_aircrafts, _, _) in outputs.items():
+        if not _equal_frames(reference, cometadf, rtol):
+            res['diffs'].append(engine)
+        for aname, acometa in outputs['frames'][1].items():
+            if not _equal_frames(acometa, cometa_aircrafts[aname], rtol, COMETA_NAMES + ['inregion', 'insector', 'Active_conflicts']):
+                res['diffs'].append('%s.%s' % (engine, aname))
+    res['equal'] = len(res['diffs']) == 0
+    return res
+
+
+def _equal_frames(df1, df2, rtol, columns=None):
+    columns = df1.columns if columns is None else columns
+    for column in columns:
+        (a, b) = (df1[column].values.astype(float), df2[column].values.astype(float))
+        if not np.allclose(a, b, rtol=rtol, atol=rtol, equal_nan=True):
+            return False
+    return True
+
+
 def debug_cometa_computations(cometa, aircrafts, conflicts, trjs, rows=range(0,50), aircraft=None):
     """This is an old function, not very usefull right now
     """
@@ -75,3 +475,99 @@ def debug_cometa_computations(cometa, aircrafts, conflicts, trjs, rows=range(0,5
         elif aircraft['idx'] == air2:
             suffix = '_a2'
         print(conflicts[cname].loc[rows,:])
+
+
+def compare_cometa_sweep(testno=1, tmax=600, logpath=None, taskpath=None, processes=1, rtol=1e-9, **values):
+    """Evaluates a grid of COMETA parameters with compute_cometa_sweep, and
+    checks that every parameter set gives the same COMETA of compute_cometa.
+    By default, the distance and severity thresholds are swept.
+    """
+    res = OD()
+    (logpath, taskpath) = get_test_paths(testno, logpath, taskpath)
+    if len(values) == 0:
+        values = OD([('umbral_distancia_conflicto', [4.0, 10.0]), ('umbral_c1', [4630.0, 9260.0]), ('d', [10, 20])])
+    taskdict, logdict, flowdict, params = util.prepare_data(logpath, taskpath, tmax)
+    cometaps = get_cometa_params_grid(**values)
+
+    t0 = time.perf_counter()
+    sweepdf = compute_cometa_sweep(taskdict, logdict, flowdict, params, cometaps, processes)
+    res['sweep'] = time.perf_counter() - t0
+
+    res['diffs'] = list()
+    t0 = time.perf_counter()
+    for k, cometap in enumerate(cometaps):
+        (cometadf, _, _, _) = compute_cometa(taskdict, logdict, flowdict, params, False, False, cometap=cometap)
+        paramdf = sweepdf[sweepdf.paramset == k]
+        for name in COMETA_NAMES + ['Active_conflicts']:
+            if not np.allclose(paramdf[name].values, cometadf[name].values, rtol=rtol, atol=rtol, equal_nan=True):
+                res['diffs'].append('%d.%s' % (k, name))
+    res['cometa'] = time.perf_counter() - t0
+    res['equal'] = len(res['diffs']) == 0
+    return res
+
+
+def compare_cometa_stream(testno=1, tmax=600, logpath=None, taskpath=None, rtol=1e-9):
+    """Computes COMETA for a test scenario tick by tick with a CometaStream,
+    and checks that every tick agrees with compute_cometa. Reports the mean
+    and maximum time per tick of the stream.
+    """
+    res = OD()
+    (logpath, taskpath) = get_test_paths(testno, logpath, taskpath)
+    taskdict, logdict, flowdict, params = util.prepare_data(logpath, taskpath, tmax)
+    (cometadf, _, _, _) = compute_cometa(taskdict, logdict, flowdict, params, False, False)
+
+    t0 = time.perf_counter()
+    streamdf = compute_cometa_stream(logpath, taskpath, tmax=tmax)
+    res['stream'] = time.perf_counter() - t0
+    res['ticks'] = len(streamdf)
+    res['tick'] = res['stream'] / max(len(streamdf), 1)
+
+    res['diffs'] = list()
+    if not np.array_equal(streamdf.time.values, cometadf.time.values):
+        res['diffs'].append('time')
+    else:
+        for name in COMETA_NAMES + ['Active_conflicts']:
+            if not np.allclose(streamdf[name].values, cometadf[name].values, rtol=rtol, atol=rtol, equal_nan=True):
+                res['diffs'].append(name)
+    res['equal'] = len(res['diffs']) == 0
+    return res
+
+
+def compare_queue_executor(testnos=range(1,5), tmax=600, workers=2, rtol=1e-9):
+    """Runs the batch jobs of the test scenarios in a temporary job queue
+    served by several run_worker processes, and checks that their results
+    agree with the ones of the local pool. Reports the time of both
+    executors."""
+    res = OD()
+    configs = list()
+    settings = runners.get_job_settings()
+    for testno in testnos:
+        (logpath, taskpath) = get_test_paths(testno)
+        flowspath = os.path.join(os.path.dirname(taskpath), 'Flows_' + os.path.basename(taskpath) + '.csv')
+        configs.append((logpath, taskpath, flowspath, os.path.dirname(logpath), tmax, False, settings))
+
+    t0 = time.perf_counter()
+    expected = runners._collect(runners.PoolExecutor().run(runners._cometa_file_worker, configs))
+    res['pool'] = time.perf_counter() - t0
+
+    with tempfile.TemporaryDirectory() as queuepath:
+        processes = [mp.Process(target=run_worker, args=(queuepath, 0.1)) for _ in range(workers)]
+        for process in processes:
+            process.start()
+        try:
+            t0 = time.perf_counter()
+            results = runners._collect(QueueExecutor(queuepath, poll=0.1).run(runners._cometa_file_worker, configs))
+            res['queue'] = time.perf_counter() - t0
+        finally:
+            for process in processes:
+                process.terminate()
+                process.join()
+
+    res['diffs'] = list()
+    for (result, expect) in zip(results, expected):
+        if result[0] != expect[0] or not _equal_frames(result[1], expect[1], rtol, COMETA_NAMES):
+            res['diffs'].append(expect[0])
+        elif list(result[3]) != list(expect[3]):
+            res['diffs'].append(expect[0] + '.conflicts')
+    res['equal'] = len(res['diffs']) == 0
+    return res
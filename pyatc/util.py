@@ -24,6 +24,7 @@ from collections import OrderedDict as OD
 from .parse import run as parse_log
 from .xml import load_xml, get_aircrafts_xml, get_routenames_xml
 from .geom import get_routes_crossingpoints
+from . import sky
 
 cnames1 = ['x_a1', 'y_a1','x_a2', 'y_a2','insector_a1','intime','isconflictinsector','Tc_a1', 'Tc_a2', 'Xc', 'Yc','A0_vdist_a1_a2_conflict', 'A0_hdist_a1_conflict','A1_dist_a1_a2','A2_hdist_conflict_sector', 'A3_angle','A4_hdist_conflict_crossingpoints','inconflict',]
 cnames2 = ['x_a1', 'y_a1','x_a2', 'y_a2','insector_a1','insector_a2']
@@ -136,6 +137,112 @@ def compute_aircraft_trjs(df, name, sector):
     return df
 
 
+def compute_all_aircraft_trjs(df, sector):
+    """Vectorized compute_aircraft_trjs for all the aircrafts in the calls
+    dataframe. The movement parameters and the insector property are computed
+    in a single pass over the whole dataframe, which is then split by aircraft
+    name. Returns an OrderedDict with the trajectory of each aircraft, in order
+    of appearance in the log.
+    """
+    # Keep the first record of each aircraft at each time, as deduplicate_df_column
+    dups = df.duplicated(subset=['name', 'time']) & ~pd.isnull(df['time'])
+    if dups.any():
+        df = df.loc[~dups, :]
+
+    # Sort the records by aircraft, in order of appearance, and then by time
+    (codes, names) = pd.factorize(df['name'])
+    order = np.lexsort((df['time'].values, codes))
+    codes = codes[order]
+    df = df.iloc[order]
+
+    # Set start at 0
+    df = df.assign(time=df['time'] - 1)
+    df = df.set_index(df.time, drop=False)
+    df.index.name = ''
+
+    # get movement parameters
+    df['v'] = df['speed'] / 3600 # nautic miles per second
+    df['vx'] = df['v'] * np.cos(df['heading'])
+    df['vy'] = df['v'] * np.sin(df['heading'])
+    # Fix zero x speed issue
+    df.loc[df['vx'] == 0, 'vx'] = 0.0001
+    df['vz'] = df['climb'] / 60 # feet per second
+    # Derivatives only between consecutive records of the same aircraft
+    samename = np.concatenate(([False], codes[1:] == codes[:-1]))
+    (z, t) = (df['z'].values, df['time'].values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vz_deriv = np.concatenate(([np.nan], (z[1:] - z[:-1]) / (t[1:] - t[:-1])))
+    df['vz_deriv'] = np.where(samename, vz_deriv, np.nan)
+
+    # compute aircraft predicted trajectory equations
+    df['m'] = df['vy'] / df['vx']
+    df['b'] = df['y'] - df['m']*df['x']
+
+    # Set insector property for all the trajectories with the same sector path
+    df['insector'] = is_point_insector(df['x'], df['y'], sector)
+
+    # Split the trajectories, each one is a contiguous block of records
+    bounds = np.concatenate(([0], np.flatnonzero(~samename[1:]) + 1, [len(df)]))
+    trajectories = OD()
+    for (name, start, stop) in zip(names, bounds[:-1], bounds[1:]):
+        trajectories[name] = df.iloc[start:stop].copy()
+    return trajectories
+
+
+def get_trajectories_lifetimes(trajectories):
+    """Returns an OrderedDict with the first and last time of each trajectory"""
+    lifetimes = OD()
+    for aname, trj in trajectories.items():
+        times = trj.index.values
+        lifetimes[aname] = (times[0], times[-1]) if len(times) > 0 else (np.inf, -np.inf)
+    return lifetimes
+
+
+def get_trajectories_altitude_bands(trajectories, tmax=600):
+    """Returns an OrderedDict with the lowest and highest altitude that each
+    aircraft can be predicted at, from any of its records and climb rates,
+    within tmax seconds."""
+    bands = OD()
+    for aname, trj in trajectories.items():
+        z = trj['z'].values.astype(float)
+        dz = trj['vz'].values.astype(float) * tmax
+        if np.all(np.isnan(z + dz)):
+            bands[aname] = (np.nan, np.nan)
+        else:
+            bands[aname] = (np.nanmin(z + np.minimum(dz, 0)), np.nanmax(z + np.maximum(dz, 0)))
+    return bands
+
+
+def compute_time_grid(trajectories):
+    """Aligns all the trajectories of a trial to a common time grid. Returns an
+    OrderedDict with the global time ticks ('time'), the aircraft names in the
+    order of trajectories ('aircrafts') and their row ('index'), and arrays
+    shaped (aircraft, time) with the presence of each aircraft in the log
+    ('inregion') and in the sector ('insector'), and its position ('x', 'y',
+    NaN when the aircraft is not present).
+    """
+    grid = OD()
+    names = list(trajectories.keys())
+    if len(names) == 0:
+        time = np.zeros(0)
+    else:
+        time = np.unique(np.concatenate([trj.index.values for trj in trajectories.values()]))
+    shape = (len(names), len(time))
+    grid['time'] = time
+    grid['aircrafts'] = names
+    grid['index'] = OD((aname, i) for i, aname in enumerate(names))
+    grid['x'] = np.full(shape, np.nan)
+    grid['y'] = np.full(shape, np.nan)
+    grid['insector'] = np.zeros(shape, dtype=bool)
+    for i, trj in enumerate(trajectories.values()):
+        pos = np.searchsorted(time, trj.index.values)
+        grid['x'][i, pos] = trj['x'].values
+        grid['y'][i, pos] = trj['y'].values
+        grid['insector'][i, pos] = trj['insector'].values == True
+    grid['inregion'] = ~np.isnan(grid['x'])
+    return grid
+
+
 ########################################################################
 ## Helpers for data and parameters extraction
 ########################################################################
@@ -145,7 +252,7 @@ def prepare_data(logpath='./data/file.xml.log', taskpath='./task', tmax=600, sav
     (logparent, logfile) = os.path.split(logpath)
 
     # Parse log file
-    logdict = parse_log(logpath, save2mat)
+    logdict = parse_log(logpath, save2mat, columnar=True)
 
     # Guess xml task file name: the filename pattern of log files is [TRIALNAME]_[TASKNAME].xml.log
     if taskpath is None:
@@ -163,25 +270,18 @@ def prepare_data(logpath='./data/file.xml.log', taskpath='./task', tmax=600, sav
     #else:
     #    (taskparent, taskfilename) = os.path.split(taskfilepath)
 
-    # Load the task dict from xml
-    taskdict = load_xml(taskfilepath)
-
     # Extract the name of the task from the xml filename (remove everything after the last dot)
     taskname = '.'.join(taskfilename.split('.')[:-1])
 
-    # Check whether flows file exists
+    # Load the task and flows files, compiled once and shared by all the logs of the task
     flowsname = 'Flows_' + taskname + '.xml.csv'
     flowspath = os.path.join(taskpath, flowsname)
-    if os.path.isfile(flowspath):
-        flowdict = parse_flows_file(flowspath, taskdict)
-    else:
-        #return None
-        # To try without flows at all, uncomment the following line and comment the previous
-        print('Warning, the flows file %s does not exists' % flowspath)
-        flowdict = OD()
+    compiled = sky.get_sky(taskfilepath, flowspath)
+    taskdict = compiled['taskdict']
+    flowdict = compiled['flowdict']
 
     # Fetch paramters fo the simulation
-    params = get_sky_parameters(taskdict, flowdict, tmax, taskpath, logfile)
+    params = sky.get_log_parameters(compiled, tmax, taskpath, logfile)
 
     return taskdict, logdict, flowdict, params
 
@@ -334,7 +434,7 @@ def is_conflict_insector(df, vertex):
     """Check whether spatial boundaries are fullfilled.
     """
     bbPath = mplPath.Path(vertex, closed=True)
-    points = np.array([df['Xc'],df['Yc']]).T
+    points = np.array([np.asarray(df['Xc']), np.asarray(df['Yc'])]).T
     return bbPath.contains_points(points, radius=1e-9)
 
 
@@ -342,7 +442,7 @@ def is_point_insector(x, y, vertex):
     """Check whether spatial boundaries are fullfilled.
     """
     bbPath = mplPath.Path(vertex, closed=True)
-    points = np.array([x,y]).T
+    points = np.array([np.asarray(x), np.asarray(y)]).T
     return bbPath.contains_points(points, radius=1e-9)
 
 
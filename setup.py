@@ -12,6 +12,9 @@ setup(
     license='LICENSE.txt',
     description='pyatc library',
     long_description=open('README.md').read(),
+    entry_points={
+        'console_scripts': ['pyatc = pyatc.__main__:main'],
+    },
     install_requires=[
         "numpy >= 1.8.1",
         "matplotlib >= 1.4",